@@ -1,24 +1,75 @@
 # Dice Parser
 # exports a yacc parser that parses dice codes from a string
+# the grammar compiles a message into an expression tree (see expression.py), which is then evaluated into the reply
 # dice codes are converted into result codes of the format [{]\d+(, \d+)*[}]([hl]\d+)?
 # where the numbers inside the braces are results of a set of rolls
 # and the [hl] followed by a number indicates to keep as many highest or lowest rolls
-
+# a numeric expression can be repeated with a count before it, like 6x 4d6kh3, or after it, like 4d6kh3 x6,
+# and is then compiled once and rolled once per repeat, after checking the repeats and dice are within their caps
+# the lexer and parser tables are generated ahead of time into lextab.py and parsetab.py,
+# so importing never builds tables or writes files. Run this module to regenerate them after changing the grammar
+# the lexer tables are checked against the token rules when they are loaded, and missing or stale ones raise TablesError
+# pratt.py is a hand-written engine for the same grammar,
+# selected with setEngine or the DICE_ENGINE environment variable
+# a DiceEngine owns its own lexer and parser, since a ply lexer and parser keep the state of the message being parsed,
+# so every thread parses with the engine of its own from currentEngine, and a parse never sees another's state
+# everything else a message is rolled with, like who rolls it and its budget, is given as a Context,
+# which sets it for the thread that runs the message
+
+from collections import OrderedDict
+import copy
+import importlib
 import logging
-from math import isnan, nan
+import os
 from ply import lex, yacc
-from signal import raise_signal, SIGABRT, signal
-from random import randint as rand
 import re
 import threading
+from time import perf_counter
+
+import audit
+import budget
+import metrics
+from budget import limit, Budget, ParserTimeoutError  # noqa: F401
+import render
+from expression import (
+	countDice,
+	countResults,
+	echoedLength,
+	evaluate,
+	Brackets,
+	Concatenation,
+	Dice,
+	Error,
+	Number,
+	Product,
+	Quotient,
+	Repeat,
+	Result,
+	Sum,
+	Text,
+	Unary,
+)
+import rolling
+from rolling import HIGHEST, LOWEST
 
-currentName = ""
 MAX_EXECUTION_SECONDS = 2
+MAX_DICE = 100000
+MAX_TOKENS = 10000
+MAX_CACHED_EXPRESSIONS = 1024
+MAX_REPEATS = 100
+MAX_REPEATED_DICE = 10000
+PLY, PRATT = "ply", "pratt"
+ENGINES = (PLY, PRATT)
+LEXER_TABLES = "lextab"
+PARSER_TABLES = "parsetab"
+TABLES_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
 
 log = logging.getLogger("parser")
+lexStage = metrics.stages["lex"]
+parseStage = metrics.stages["parse"]
+evaluateStage = metrics.stages["evaluate"]
 
 lexerRegexFlags = re.DOTALL | re.IGNORECASE | re.UNICODE | re.VERBOSE
-HIGHEST, LOWEST = range(2)
 
 tokens = [
 	"PLAINTEXT",
@@ -30,15 +81,43 @@ tokens = [
 	"OPEN",
 	"CLOSE",
 	"DIE",
+	"REPEAT",
+	"TIMES",
 ]
 
-t_PLAINTEXT = r'.+?'
+# a run of plain text stops wherever any other token could start:
+# before digits, operators and brackets, before a d that could start a die,
+# and before whitespace that an operator would swallow
+t_PLAINTEXT = r'''
+(?:
+	[^\s\d+\-*/{}[\]()d]
+|
+	(?<=\w)d
+|
+	d(?![1-9])
+|
+	(?<=\w)\d(?=\d*d[1-9])
+|
+	\s+(?![\s+\-*/{}[\]()])
+)+
+'''
 t_PLUS = r'\s*\+\s*'
 t_MINUS = r'\s*-\s*'
 t_MULTIPLY = r'\s*\*\s*'
 t_DIVIDE = r'\s*/\s*'
 t_OPEN = r"\s*[{[(]\s*"
-t_CLOSE = r"\s*[)\]}]\s*"
+# a closing bracket leaves the whitespace before a repeat count to the count, so the count can see what it follows
+t_CLOSE = r"\s*[)\]}](?:(?!\s+[x×][1-9])\s*)?"
+
+
+def t_REPEAT(t):
+	r'''
+	(?<![\w.])
+	[1-9]\d*
+	\s*[x×]\s+
+	(?=\d*d[1-9])
+	'''
+	return t
 
 
 def t_NUMBER(t):
@@ -49,12 +128,7 @@ def t_NUMBER(t):
 	)
 	(?!\d*d[1-9])
 	'''
-	m = t.lexer.lexmatch
-	val = m.group('num')
-	try:
-		t.value = int(val)
-	except ValueError:
-		t.value = float(val)
+	t.value = numberValue(t.lexer.lexmatch.group('num'))
 	return t
 
 
@@ -71,7 +145,30 @@ def t_DIE(t):
 		(?P<inclusive>[kd])?(?P<range>[hl])?(?P<rangeSize>\d+)?
 	)?
 	'''
-	data = t.lexer.lexmatch.groupdict()
+	t.value = dieValue(t.lexer.lexmatch.groupdict(), t.value)
+	return t
+
+
+def t_TIMES(t):
+	r'''
+	(?<=[\w)\]}])
+	\s*[x×][1-9]\d*
+	(?![\w.])
+	'''
+	return t
+
+
+def numberValue(text):
+	try:
+		return int(text)
+	except ValueError:
+		return float(text)
+
+
+def dieValue(data, code):
+	"""Converts the groups matched by t_DIE into the number of dice and sides, and which of them to keep.
+	code is the text that matched, kept so the die can be described as the user wrote it."""
+	data['code'] = code
 	data['numDice'] = int(data['numDice']) if data['numDice'] else 1
 	data['numSides'] = int(data['numSides'])
 	if data['modifier'].lower() == 'adv':
@@ -95,8 +192,23 @@ def t_DIE(t):
 			data['rangeSize'] = 0
 		if data['rangeSize'] > data['numDice']:
 			data['rangeSize'] = data['numDice']
-	t.value = data
-	return t
+	return data
+
+
+def repeat(numeric, before="", after=""):
+	"""Builds the node that repeats numeric as many times as the REPEAT or TIMES token before or after it says.
+	Raises ParserTimeoutError if the repeats, or the dice they would roll, are over their caps."""
+	repeats = int("".join(character for character in before + after if character.isdecimal()))
+	dice = repeats * countDice(numeric)
+	if repeats > MAX_REPEATS:
+		raise ParserTimeoutError(f"Exceeded the maximum of {MAX_REPEATS} repeats with {repeats} repeats.")
+	if dice > MAX_REPEATED_DICE:
+		raise ParserTimeoutError(f"Exceeded the maximum of {MAX_REPEATED_DICE} repeated dice with {dice} dice.")
+	return Repeat(numeric, repeats, before, after)
+
+
+class TablesError(Exception):
+	pass
 
 
 def t_error(t):
@@ -106,10 +218,43 @@ def t_error(t):
 	t.lexer.skip(1)
 
 
-lexer = lex.lex(reflags=lexerRegexFlags)
+def loadLexer(name=LEXER_TABLES):
+	"""Builds the lexer from its pre-generated tables, which are never written here.
+	Raises TablesError if the tables are missing, or were generated from other token rules than these."""
+	try:
+		tables = importlib.import_module(name)
+	except ImportError:
+		raise TablesError(f"The lexer tables {name} are missing. Generate them with `python DiceParser.py`.") from None
+	if not tablesMatch(tables):
+		raise TablesError(f"The lexer tables {name} are out of date. Regenerate them with `python DiceParser.py`.")
+	# given the module rather than its name, ply can not fall back to importing or writing the tables itself
+	return lex.lex(reflags=lexerRegexFlags, optimize=True, lextab=tables)
+
+
+def tablesMatch(tables):
+	"""Returns whether lexer tables were generated from the tokens, flags and token rules of this module."""
+	rules = {
+		name: rule.__doc__ if callable(rule) else rule
+		for name, rule in globals().items() if name.startswith("t_") and name != "t_error"
+	}
+	try:
+		patterns = "".join(pattern for state in tables._lexstatere.values() for pattern, names in state)
+		return (
+			tables._tabversion == lex.__tabversion__
+			and tables._lextokens == set(tokens)
+			and tables._lexreflags == int(lexerRegexFlags)
+			and all(f"(?P<{name}>{rule})" in patterns for name, rule in rules.items())
+		)
+	except AttributeError:
+		return False
+
+
+# run as a script, the lexer is built from the token rules instead, so stale tables can be regenerated
+lexer = lex.lex(reflags=lexerRegexFlags) if __name__ == '__main__' else loadLexer()
 
 precedence = (
 	('left', 'expr', 'OPEN', 'CLOSE'),
+	('left', 'TIMES'),
 	('left', 'PLUS', 'MINUS'),
 	('left', 'MULTIPLY', 'DIVIDE'),
 	('left', 'brackets', 'UNARY'),
@@ -119,8 +264,14 @@ precedence = (
 
 def p_expr2exprexpr(p):
 	'expr : expr expr %prec expr'
-	log.debug("Parsing expr concatination " + str(p[1:]))
-	p[0] = p[1] + p[2]
+	log.debug("Parsing expr concatination %s", p[1:])
+	# fragments are collected into a list while parsing, and frozen into a single Concatenation once parsing is done
+	parts = p[1] if isinstance(p[1], list) else [p[1]]
+	if isinstance(p[2], list):
+		parts += p[2]
+	else:
+		parts.append(p[2])
+	p[0] = parts
 
 
 def p_expr2PLAINTEXT(p):
@@ -131,112 +282,83 @@ def p_expr2PLAINTEXT(p):
 	| DIVIDE
 	| OPEN
 	| CLOSE %prec expr
+	| TIMES
 	'''
-	log.debug("Parsing elevation to expr " + str(p[1:]))
-	p[0] = p[1]
+	log.debug("Parsing elevation to expr %s", p[1:])
+	p[0] = Text(p[1])
 
 
 def p_expr2numeric(p):
 	'expr : numeric %prec expr'
-	log.debug("Parsing numeric to expr " + str(p[1:]))
-	text = p[1]['text']
-	if text.isdigit() or text == '[]':
-		p[0] = text
+	log.debug("Parsing numeric to expr %s", p[1:])
+	p[0] = Result(p[1])
+
+
+def p_expr2REPEAT(p):
+	'expr : REPEAT numeric %prec expr'
+	log.debug("Parsing repeat %s", p[1:])
+	p[0] = repeat(p[2], before=p[1])
+
+
+def p_expr2TIMES(p):
+	'expr : numeric TIMES'
+	log.debug("Parsing times %s", p[1:])
+	# repeating a numeric without dice would only print the same number again, so the count stays text
+	if countDice(p[1]):
+		p[0] = repeat(p[1], after=p[2])
 	else:
-		result = p[1]['result']
-		if isnan(result):
-			result = "[DIVISION BY ZERO]"
-		else:
-			result = f"{result:n}" if int(result) == result else f"{result:.2f}"
-			while "." in result and result[-1] == "0":
-				result = result[:-1]
-		p[0] = f"{p[1]['text']} = {result}"
+		p[0] = [Result(p[1]), Text(p[2])]
 
 
 def p_numeric2PLUSMINUS(p):
 	'''numeric : numeric PLUS numeric
 	| numeric MINUS numeric'''
-	log.debug("Parsing PLUSMINUS " + str(p[1:]))
-	if '-' in p[2]:
-		p[3]['result'] *= -1
-	text = p[1]['text'] + p[2] + p[3]['text']
-	result = p[1]['result'] + p[3]['result']
-	p[0] = dict(text=text, result=result)
+	log.debug("Parsing PLUSMINUS %s", p[1:])
+	p[0] = Sum(p[1], p[2], p[3])
 
 
 def p_numeric2MULTIPLY(p):
 	'numeric : numeric MULTIPLY numeric'
-	log.debug("Parsing multiply " + str(p[1:]))
-	text = p[1]['text'] + p[2] + p[3]['text']
-	result = p[1]['result'] * p[3]['result']
-	p[0] = dict(text=text, result=result)
+	log.debug("Parsing multiply %s", p[1:])
+	p[0] = Product(p[1], p[2], p[3])
 
 
 def p_numeric2DIVIDE(p):
 	'numeric : numeric DIVIDE numeric'
-	log.debug("Parsing divide " + str(p[1:]))
-	if p[3]['result']:
-		result = p[1]['result'] / p[3]['result']
-	else:
-		p[3]['text'] = f"~~{p[3]['text']}~~"
-		result = nan
-	text = p[1]['text'] + p[2] + p[3]['text']
-	p[0] = dict(text=text, result=result)
+	log.debug("Parsing divide %s", p[1:])
+	p[0] = Quotient(p[1], p[2], p[3])
 
 
 def p_numeric2UNARY_PLUSMINUS(p):
 	'''numeric : PLUS numeric
 	| MINUS numeric %prec UNARY'''
-	log.debug("Parsing unary operator " + str(p[1:]))
-	text = p[1] + p[2]['text']
-	result = p[2]['result']
-	if '-' in p[1]:
-		result *= -1
-	p[0] = dict(text=text, result=result)
+	log.debug("Parsing unary operator %s", p[1:])
+	p[0] = Unary(p[1], p[2])
 
 
 def p_numeric2NUMBER(p):
 	'numeric : NUMBER'
-	log.debug("Parsing number " + str(p[1:]))
-	result = p[1]
-	text = str(result)
-	p[0] = dict(text=text, result=result)
+	log.debug("Parsing number %s", p[1:])
+	p[0] = Number(p[1])
 
 
 def p_numeric2brackets(p):
 	'numeric : OPEN numeric CLOSE %prec brackets'
-	log.debug("Parsing brackets " + str(p[1:]))
-	text = p[1] + p[2]['text'] + p[3]
-	p[0] = dict(text=text, result=p[2]['result'])
+	log.debug("Parsing brackets %s", p[1:])
+	p[0] = Brackets(p[1], p[2], p[3])
 
 
 def p_numeric2DIE(p):
 	'numeric : DIE'
-	log.debug("Parsing die " + str(p[1:]))
+	log.debug("Parsing die %s", p[1:])
 	tok = p[1]
-	rolls = [randint(1, tok['numSides']) for i in range(tok['numDice'])]
-	text = str(rolls[0]) if len(rolls) == 1 else str(rolls)
-	rolls.sort()
-	max = tok['numDice']
-	min = 0
-	if tok['range'] == HIGHEST:
-		min = tok['numDice'] - tok['rangeSize']
-	else:
-		max = tok['rangeSize']
-	result = sum(rolls[min: max])
-	p[0] = dict(result=result, text=text)
-
-
-def randint(low, high):
-	res = rand(low, high)
-	log.info(f"{currentName} rolled {res}/{high}")
-	return res
+	p[0] = Dice(tok['numDice'], tok['numSides'], tok['range'], tok['rangeSize'], tok['code'])
 
 
 def p_expr2error(p):
 	'expr : error'
-	log.debug("Parsing error " + str(p[1:]))
-	p[0] = '**<ERROR>**'
+	log.debug("Parsing error %s", p[1:])
+	p[0] = Error()
 
 
 def p_error(p):
@@ -248,24 +370,188 @@ def p_error(p):
 		log.error("Parser ran out of tokens to parse.")
 
 
-class ParserTimeoutError(Exception):
-	pass
-
-
-def SIGABRT_handler(*args, **kwargs):
-	raise ParserTimeoutError(f"Exceeded maximum execution time for parsing of {MAX_EXECUTION_SECONDS} seconds.")
-
-
-def timedParse(*args, **kwargs):
-	timer = threading.Timer(MAX_EXECUTION_SECONDS, raise_signal, args=(SIGABRT,))
-	timer.start()
-	try:
-		return original_parser(*args, **kwargs)
-	finally:
-		timer.cancel()
-
+class Context:
+	"""What a message is rolled with: the name its rolls are audited under, the source its dice are rolled from,
+	its budget, and the audit log its rolls are recorded to. Whatever is left out stays as it is on the thread,
+	except the budget, which is a fresh one of MAX_EXECUTION_SECONDS, MAX_DICE and MAX_TOKENS."""
+
+	def __init__(self, user=None, source=None, budget=None, auditLog=None):
+		self.user = user
+		self.source = source
+		self.budget = budget
+		self.auditLog = auditLog
+
+	def run(self, function, *args, **kwargs):
+		"""Calls function within this context, on this thread. Raises ParserTimeoutError as soon as the budget runs out.
+		Rolls are formatted within a fresh output budget of the characters one reply can show."""
+		spending = self.budget or Budget(MAX_EXECUTION_SECONDS, MAX_DICE, MAX_TOKENS)
+		with limit(spending), render.limit(render.Output(render.replyCharacters())):
+			if self.user is None and self.auditLog is None and self.source is None:
+				# the thread's own roller and source need no setting, which keeps plain budgeted calls cheap
+				return function(*args, **kwargs)
+			with audit.rolledBy(self.user, self.auditLog), rolling.using(self.source or rolling.current()):
+				return function(*args, **kwargs)
+
+
+def budgeted(function, *args, **kwargs):
+	"""Calls function under a fresh budget of MAX_EXECUTION_SECONDS, MAX_DICE and MAX_TOKENS.
+	Raises ParserTimeoutError as soon as any of them runs out.
+	Rolls are formatted within a fresh output budget of the characters one reply can show."""
+	return Context().run(function, *args, **kwargs)
+
+
+class DiceEngine:
+	"""Compiles and rolls messages with a lexer and parser of its own, with the engine called name,
+	or else the selected one. An engine parses one message at a time, so each thread takes its own from currentEngine."""
+
+	def __init__(self, name=None):
+		self.name = name or engine
+		self.lexer = lexer.clone()
+		# a shallow copy shares the read-only tables, but keeps the stacks of its parses to itself
+		self.tables = copy.copy(tables)
+		if self.name == PRATT:
+			import pratt
+			self.compiler = pratt.compileExpression
+		else:
+			self.compiler = lambda text: compileWithTables(text, self.lexer, self.tables)
+
+	def compile(self, text):
+		"""Parses a message into an expression tree without rolling any dice.
+		Returns None if the message could not be parsed at all."""
+		return self.compiler(text)
+
+	def parse(self, text, context=None):
+		"""Compiles and rolls a message, within context or else a default one."""
+		return (context or Context()).run(lambda: rollExpression(self.compile(text)))
+
+
+def currentEngine():
+	"""Returns the DiceEngine of this thread, making one with the selected engine on first use, or after setEngine."""
+	current = getattr(engines, 'engine', None)
+	if current is None or current.name != engine:
+		current = engines.engine = DiceEngine()
+	return current
+
+
+def compileExpression(text):
+	"""Parses a message into an expression tree without rolling any dice, with the engine of this thread.
+	Returns None if the message could not be parsed at all."""
+	return currentEngine().compile(text)
+
+
+def compileWithTables(text, lexer=None, tables=None, **kwargs):
+	"""Compiles a message with a ply lexer and the generated LALR tables, by default those of the engine of this thread.
+	The whole message is lexed before parsing starts, so the two stages are timed separately."""
+	if lexer is None or tables is None:
+		lexer = lexer or currentEngine().lexer
+		tables = tables or currentEngine().tables
+	spendToken = budget.current().spendTokens
+	start = perf_counter()
+	lexer.input(text)
+	tokens = []
+	for tok in iter(lexer.token, None):
+		spendToken()
+		tokens.append(tok)
+	lexed = perf_counter()
+	lexStage.observe(lexed - start)
+	tokens = iter(tokens)
+	expression = tables.parse(None, lexer=lexer, tokenfunc=lambda: next(tokens, None), **kwargs)
+	parseStage.observe(perf_counter() - lexed)
+	return Concatenation(tuple(expression)) if isinstance(expression, list) else expression
+
+
+def rollExpression(expression):
+	"""Evaluates a compiled expression, auditing its rolls as a single message.
+	Room for its results and the text it echoes is reserved before its rolls are formatted."""
+	start = perf_counter()
+	render.current().reserveEchoed(echoedLength(expression), countResults(expression))
+	name, auditLog = audit.current()
+	with auditLog.message(name):
+		result = evaluate(expression)
+	evaluateStage.observe(perf_counter() - start)
+	return result
+
+
+def parse(text, **kwargs):
+	# ply options such as another lexer can only be honoured by the tables
+	return rollExpression(compileWithTables(text, **kwargs) if kwargs else compileExpression(text))
+
+
+def budgetedParse(*args, **kwargs):
+	return budgeted(parse, *args, **kwargs)
+
+
+class ExpressionCache:
+	"""A bounded LRU cache of compiled expressions keyed by message text.
+	A hit skips lexing and parsing entirely, so only the dice are rolled again."""
+
+	def __init__(self, maxsize=MAX_CACHED_EXPRESSIONS):
+		self.maxsize = maxsize
+		self.expressions = OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def get(self, text):
+		with self.lock:
+			if text in self.expressions:
+				self.hits += 1
+				self.expressions.move_to_end(text)
+				return self.expressions[text]
+			self.misses += 1
+		expression = compileExpression(text)
+		with self.lock:
+			self.expressions[text] = expression
+			while len(self.expressions) > self.maxsize:
+				self.expressions.popitem(last=False)
+				self.evictions += 1
+		return expression
+
+	def clear(self):
+		with self.lock:
+			self.expressions.clear()
+
+	def stats(self):
+		return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, size=len(self.expressions))
+
+
+class LocalParser:
+	"""Parses and rolls messages with the engine of the calling thread, so one can be shared by every thread."""
+
+	def parse(self, text, context=None):
+		return currentEngine().parse(text, context)
+
+
+def writeTables(outputdir=TABLES_DIRECTORY):
+	"""Regenerates the lexer and parser tables from the token rules and grammar of this module."""
+	lex.lex(reflags=lexerRegexFlags).writetab(LEXER_TABLES, outputdir)
+	# the parser tables are only rewritten when their signature no longer matches the grammar
+	yacc.yacc(debug=False, tabmodule=PARSER_TABLES, outputdir=outputdir)
+
+
+# stale parser tables are rebuilt in memory, but never written at import
+# the lexer and tables are only the templates that every DiceEngine copies, and never parse anything themselves
+tables = yacc.yacc(debug=False, write_tables=False, tabmodule=PARSER_TABLES, outputdir=TABLES_DIRECTORY)
+parser = LocalParser()
+expressionCache = ExpressionCache()
+engines = threading.local()
+
+
+def setEngine(name):
+	"""Selects the engine that compiles messages. Both engines compile every message into the same expression tree.
+	Every thread makes a new DiceEngine with the selected engine the next time it compiles a message."""
+	global engine
+	if name not in ENGINES:
+		raise ValueError(f"Unknown parser engine {name!r}. Use one of {', '.join(ENGINES)}.")
+	if name == PRATT:
+		# the pratt engine is built from the token rules of this module, so it can only be imported once they exist
+		import pratt  # noqa: F401
+	engine = name
+
+
+setEngine(os.environ.get("DICE_ENGINE", PLY))
+
 
-parser = yacc.yacc()
-original_parser = parser.parse
-parser.parse = timedParse
-signal(SIGABRT, SIGABRT_handler)
+if __name__ == '__main__':
+	writeTables()
@@ -0,0 +1,224 @@
+# Audit
+# records rolls into an append-only binary file of fixed-width records
+# records are buffered in memory, and written to the file in bulk by a background thread,
+# so auditing never blocks rolling on disk
+# the granularity decides how much is recorded:
+# DIE writes one record per die, MESSAGE writes one record per message with the number and total of its dice,
+# and OFF records nothing
+# a pool rolled as counts of each face writes one record per face instead of one per die,
+# with the number of dice that landed on the face and their total
+# sides, counts and totals too big for their fields saturate at the largest value the field holds,
+# and are decoded as at least that value
+# the name that rolls are recorded under, and the log they go to, are kept per thread and set with rolledBy,
+# so messages rolled at the same time on different threads are never recorded under each other's names
+# run this module with the path of an audit file to decode it back to text
+
+import argparse
+import atexit
+from contextlib import contextmanager
+import logging
+import os
+import struct
+import threading
+import time
+
+DIE, MESSAGE, OFF = "die", "message", "off"
+GRANULARITIES = (DIE, MESSAGE, OFF)
+MAGIC = b"DMAUDIT1"
+RECORD = struct.Struct("<d32sIIq")
+MAX_RECORDED_COUNT = MAX_RECORDED_SIDES = 2**32 - 1
+MAX_RECORDED_VALUE = 2**63 - 1
+NAME_BYTES = 32
+FLUSH_BYTES = 64 * 1024
+FLUSH_SECONDS = 1.0
+
+log = logging.getLogger(__name__)
+
+
+class AuditLog:
+	def __init__(self, path=None, granularity=OFF, flushBytes=FLUSH_BYTES, flushSeconds=FLUSH_SECONDS):
+		if granularity not in GRANULARITIES:
+			raise ValueError(f"Unknown audit granularity {granularity!r}. Use one of {', '.join(GRANULARITIES)}.")
+		if path is None and granularity != OFF:
+			raise ValueError("An audit file is needed unless auditing is off.")
+		self.path = path
+		self.granularity = granularity
+		self.flushBytes = flushBytes
+		self.flushSeconds = flushSeconds
+		self.buffer = bytearray()
+		self.lock = threading.Lock()
+		self.writing = threading.Lock()
+		self.messages = threading.local()
+		self.wake = threading.Event()
+		self.closed = False
+		self.writer = None
+		if granularity != OFF:
+			self.writer = threading.Thread(target=self.writeForever, name="audit writer", daemon=True)
+			self.writer.start()
+
+	def recordRolls(self, name, numSides, rolls):
+		"""Records a pool of rolls at the configured granularity."""
+		if self.granularity == DIE:
+			now = time.time()
+			name = encodeName(name)
+			numSides = min(numSides, MAX_RECORDED_SIDES)
+			self.append(b"".join(RECORD.pack(now, name, numSides, 1, min(roll, MAX_RECORDED_VALUE)) for roll in rolls))
+		elif self.granularity == MESSAGE:
+			self.recordPool(name, numSides, len(rolls), sum(rolls))
+
+	def recordCounts(self, name, numSides, counts):
+		"""Records a pool rolled as how many dice landed on each face, lowest face first, at the configured granularity."""
+		if self.granularity == DIE:
+			now = time.time()
+			name = encodeName(name)
+			numSides = min(numSides, MAX_RECORDED_SIDES)
+			self.append(b"".join(
+				RECORD.pack(now, name, numSides, min(count, MAX_RECORDED_COUNT), min(face * count, MAX_RECORDED_VALUE))
+				for face, count in enumerate(counts, 1) if count
+			))
+		elif self.granularity == MESSAGE:
+			self.recordPool(name, numSides, sum(counts), sum(face * count for face, count in enumerate(counts, 1)))
+
+	def recordPool(self, name, numSides, count, total):
+		tally = getattr(self.messages, 'tally', None)
+		if tally is None:
+			self.append(pack(name, numSides, count, total))
+		else:
+			tally[0] += count
+			tally[1] += total
+
+	@contextmanager
+	def message(self, name):
+		"""Collects every roll made inside the block into a single record when the granularity is MESSAGE."""
+		if self.granularity != MESSAGE or getattr(self.messages, 'tally', None) is not None:
+			yield
+			return
+		tally = self.messages.tally = [0, 0]
+		try:
+			yield
+		finally:
+			self.messages.tally = None
+			if tally[0]:
+				self.append(pack(name, 0, tally[0], tally[1]))
+
+	def append(self, data):
+		with self.lock:
+			self.buffer += data
+			full = len(self.buffer) >= self.flushBytes
+		if full:
+			self.wake.set()
+
+	def writeForever(self):
+		while not self.closed:
+			self.wake.wait(self.flushSeconds)
+			self.wake.clear()
+			self.flush()
+
+	def flush(self):
+		with self.writing:
+			with self.lock:
+				data, self.buffer = self.buffer, bytearray()
+			if not data:
+				return
+			try:
+				with open(self.path, "ab") as file:
+					if file.tell() == 0:
+						file.write(MAGIC)
+					file.write(data)
+			except OSError as e:
+				log.error(f"{e!r} when writing {len(data) // RECORD.size} audit records to {self.path}.")
+
+	def close(self):
+		self.closed = True
+		self.wake.set()
+		if self.writer:
+			self.writer.join()
+		self.flush()
+
+
+def encodeName(name):
+	return name.encode("utf-8")[:NAME_BYTES]
+
+
+def pack(name, numSides, count, value):
+	"""Packs a record stamped with the current time, saturating the fields that are too big for the record."""
+	return RECORD.pack(
+		time.time(), encodeName(name),
+		min(numSides, MAX_RECORDED_SIDES), min(count, MAX_RECORDED_COUNT), min(value, MAX_RECORDED_VALUE),
+	)
+
+
+def atLeast(value, limit):
+	return f"{value}+" if value >= limit else str(value)
+
+
+def readRecords(path):
+	"""Yields the (timestamp, name, numSides, count, value) records of an audit file."""
+	with open(path, "rb") as file:
+		if file.read(len(MAGIC)) != MAGIC:
+			raise ValueError(f"{path} is not an audit file.")
+		while True:
+			data = file.read(RECORD.size * 1024)
+			if not data:
+				return
+			whole = len(data) // RECORD.size * RECORD.size
+			for timestamp, name, numSides, count, value in RECORD.iter_unpack(data[:whole]):
+				yield timestamp, name.rstrip(b"\0").decode("utf-8", errors="replace"), numSides, count, value
+
+
+def formatRecord(timestamp, name, numSides, count, value):
+	when = time.strftime("%b %d %H:%M:%S", time.localtime(timestamp))
+	value = atLeast(value, MAX_RECORDED_VALUE)
+	sides = atLeast(numSides, MAX_RECORDED_SIDES)
+	if count == 1 and numSides:
+		return f"{when} {name} rolled {value}/{sides}"
+	count = atLeast(count, MAX_RECORDED_COUNT)
+	dice = f"{count}d{sides}" if numSides else f"{count} dice"
+	return f"{when} {name} rolled {dice} totalling {value}"
+
+
+auditLog = AuditLog()
+state = threading.local()
+
+
+def current():
+	"""Returns the name that rolls on this thread are recorded under, and the audit log they are recorded to."""
+	return getattr(state, 'name', ""), getattr(state, 'log', None) or auditLog
+
+
+@contextmanager
+def rolledBy(name=None, log=None):
+	"""Records the rolls of this thread under name, into log, for the duration of the block.
+	Either left out stays as it was, and the log is otherwise the one that configure set up."""
+	previous = getattr(state, 'name', ""), getattr(state, 'log', None)
+	if name is not None:
+		state.name = name
+	if log is not None:
+		state.log = log
+	try:
+		yield
+	finally:
+		state.name, state.log = previous
+
+
+def configure(path=None, granularity=OFF):
+	global auditLog
+	auditLog.close()
+	auditLog = AuditLog(path, granularity)
+	return auditLog
+
+
+@atexit.register
+def closeAuditLog():
+	auditLog.close()
+
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description="Decodes an audit file of rolls to text.")
+	argparser.add_argument("path", help="The audit file to decode.")
+	args = argparser.parse_args()
+	try:
+		for record in readRecords(args.path):
+			print(formatRecord(*record))
+	except BrokenPipeError:
+		os._exit(0)
@@ -0,0 +1,5 @@
+import sys
+
+from benchmarks.messages import main
+
+sys.exit(main())
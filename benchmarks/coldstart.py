@@ -0,0 +1,77 @@
+# Cold start benchmark
+# times how long a fresh interpreter takes to import each entry point,
+# once with the pre-generated lexer and parser tables, and once with the tables rebuilt at import
+# run with `python -m benchmarks.coldstart` from the root of the repository
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ("DiceParser", "cli", "workers", "discordUI")
+TABLES = ("lextab.py", "parsetab.py")
+RUNS = 10
+
+
+def timeImport(module, path, workdir):
+	"""Returns the seconds a fresh interpreter takes to import module from path, excluding the interpreter's own start."""
+	environment = dict(os.environ, PYTHONPATH=path, PYTHONDONTWRITEBYTECODE="1")
+	script = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+	child = subprocess.run(
+		[sys.executable, "-c", script],
+		cwd=workdir, env=environment, check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+	)
+	return float(child.stdout.split()[-1])
+
+
+def copyWithoutTables(destination):
+	shutil.copytree(
+		ROOT, destination,
+		ignore=shutil.ignore_patterns(".git", "__pycache__", "benchmarks", "tests", *TABLES),
+	)
+
+
+def removeTables(path):
+	for table in TABLES:
+		try:
+			os.remove(os.path.join(path, table))
+		except FileNotFoundError:
+			pass
+
+
+def benchmark(modules, runs):
+	"""Returns (module, seconds with tables, seconds without tables) rows of median import times."""
+	rows = []
+	with tempfile.TemporaryDirectory() as workdir:
+		bare = os.path.join(workdir, "bare")
+		copyWithoutTables(bare)
+		for module in modules:
+			withTables = []
+			withoutTables = []
+			for i in range(runs):
+				withTables.append(timeImport(module, ROOT, workdir))
+				removeTables(bare)
+				withoutTables.append(timeImport(module, bare, workdir))
+			rows.append((module, statistics.median(withTables), statistics.median(withoutTables)))
+	return rows
+
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description="Times the cold start import of each entry point.")
+	argparser.add_argument(
+		"modules",
+		nargs="*", default=MODULES,
+		help="The modules to import. Defaults to every entry point.",
+	)
+	argparser.add_argument("--runs", type=int, default=RUNS, help=f"Imports to time per module. Defaults to {RUNS}.")
+	args = argparser.parse_args()
+	print(f"{'module':<12} {'tables':>10} {'no tables':>10} {'saved':>10}")
+	for module, withTables, withoutTables in benchmark(args.modules, args.runs):
+		print(
+			f"{module:<12} {withTables * 1000:>8.1f}ms {withoutTables * 1000:>8.1f}ms "
+			f"{(withoutTables - withTables) * 1000:>8.1f}ms"
+		)
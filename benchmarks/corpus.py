@@ -0,0 +1,87 @@
+# Corpus
+# generates a repeatable corpus of realistic messages for the benchmarks, grouped into categories
+# every message is drawn from a seeded generator, so the same seed always gives the same corpus
+
+from collections import namedtuple
+from random import Random
+
+Author = namedtuple("Author", "id display_name")
+
+WORDS = (
+	"the", "goblin", "and", "I", "draw", "my", "sword", "hidden", "behind", "door", "dragon", "breathes",
+	"fire", "across", "old", "road", "wizard", "mutters", "ancient", "words", "paladin", "dodges", "under",
+	"guard", "heads", "toward", "tavern", "need", "a", "drink", "did", "anyone", "bring", "rations", "today",
+	"sounds", "good", "lol", "ok", "d&d", "at", "8pm", "tomorrow", "2nd", "floor", "3-4", "players",
+)
+SHORT = (
+	"d20", "d20+5", "2d6+3", "d20adv+7", "d20dis", "4d6kh3", "d100", "3d8+d6+4", "(d8+3)*2", "1d4-1",
+	"attack for d20+6", "hits for 2d6+4 damage", "save: d20+3", "initiative d20+2",
+)
+ALIASES = dict(
+	att="does a d20+6 attack with his sword.",
+	axe="hits with his axe for d10+4 damage!",
+	stat="4d6kh3",
+	fireball="casts fireball for 8d6 fire damage, dex save 15",
+	sneak="stabs for d20adv+7 then d6+3d6+4",
+)
+USERS = tuple(Author(1000 + i, f"player {i}") for i in range(20))
+CATEGORIES = ("chat", "short", "roleplay", "pools", "brackets", "aliases")
+
+
+def chat(random):
+	return " ".join(random.choice(WORDS) for i in range(random.randint(3, 25)))
+
+
+def short(random):
+	return random.choice(SHORT)
+
+
+def roleplay(random):
+	sentences = []
+	for i in range(random.randint(4, 12)):
+		sentence = chat(random)
+		if random.random() < 0.3:
+			sentence += f" for {random.choice(SHORT)}"
+		sentences.append(sentence.capitalize() + ".")
+	return " ".join(sentences)
+
+
+def pools(random):
+	numDice = random.choice((1000, 5000, 20000, 50000))
+	numSides = random.choice((6, 10, 20, 100))
+	modifier = random.choice(("", f"kh{numDice // 2}", f"kl{numDice // 10}", "dl1"))
+	return f"rolls {numDice}d{numSides}{modifier}"
+
+
+def brackets(random):
+	expression = random.choice(("d6", "2d8", "4", "d20"))
+	for i in range(random.randint(5, 40)):
+		expression = f"({expression}{random.choice('+-*/')}{random.choice(('d4', '2', 'd6', '3'))})"
+	return f"deals {expression} damage"
+
+
+def aliases(random):
+	return "!" + random.choice(tuple(ALIASES))
+
+
+GENERATORS = dict(chat=chat, short=short, roleplay=roleplay, pools=pools, brackets=brackets, aliases=aliases)
+
+
+def weighted(seed=0, count=1000, weights=None):
+	"""Returns count (category, author, text) tuples, with each category drawn in proportion to its weight."""
+	random = Random(seed)
+	weights = weights or dict.fromkeys(CATEGORIES, 1)
+	categories = random.choices(tuple(weights), tuple(weights.values()), k=count)
+	return [(category, random.choice(USERS), GENERATORS[category](random)) for category in categories]
+
+
+def messages(seed=0, perCategory=200, categories=CATEGORIES):
+	"""Returns (category, author, text) tuples, with perCategory messages from each category, in a shuffled order."""
+	random = Random(seed)
+	corpus = [
+		(category, random.choice(USERS), GENERATORS[category](random))
+		for category in categories
+		for i in range(perCategory)
+	]
+	random.shuffle(corpus)
+	return corpus
@@ -0,0 +1,258 @@
+# Gateway load test
+# feeds messages into discordUI.on_message through stand-ins for discord's client, message, author and channel objects,
+# without connecting to discord
+# each message is dispatched as its own task at its scheduled time, like the gateway dispatches events,
+# and its latency is measured from when it was scheduled, so a backlog counts against the bot
+# rather than hiding in the load generator
+# a monitor task measures how late the event loop wakes it, which is how long the loop was blocked
+# messages are either generated from the seeded corpus of corpus.py, at a fixed rate,
+# or replayed from an anonymised capture: a JSON lines file of records like
+# {"at": 1.25, "guild": 3, "author": 17, "content": "hits for d8+3"}
+# where at is the seconds since the start of the capture, and guild and author are stand-in ids
+# run with `python -m benchmarks.gateway`, and pass arguments for discordUI after --, like `-- --workers 4`
+
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import sys
+import tempfile
+
+from benchmarks import corpus
+from benchmarks.messages import seed, setUpDatabase, summarise
+from budget import ParserTimeoutError
+import database
+import scheduler
+
+MESSAGES = 2000
+RATE = 500
+CONCURRENCY = 100
+GUILDS = 50
+SEED = 0
+SPEED = 1
+LAG_INTERVAL = 0.005
+
+
+class Author:
+	def __init__(self, id, name):
+		self.id = id
+		self.display_name = name
+		self.bot = False
+
+
+class Channel:
+	def __init__(self, id):
+		self.id = id
+		self.name = f"channel {id}"
+		self.replies = 0
+
+	async def send(self, content):
+		self.replies += 1
+
+
+class Message:
+	def __init__(self, author, channel, content, due):
+		self.author = author
+		self.channel = channel
+		self.content = content
+		# the loop time the message was scheduled for
+		self.due = due
+		self.handled = asyncio.Event()
+
+
+def syntheticTraffic(count, rate, guilds, seedValue):
+	"""Returns (seconds after start, guild, author, content) tuples of corpus messages at a steady rate.
+	A rate of zero sends every message at once."""
+	categories = len(corpus.CATEGORIES)
+	messages = corpus.messages(seedValue, -(-count // categories))[:count]
+	return [
+		(i / rate if rate else 0, author.id % guilds, author.id, text)
+		for i, (category, author, text) in enumerate(messages)
+	]
+
+
+def capturedTraffic(path, speed):
+	with open(path) as file:
+		records = [json.loads(line) for line in file if line.strip()]
+	return [
+		(record["at"] / speed, record["guild"], record["author"], record["content"])
+		for record in records
+	]
+
+
+class Gateway:
+	"""Dispatches traffic to on_message, at most concurrency messages at a time, and records how the bot kept up."""
+
+	def __init__(self, onMessage, concurrency=CONCURRENCY):
+		self.onMessage = onMessage
+		self.slots = asyncio.Semaphore(concurrency)
+		self.channels = {}
+		self.authors = {}
+		self.latencies = []
+		self.lags = []
+		self.timeouts = 0
+		self.tasks = set()
+
+	async def run(self, traffic):
+		loop = asyncio.get_running_loop()
+		monitor = asyncio.create_task(self.monitor())
+		start = loop.time()
+		for at, guild, author, content in traffic:
+			due = start + at
+			delay = due - loop.time()
+			if delay > 0:
+				await asyncio.sleep(delay)
+			await self.slots.acquire()
+			task = asyncio.create_task(self.handle(Message(self.author(author), self.channel(guild), content, due)))
+			self.tasks.add(task)
+			task.add_done_callback(self.tasks.discard)
+		await asyncio.gather(*self.tasks)
+		duration = loop.time() - start
+		monitor.cancel()
+		return duration
+
+	async def handle(self, message):
+		try:
+			if await self.onMessage(message) == scheduler.QUEUED:
+				await message.handled.wait()
+		except ParserTimeoutError:
+			self.timeouts += 1
+		finally:
+			self.latencies.append(asyncio.get_running_loop().time() - message.due)
+			self.slots.release()
+
+	def finishing(self, handle):
+		"""Wraps the handler of a scheduler, to tell handle when a worker is done with a queued message."""
+		async def handleQueued(message):
+			try:
+				await handle(message)
+			except ParserTimeoutError:
+				self.timeouts += 1
+			finally:
+				message.handled.set()
+		return handleQueued
+
+	async def monitor(self):
+		loop = asyncio.get_running_loop()
+		while True:
+			expected = loop.time() + LAG_INTERVAL
+			await asyncio.sleep(LAG_INTERVAL)
+			self.lags.append(max(0.0, loop.time() - expected))
+
+	def author(self, id):
+		if id not in self.authors:
+			self.authors[id] = Author(id, f"player {id}")
+		return self.authors[id]
+
+	def channel(self, id):
+		if id not in self.channels:
+			self.channels[id] = Channel(id)
+		return self.channels[id]
+
+	def results(self, duration):
+		replies = sum(channel.replies for channel in self.channels.values())
+		return dict(
+			messages=len(self.latencies),
+			seconds=duration,
+			throughput=len(self.latencies) / duration if duration else 0.0,
+			replies=replies,
+			timeouts=self.timeouts,
+			timeoutRate=self.timeouts / len(self.latencies) if self.latencies else 0.0,
+			latency=summarise(self.latencies),
+			loopLag=dict(summarise(self.lags), max=max(self.lags) * 1e6) if len(self.lags) > 1 else None,
+		)
+
+
+async def runGateway(discordUI, traffic, concurrency):
+	"""Sets up discordUI and feeds it traffic. Returns the Gateway, and how many seconds the traffic took."""
+	await discordUI.setup_hook()
+	try:
+		gateway = Gateway(discordUI.on_message, concurrency)
+		if discordUI.messageScheduler:
+			# replies are sent by the workers of the scheduler, after on_message has returned
+			discordUI.messageScheduler.handle = gateway.finishing(discordUI.messageScheduler.handle)
+		return gateway, await gateway.run(traffic)
+	finally:
+		if discordUI.messageScheduler:
+			discordUI.messageScheduler.close()
+		if discordUI.pool:
+			discordUI.pool.close()
+
+
+async def loadTest(discordUI, traffic, concurrency):
+	gateway, duration = await runGateway(discordUI, traffic, concurrency)
+	return gateway.results(duration)
+
+
+def report(results):
+	latency = results["latency"]
+	lines = [
+		f"{results['messages']} messages in {results['seconds']:.2f}s: {results['throughput']:.0f} msgs/s, "
+		f"{results['replies']} replies, {results['timeouts']} timeouts ({results['timeoutRate']:.2%})",
+		f"reply latency   p50 {latency['p50']:>10.0f}µs  p95 {latency['p95']:>10.0f}µs  p99 {latency['p99']:>10.0f}µs",
+	]
+	lag = results["loopLag"]
+	if lag:
+		lines.append(
+			f"event loop lag  p50 {lag['p50']:>10.0f}µs  p95 {lag['p95']:>10.0f}µs  p99 {lag['p99']:>10.0f}µs  "
+			f"max {lag['max']:.0f}µs"
+		)
+	return lines
+
+
+def main(argv=None):
+	argparser = argparse.ArgumentParser(
+		description="Load tests discordUI.on_message with a fake gateway. Arguments after -- are passed to discordUI."
+	)
+	argparser.add_argument("--messages", type=int, default=MESSAGES, help=f"Synthetic messages. Defaults to {MESSAGES}.")
+	argparser.add_argument(
+		"--rate",
+		type=float, default=RATE,
+		help=f"Synthetic messages per second, or 0 to send them all at once. Defaults to {RATE}.",
+	)
+	argparser.add_argument(
+		"--concurrency",
+		type=int, default=CONCURRENCY,
+		help=f"The most messages being handled at once. Defaults to {CONCURRENCY}.",
+	)
+	argparser.add_argument(
+		"--guilds",
+		type=int, default=GUILDS,
+		help=f"Guilds to spread synthetic messages across. Defaults to {GUILDS}.",
+	)
+	argparser.add_argument("--seed", type=int, default=SEED, help=f"Seeds the corpus and the dice. Defaults to {SEED}.")
+	argparser.add_argument("--replay", help="Replay this anonymised capture instead of synthetic messages.")
+	argparser.add_argument(
+		"--speed",
+		type=float, default=SPEED,
+		help="Replay the capture this many times faster than it was recorded. Defaults to 1.",
+	)
+	argparser.add_argument("--output", help="Write the results to this JSON file.")
+	argparser.add_argument("discordUI", nargs=argparse.REMAINDER, help="Arguments for discordUI, after --.")
+	args = argparser.parse_args(argv)
+
+	# discordUI reads its own arguments when it is imported
+	sys.argv = ["discordUI", *(arg for arg in args.discordUI if arg != "--")]
+	discordUI = importlib.import_module("discordUI")
+	logging.getLogger("main").handlers.clear()
+	seed(args.seed)
+	if args.replay:
+		traffic = capturedTraffic(args.replay, args.speed)
+	else:
+		traffic = syntheticTraffic(args.messages, args.rate, args.guilds, args.seed)
+
+	# a file database, unlike one in memory, is shared with worker processes, and syncs to disk like the real one
+	with tempfile.TemporaryDirectory() as directory:
+		setUpDatabase(f"sqlite:///{os.path.join(directory, 'aliases.sqlite3')}")
+		results = asyncio.run(loadTest(discordUI, traffic, args.concurrency))
+		database.engine.dispose()
+	print("\n".join(report(results)))
+	if args.output:
+		with open(args.output, "w") as file:
+			json.dump(results, file, indent="\t")
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,186 @@
+# Message benchmark
+# times the parser, and mice.handleInput end to end, over a seeded corpus of realistic messages (see corpus.py)
+# aliases live in an in memory database, and the dice are seeded, so repeated runs do the same work
+# reports throughput and p50/p95/p99 latency per category, and writes them as JSON,
+# which a later run can compare itself against with --baseline
+# run with `python -m benchmarks` from the root of the repository
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import platform
+import statistics
+import sys
+from time import perf_counter
+
+from benchmarks import corpus
+import database
+from db.models import Alias
+import DiceParser
+import mice
+import rolling
+
+PASSES = 3
+PER_CATEGORY = 200
+SEED = 0
+TOLERANCE = 0.1
+
+
+def seed(value):
+	rolling.setSource(rolling.FAST, value)
+
+
+def setUpDatabase(url="sqlite:///:memory:"):
+	Alias.metadata.create_all(database.configure(url))
+	for author in corpus.USERS:
+		for name, definition in corpus.ALIASES.items():
+			database.addAlias(author.id, name, definition)
+
+
+def parse(author, text):
+	return DiceParser.budgeted(DiceParser.compileExpression, text)
+
+
+def handleInput(author, text):
+	return mice.handleInput(author, text)
+
+
+def timeStage(function, messages, passes, threads=1):
+	"""Returns a dict of categories to the latencies in seconds of calling function on each of their messages.
+	The caches are emptied before each pass, so every pass starts cold like a fresh bot.
+	With several threads, the messages are shared out between them, and each thread parses with its own engine."""
+	def timed(message):
+		category, author, text = message
+		start = perf_counter()
+		function(author, text)
+		return category, perf_counter() - start
+
+	latencies = {}
+	with ThreadPoolExecutor(threads) as executor:
+		for i in range(passes):
+			DiceParser.expressionCache.clear()
+			mice.aliasIndex.clear()
+			for category, latency in executor.map(timed, messages) if threads > 1 else map(timed, messages):
+				latencies.setdefault(category, []).append(latency)
+	return latencies
+
+
+def summarise(latencies):
+	"""Returns the count, throughput and percentile latencies in microseconds of a list of latencies."""
+	percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+	return dict(
+		count=len(latencies),
+		throughput=len(latencies) / sum(latencies),
+		p50=percentiles[49] * 1e6,
+		p95=percentiles[94] * 1e6,
+		p99=percentiles[98] * 1e6,
+	)
+
+
+def benchmark(seedValue=SEED, perCategory=PER_CATEGORY, passes=PASSES, engine=DiceParser.PLY, threads=1):
+	DiceParser.setEngine(engine)
+	setUpDatabase()
+	messages = corpus.messages(seedValue, perCategory)
+	results = {}
+	for stage, function in (("parse", parse), ("handleInput", handleInput)):
+		seed(seedValue)
+		latencies = timeStage(function, messages, passes, threads)
+		latencies["all"] = [latency for category in corpus.CATEGORIES for latency in latencies[category]]
+		results[stage] = {category: summarise(values) for category, values in latencies.items()}
+	return dict(
+		meta=dict(
+			seed=seedValue,
+			perCategory=perCategory,
+			passes=passes,
+			engine=engine,
+			threads=threads,
+			numpy=rolling.numpy is not None,
+			python=platform.python_version(),
+		),
+		results=results,
+	)
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+	"""Returns lines comparing results to a baseline, and whether any latency or throughput regressed by more than
+	the tolerance."""
+	lines = [f"{'stage':<12} {'category':<10} {'metric':<10} {'baseline':>10} {'now':>10} {'change':>8}"]
+	regressed = False
+	for stage, categories in results["results"].items():
+		for category, metrics in categories.items():
+			before = baseline["results"].get(stage, {}).get(category)
+			if before is None:
+				continue
+			for metric in ("throughput", "p50", "p95", "p99"):
+				change = metrics[metric] / before[metric] - 1
+				# throughput is better higher, and latencies are better lower
+				worse = -change if metric == "throughput" else change
+				flag = ""
+				if worse > tolerance:
+					regressed = True
+					flag = " slower"
+				lines.append(
+					f"{stage:<12} {category:<10} {metric:<10} {before[metric]:>10.1f} {metrics[metric]:>10.1f} "
+					f"{change:>+8.1%}{flag}"
+				)
+	return lines, regressed
+
+
+def report(results):
+	lines = [f"{'stage':<12} {'category':<10} {'msgs/s':>10} {'p50 µs':>10} {'p95 µs':>10} {'p99 µs':>10}"]
+	for stage, categories in results["results"].items():
+		for category, metrics in categories.items():
+			lines.append(
+				f"{stage:<12} {category:<10} {metrics['throughput']:>10.0f} {metrics['p50']:>10.1f} "
+				f"{metrics['p95']:>10.1f} {metrics['p99']:>10.1f}"
+			)
+	return lines
+
+
+def main(argv=None):
+	argparser = argparse.ArgumentParser(description="Times the parser and handleInput over a corpus of messages.")
+	argparser.add_argument("--seed", type=int, default=SEED, help=f"Seeds the corpus and the dice. Defaults to {SEED}.")
+	argparser.add_argument(
+		"--messages",
+		type=int, default=PER_CATEGORY,
+		help=f"Messages per category. Defaults to {PER_CATEGORY}.",
+	)
+	argparser.add_argument(
+		"--passes",
+		type=int, default=PASSES,
+		help=f"Times to run through the corpus. Defaults to {PASSES}.",
+	)
+	argparser.add_argument("--engine", choices=DiceParser.ENGINES, default=DiceParser.PLY, help="The parser engine.")
+	argparser.add_argument(
+		"--threads",
+		type=int, default=1,
+		help="Share the messages out between this many threads, to time parsing concurrently. Defaults to 1.",
+	)
+	argparser.add_argument("--output", help="Write the results to this JSON file.")
+	argparser.add_argument("--baseline", help="Compare the results against this JSON file from an earlier run.")
+	argparser.add_argument(
+		"--tolerance",
+		type=float, default=TOLERANCE,
+		help=f"The fraction a metric may get worse by before it counts as a regression. Defaults to {TOLERANCE}.",
+	)
+	args = argparser.parse_args(argv)
+	# parse errors in the corpus are expected, and are still formatted, but never printed
+	logging.getLogger().addHandler(logging.NullHandler())
+
+	results = benchmark(args.seed, args.messages, args.passes, args.engine, args.threads)
+	print("\n".join(report(results)))
+	if args.output:
+		with open(args.output, "w") as file:
+			json.dump(results, file, indent="\t")
+	if args.baseline:
+		with open(args.baseline) as file:
+			lines, regressed = compare(results, json.load(file), args.tolerance)
+		print()
+		print("\n".join(lines))
+		return 1 if regressed else 0
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,53 @@
+# Precheck benchmark
+# times mice.hasDice against a plain diceRegex.search over a corpus where most messages have no dice,
+# like the traffic of a busy server
+# run with `python -m benchmarks.precheck` from the root of the repository
+
+import argparse
+from time import perf_counter
+
+from benchmarks import corpus
+import mice
+
+MESSAGES = 20000
+NO_DICE_SHARE = 0.9
+SEED = 0
+PASSES = 5
+
+
+def mix(noDiceShare):
+	"""Weights chat, which never has dice, against the categories of messages that do."""
+	withDice = ("short", "roleplay", "pools", "brackets")
+	return dict(chat=noDiceShare, **dict.fromkeys(withDice, (1 - noDiceShare) / len(withDice)))
+
+
+def timeCheck(check, texts, passes):
+	"""Returns the fastest of several passes of check over texts, in nanoseconds per message."""
+	best = None
+	for i in range(passes):
+		start = perf_counter()
+		for text in texts:
+			check(text)
+		elapsed = perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best / len(texts) * 1e9
+
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description="Times the check for dice codes that runs on every message.")
+	argparser.add_argument("--messages", type=int, default=MESSAGES, help=f"Defaults to {MESSAGES}.")
+	argparser.add_argument(
+		"--no-dice",
+		type=float, default=NO_DICE_SHARE,
+		help=f"The share of messages without dice. Defaults to {NO_DICE_SHARE}.",
+	)
+	argparser.add_argument("--seed", type=int, default=SEED, help=f"Defaults to {SEED}.")
+	argparser.add_argument("--passes", type=int, default=PASSES, help=f"Defaults to {PASSES}.")
+	args = argparser.parse_args()
+	texts = [text for category, author, text in corpus.weighted(args.seed, args.messages, mix(args.no_dice))]
+	if any(bool(mice.diceRegex.search(text)) != mice.hasDice(text) for text in texts):
+		raise AssertionError("hasDice disagrees with diceRegex on the corpus.")
+	regex = timeCheck(mice.diceRegex.search, texts, args.passes)
+	fast = timeCheck(mice.hasDice, texts, args.passes)
+	print(f"diceRegex.search {regex:>8.0f}ns per message")
+	print(f"hasDice          {fast:>8.0f}ns per message, {regex / fast:.1f}x faster")
@@ -0,0 +1,170 @@
+# Shards load test
+# runs the launcher of launcher.py against a stub gateway, to see how throughput scales with processes,
+# without connecting to discord
+# every process identifies each of its shards through the shared IdentifyGate, like it would before connecting,
+# and is then fed the messages of the guilds of its shards by the Gateway of gateway.py,
+# so the same seeded traffic is split between the processes the way discord would split it
+# run with `python -m benchmarks.shards --processes 1 2 4`, and pass arguments for discordUI after --
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+
+from benchmarks import gateway
+from benchmarks.messages import seed, setUpDatabase, summarise
+import database
+import launcher
+
+PROCESSES = (1, 2, 4)
+SHARDS = 8
+IDENTIFY_SECONDS = 0.1
+
+
+def shardTraffic(traffic, shardIds, shardCount):
+	"""Returns the messages of traffic from guilds of shardIds, treating the stand-in guild ids as snowflakes."""
+	shardIds = set(shardIds)
+	return [
+		message for message in traffic
+		if launcher.shardOf(message[1] << launcher.SNOWFLAKE_TIME_SHIFT, shardCount) in shardIds
+	]
+
+
+async def runStub(discordUI, traffic, concurrency):
+	"""Identifies every shard of discordUI, then load tests it with traffic. Returns the results of the Gateway,
+	with the seconds after the start of the process that each shard identified at."""
+	shardIds = discordUI.args.shard_ids
+	start = time.time()
+	identified = []
+	for shardId in shardIds:
+		await discordUI.client.before_identify_hook(shardId, initial=shardId == shardIds[0])
+		identified.append(time.time() - start)
+	stub, duration = await gateway.runGateway(discordUI, traffic, concurrency)
+	return dict(
+		stub.results(duration), latencies=stub.latencies, shards=launcher.formatShardIds(shardIds), identified=identified,
+	)
+
+
+def stubShards(arguments, gate, sharded, databaseUrl, settings, directory):
+	"""Runs in a process of the launcher instead of connecting to discord, and writes its results into directory."""
+	discordUI = launcher.importBot(arguments, gate, sharded)
+	logging.getLogger("main").handlers.clear()
+	database.configure(databaseUrl)
+	seed(settings["seed"])
+	traffic = gateway.syntheticTraffic(settings["messages"], settings["rate"], settings["guilds"], settings["seed"])
+	traffic = shardTraffic(traffic, discordUI.args.shard_ids, discordUI.args.shard_count)
+	results = asyncio.run(runStub(discordUI, traffic, settings["concurrency"]))
+	with open(os.path.join(directory, f"results.{results['shards']}.json"), "w") as file:
+		json.dump(results, file)
+
+
+def loadTest(processes, shardCount, arguments, settings, identifySeconds=IDENTIFY_SECONDS):
+	"""Launches processes stub processes over shardCount shards, and returns the results of each, and of them all."""
+	with tempfile.TemporaryDirectory() as directory:
+		url = f"sqlite:///{os.path.join(directory, 'aliases.sqlite3')}"
+		setUpDatabase(url)
+		database.engine.dispose()
+		arguments = ["--log-file", os.path.join(directory, "log.log"), *arguments]
+		codes = launcher.launch(
+			arguments, processes, shardCount,
+			target=stubShards, targetArgs=(url, settings, directory), identifySeconds=identifySeconds,
+		)
+		shards = []
+		for shardIds in launcher.shardRanges(shardCount, processes):
+			path = os.path.join(directory, f"results.{launcher.formatShardIds(shardIds)}.json")
+			if os.path.exists(path):
+				with open(path) as file:
+					shards.append(json.load(file))
+	if not shards:
+		raise RuntimeError(f"every stub process failed, with exit codes {codes}")
+	latencies = [latency for results in shards for latency in results.pop("latencies")]
+	seconds = max(results["seconds"] for results in shards)
+	return dict(
+		processes=len(shards),
+		messages=len(latencies),
+		seconds=seconds,
+		throughput=len(latencies) / seconds if seconds else 0.0,
+		latency=summarise(latencies),
+		shards=shards,
+	)
+
+
+def report(results):
+	latency = results["latency"]
+	lines = [
+		f"{results['processes']} processes: {results['messages']} messages in {results['seconds']:.2f}s, "
+		f"{results['throughput']:.0f} msgs/s, reply latency p50 {latency['p50']:.0f}µs p99 {latency['p99']:.0f}µs",
+	]
+	for shard in results["shards"]:
+		identified = ", ".join(f"{seconds:.2f}s" for seconds in shard["identified"])
+		lines.append(
+			f"  shards {shard['shards']}: {shard['messages']} messages, {shard['throughput']:.0f} msgs/s, "
+			f"identified at {identified}"
+		)
+	return lines
+
+
+def main(argv=None):
+	argparser = argparse.ArgumentParser(
+		description="Load tests the launcher with a stub gateway. Arguments after -- are passed to discordUI."
+	)
+	argparser.add_argument(
+		"--processes",
+		type=int, nargs="+", default=PROCESSES,
+		help=f"Test with each of these numbers of processes. Defaults to {' '.join(map(str, PROCESSES))}.",
+	)
+	argparser.add_argument("--shards", type=int, default=SHARDS, help=f"Shards in all. Defaults to {SHARDS}.")
+	argparser.add_argument(
+		"--messages",
+		type=int, default=gateway.MESSAGES,
+		help=f"Synthetic messages. Defaults to {gateway.MESSAGES}.",
+	)
+	argparser.add_argument(
+		"--rate",
+		type=float, default=0,
+		help="Synthetic messages per second, or 0 to send them all at once. Defaults to 0.",
+	)
+	argparser.add_argument(
+		"--concurrency",
+		type=int, default=gateway.CONCURRENCY,
+		help=f"The most messages each process handles at once. Defaults to {gateway.CONCURRENCY}.",
+	)
+	argparser.add_argument(
+		"--guilds",
+		type=int, default=gateway.GUILDS,
+		help=f"Guilds to spread synthetic messages across. Defaults to {gateway.GUILDS}.",
+	)
+	argparser.add_argument(
+		"--identify-seconds",
+		type=float, default=IDENTIFY_SECONDS,
+		help=f"Seconds between identifies, instead of discord's {launcher.IDENTIFY_SECONDS}. "
+		f"Defaults to {IDENTIFY_SECONDS}.",
+	)
+	argparser.add_argument(
+		"--seed",
+		type=int, default=gateway.SEED,
+		help=f"Seeds the corpus and the dice. Defaults to {gateway.SEED}.",
+	)
+	argparser.add_argument("--output", help="Write the results to this JSON file.")
+	argparser.add_argument("discordUI", nargs=argparse.REMAINDER, help="Arguments for discordUI, after --.")
+	args = argparser.parse_args(argv)
+
+	arguments = [arg for arg in args.discordUI if arg != "--"]
+	settings = dict(
+		messages=args.messages, rate=args.rate, guilds=args.guilds, seed=args.seed, concurrency=args.concurrency,
+	)
+	runs = []
+	for processes in args.processes:
+		results = loadTest(processes, args.shards, arguments, settings, args.identify_seconds)
+		print("\n".join(report(results)))
+		runs.append(results)
+	if args.output:
+		with open(args.output, "w") as file:
+			json.dump(runs, file, indent="\t")
+
+
+if __name__ == '__main__':
+	main()
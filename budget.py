@@ -0,0 +1,66 @@
+# Budget
+# a cooperative limit on the work done for a single message
+# the lexer spends a token per token, evaluation spends a step per expression node, and rolling spends a die per die
+# every spend checks the limits, so an expensive message raises ParserTimeoutError
+# at the same point no matter which thread it runs on, without signals or timer threads
+# the active budget is kept per thread, so parses on different threads never share one
+
+from contextlib import contextmanager
+from math import inf
+import threading
+from time import perf_counter
+
+CHECK_TIME_EVERY = 64
+
+
+class ParserTimeoutError(Exception):
+	pass
+
+
+class Budget:
+	def __init__(self, seconds=inf, dice=inf, tokens=inf):
+		self.seconds = seconds
+		self.deadline = perf_counter() + seconds
+		self.dice = dice
+		self.tokens = tokens
+		self.steps = 0
+
+	def checkTime(self):
+		if perf_counter() >= self.deadline:
+			raise ParserTimeoutError(f"Exceeded maximum execution time for parsing of {self.seconds} seconds.")
+
+	def step(self):
+		self.steps += 1
+		if not self.steps % CHECK_TIME_EVERY:
+			self.checkTime()
+
+	def spendTokens(self, count=1):
+		self.tokens -= count
+		if self.tokens < 0:
+			raise ParserTimeoutError("Exceeded the maximum number of tokens for parsing.")
+		self.checkTime()
+
+	def spendDice(self, count):
+		self.dice -= count
+		if self.dice < 0:
+			raise ParserTimeoutError("Exceeded the maximum number of dice for parsing.")
+		self.checkTime()
+
+
+UNLIMITED = Budget()
+state = threading.local()
+
+
+def current():
+	return getattr(state, 'budget', UNLIMITED)
+
+
+@contextmanager
+def limit(budget):
+	"""Makes budget the active budget of this thread for the duration of the block."""
+	previous = current()
+	state.budget = budget
+	try:
+		yield budget
+	finally:
+		state.budget = previous
@@ -0,0 +1,164 @@
+# Database
+# owns the engine and sessions of the alias database, and the queries the bot runs against it
+# sessions are scoped with context managers, so every session is committed or rolled back, and always closed
+# file databases are opened in WAL mode with a busy timeout,
+# so readers never wait for a writer and a locked database is retried instead of failing at once
+# alias lookups are baked queries and writes are prebuilt statements,
+# so their SQL is only compiled once, and sqlite reuses the prepared statement of each
+# every query runs on a single database thread, so the threads that evaluate messages never share a connection,
+# and a query called from any other thread is handed to the database thread, which the caller waits on
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+import os
+import threading
+
+from sqlalchemy import and_, bindparam, create_engine, event
+from sqlalchemy.ext import baked
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from db.models import Alias
+import metrics
+
+DATABASE_URL = "sqlite:///db/db.sqlite3"
+BUSY_TIMEOUT_SECONDS = 5
+PRAGMAS = (
+	("journal_mode", "WAL"),
+	# in WAL mode a commit is still atomic and durable against crashes of the bot without syncing every commit
+	("synchronous", "NORMAL"),
+	("foreign_keys", "ON"),
+	("temp_store", "MEMORY"),
+)
+
+bakery = baked.bakery()
+aliasTable = Alias.__table__
+insertAlias = aliasTable.insert().values(
+	user=bindparam("user"),
+	name=bindparam("name"),
+	definition=bindparam("definition"),
+)
+# sqlite replaces the row with the same user and name, if there is one
+upsertAlias = aliasTable.insert().prefix_with("OR REPLACE").values(
+	user=bindparam("user"),
+	name=bindparam("name"),
+	definition=bindparam("definition"),
+)
+deleteAlias = aliasTable.delete().where(and_(
+	aliasTable.c.user == bindparam("user"),
+	aliasTable.c.name == bindparam("name"),
+))
+
+
+def createEngine(url=DATABASE_URL):
+	if url in ("sqlite://", "sqlite:///:memory:"):
+		# an in memory database only lives as long as its connection, so every thread has to share that one
+		return create_engine(url, connect_args=dict(check_same_thread=False), poolclass=StaticPool)
+	engine = create_engine(url, connect_args=dict(timeout=BUSY_TIMEOUT_SECONDS))
+	event.listen(engine, "connect", setPragmas)
+	return engine
+
+
+def setPragmas(connection, record):
+	cursor = connection.cursor()
+	for name, value in PRAGMAS:
+		cursor.execute(f"PRAGMA {name}={value}")
+	cursor.close()
+
+
+def configure(url=DATABASE_URL):
+	"""Replaces the engine and session factory, such as with an in memory database for tests."""
+	global engine, Session
+	engine = createEngine(url)
+	Session = sessionmaker(bind=engine)
+	return engine
+
+
+@contextmanager
+def session():
+	"""Opens a session for the block, which is committed if the block succeeds and rolled back if it raises."""
+	scoped = Session()
+	try:
+		yield scoped
+		scoped.commit()
+	except BaseException:
+		scoped.rollback()
+		raise
+	finally:
+		scoped.close()
+
+
+state = threading.local()
+
+
+def startExecutor():
+	"""Starts the database thread, which is also needed again in a forked process, since threads do not survive a fork."""
+	global executor
+	executor = ThreadPoolExecutor(1, thread_name_prefix="database", initializer=markDatabaseThread)
+
+
+def markDatabaseThread():
+	state.isDatabaseThread = True
+
+
+def onDatabaseThread(function):
+	"""Makes every call to function run on the database thread, waiting for its result when called from another."""
+	@wraps(function)
+	def call(*args):
+		if getattr(state, 'isDatabaseThread', False):
+			return function(*args)
+		return executor.submit(function, *args).result()
+
+	return call
+
+
+@onDatabaseThread
+@metrics.timed("database")
+def aliasesOf(userId):
+	"""Returns the aliases of a user as a dict of alias names to definitions."""
+	query = bakery(lambda session: session.query(Alias.name, Alias.definition))
+	query += lambda query: query.filter(Alias.user == bindparam("user"))
+	with session() as scoped:
+		return dict(query(scoped).params(user=userId))
+
+
+def findDefinition(scoped, userId, name):
+	query = bakery(lambda session: session.query(Alias.definition))
+	query += lambda query: query.filter(Alias.user == bindparam("user"), Alias.name == bindparam("name"))
+	row = query(scoped).params(user=userId, name=name).first()
+	return row.definition if row else None
+
+
+@onDatabaseThread
+@metrics.timed("database")
+def addAlias(userId, name, definition):
+	with session() as scoped:
+		scoped.execute(insertAlias, dict(user=userId, name=name, definition=definition))
+
+
+@onDatabaseThread
+@metrics.timed("database")
+def upsertAliases(userId, aliases):
+	"""Defines or redefines many aliases of a user, given as a dict of names to definitions, in one transaction."""
+	with session() as scoped:
+		scoped.execute(upsertAlias, [
+			dict(user=userId, name=name, definition=definition) for name, definition in aliases.items()
+		])
+
+
+@onDatabaseThread
+@metrics.timed("database")
+def removeAlias(userId, name):
+	"""Deletes an alias of a user, and returns its definition, or None if the user had no such alias."""
+	with session() as scoped:
+		definition = findDefinition(scoped, userId, name)
+		if definition is not None:
+			scoped.execute(deleteAlias, dict(user=userId, name=name))
+		return definition
+
+
+startExecutor()
+if hasattr(os, 'register_at_fork'):
+	os.register_at_fork(after_in_child=startExecutor)
+configure()
@@ -1,20 +1,34 @@
 #! /usr/bin/python3.8
 import argparse
+import asyncio
+import audit
+from concurrent.futures import ThreadPoolExecutor
 import discord
 from dotenv import load_dotenv
 import logging
 import os
 from sys import stdout
+from time import perf_counter
 
-from DiceParser import ParserTimeoutError
 import DiceParser
+from DiceParser import ParserTimeoutError
+import launcher
+import metrics
+import mice
 from mice import handleInput
+import render
+import rolling
+import scheduler
+import workers
 
+METRICS_FILE_SECONDS = 15
+MAX_ATTACHMENT_BYTES = 64 * 1024
 GUILD_GREETING = """
 I am your dice mice, ready to roll.
 Just type your dice codes, and I'll echo your message back with the dice already rolled.
 For more help, check out https://github.com/BeastlyTheos//Dice-Mice
 """
+QUEUE_KEYS = ("channel", "guild")
 
 argparser = argparse.ArgumentParser()
 argparser.add_argument(
@@ -22,31 +36,190 @@ argparser.add_argument(
 	action='count', default=0,
 	help="Increase the output verbosity. Can be used up to 3 times.",
 )
+argparser.add_argument(
+	"--audit",
+	choices=audit.GRANULARITIES, default=audit.OFF,
+	help="Record every die, or one summary per message, to the audit file. Off by default.",
+)
+argparser.add_argument(
+	"--audit-file",
+	default="rolls.audit",
+	help="The append-only binary file that rolls are audited to. Decode it with `python -m audit <file>`.",
+)
+argparser.add_argument(
+	"--workers",
+	type=int, default=0,
+	help="Evaluate messages in this many worker processes, instead of on the event loop. Off by default.",
+)
+argparser.add_argument(
+	"--deadline",
+	type=float, default=workers.DEADLINE_SECONDS,
+	help=f"Kill and replace a worker that takes longer than this many seconds on one message. "
+	f"Defaults to {workers.DEADLINE_SECONDS}.",
+)
+argparser.add_argument(
+	"--queue-workers",
+	type=int, default=scheduler.WORKERS,
+	help="Handle messages with this many async workers, taking turns between the queues of the channels, "
+	"and evaluate them on as many threads. "
+	f"0 handles every message as it arrives. Defaults to {scheduler.WORKERS}.",
+)
+argparser.add_argument(
+	"--queue-size",
+	type=int, default=scheduler.QUEUE_SIZE,
+	help="The most messages one queue holds. Further messages are turned away until it catches up. "
+	f"Defaults to {scheduler.QUEUE_SIZE}.",
+)
+argparser.add_argument(
+	"--queue-by",
+	choices=QUEUE_KEYS, default="channel",
+	help="Queue messages per channel, or per guild so a busy guild only gets one turn however many channels it has. "
+	"Direct messages are always queued per channel. Defaults to channel.",
+)
+argparser.add_argument(
+	"--engine",
+	choices=DiceParser.ENGINES, default=DiceParser.engine,
+	help="The engine that parses messages. Both give the same replies. Defaults to $DICE_ENGINE, or else ply.",
+)
+argparser.add_argument(
+	"--rng",
+	choices=rolling.SOURCES, default=rolling.FAST,
+	help="Roll dice from a fast seedable generator, or from the operating system's secure one. Defaults to fast.",
+)
+argparser.add_argument(
+	"--seed",
+	type=int,
+	help="Seed the fast generator, to roll the same dice on every run. Worker processes are never seeded.",
+)
+argparser.add_argument(
+	"--split-replies",
+	action="store_true",
+	help=f"Split replies over {render.MESSAGE_LIMIT} characters into up to {render.MAX_SPLIT_MESSAGES} messages, "
+	"rather than cutting them short.",
+)
+argparser.add_argument(
+	"--shard-count",
+	type=int,
+	help="Run as an AutoShardedClient with this many shards in all, or 0 for as many as discord recommends. "
+	"Runs one unsharded client by default. See launcher.py to run the shards in several processes.",
+)
+argparser.add_argument(
+	"--shard-ids",
+	type=launcher.parseShardIds,
+	help="Only run these of the shards, written like 0-3,8. Log, audit and metrics files are named after them, "
+	"and the metrics port is offset by the first of them. Needs --shard-count.",
+)
+argparser.add_argument(
+	"--log-file",
+	default="log.log",
+	help="The file to log to. Defaults to log.log.",
+)
+argparser.add_argument(
+	"--admin",
+	type=int, action="append", default=[],
+	help="The discord user id of an admin, who may use admin commands like !metrics. Can be given many times.",
+)
+argparser.add_argument(
+	"--metrics-port",
+	type=int,
+	help="Serve metrics for Prometheus at http://127.0.0.1:<port>/metrics. Off by default.",
+)
+argparser.add_argument(
+	"--metrics-file",
+	help="Rewrite this file with metrics in the Prometheus text format every "
+	f"{METRICS_FILE_SECONDS} seconds, for the node exporter's textfile collector. Off by default.",
+)
 args = argparser.parse_args()
+if args.shard_ids and not args.shard_count:
+	argparser.error("--shard-ids needs --shard-count")
+
+
+def perShard(path):
+	"""Names a file after the shards of this process, so every process of the launcher writes its own."""
+	if not args.shard_ids:
+		return path
+	root, extension = os.path.splitext(path)
+	return f"{root}.shards{launcher.formatShardIds(args.shard_ids)}{extension}"
+
 
 logging.basicConfig(
 	level=40 - 10 * args.verbose,
-	filename="log.log",
+	filename=perShard(args.log_file),
 	format="{levelname} from {name}. {message} on {asctime}. In {filename}, {funcName} line {lineno}",
 	datefmt="%b %d %H:%M",
 	style="{",
 )
 log = logging.getLogger("main")
 log.addHandler(logging.StreamHandler(stdout))
+audit.configure(perShard(args.audit_file), args.audit)
+DiceParser.setEngine(args.engine)
+try:
+	rolling.setSource(args.rng, args.seed)
+except ValueError as e:
+	argparser.error(str(e))
+mice.admins.update(args.admin)
+render.setSplit(args.split_replies)
 
 load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
-intents = discord.Intents.default()
-intents.message_content = True
-client = discord.Client(intents=intents)
+pool = None
+# shared with the other processes of the launcher, to space out the identifies of all their shards
+identifyGate = None
+messageScheduler = None
+messageCounter = metrics.counters["messages"]
+timeoutCounter = metrics.counters["timeouts"]
+errorCounter = metrics.counters["errors"]
+sendStage = metrics.stages["send"]
+# messages are evaluated off the event loop, on threads of their own rather than the database thread,
+# so a slow roll never holds up a query, and the queries a message needs are handed to the database thread
+evaluator = ThreadPoolExecutor(args.queue_workers or None, thread_name_prefix="evaluate")
+
+
+async def setup_hook():
+	global pool, messageScheduler
+	if args.workers:
+		pool = workers.EvaluationPool(args.workers, args.deadline)
+		pool.start()
+	if args.queue_workers:
+		messageScheduler = scheduler.Scheduler(handleMessage, args.queue_workers, args.queue_size)
+		messageScheduler.start()
+		metrics.gauges["scheduler"] = messageScheduler.stats
+	if args.metrics_port:
+		metrics.serve(args.metrics_port + (args.shard_ids[0] if args.shard_ids else 0))
+	if args.metrics_file:
+		# the loop only keeps a weak reference to its tasks
+		client.metricsWriter = asyncio.create_task(writeMetrics(perShard(args.metrics_file)))
+	metrics.gauges["shards"] = shardStats
+
+
+async def writeMetrics(path):
+	loop = asyncio.get_running_loop()
+	while True:
+		await loop.run_in_executor(None, metrics.writeFile, path)
+		await asyncio.sleep(METRICS_FILE_SECONDS)
+
+
+def shardStats():
+	stats = dict(shards=len(args.shard_ids or ()) or client.shard_count or 1, guilds=len(client.guilds))
+	if args.shard_ids:
+		stats.update(first=args.shard_ids[0])
+	if client.latency == client.latency and client.latency != float("inf"):
+		stats.update(latency=client.latency)
+	return stats
+
+
+async def before_identify_hook(shardId, *, initial=False):
+	"""Waits for the turn of a shard to identify, across every process of the launcher if there are several."""
+	if identifyGate:
+		await identifyGate.wait(shardId)
+	elif not initial:
+		await asyncio.sleep(launcher.IDENTIFY_SECONDS)
 
 
-@client.event
 async def on_ready():
 	print("connected.")
 
 
-@client.event
 async def on_guild_join(guild):
 	log.info(f"joinned {guild.name=}")
 	channel = guild.system_channel
@@ -59,19 +232,63 @@ async def on_guild_join(guild):
 	log.info(f"sent greeting to {channel.name=}")
 
 
-@client.event
+async def evaluate(author, content):
+	"""Handles a message on an evaluation thread, and returns the reply without blocking the event loop."""
+	return await asyncio.get_running_loop().run_in_executor(evaluator, handleInput, author, content)
+
+
+async def readAttachments(msg):
+	"""Returns the text of the small text files attached to a message, each on lines of its own."""
+	texts = []
+	for attachment in msg.attachments:
+		if attachment.size <= MAX_ATTACHMENT_BYTES:
+			texts.append("\n" + (await attachment.read()).decode("utf-8", errors="replace"))
+	return "".join(texts)
+
+
+def queueKey(msg):
+	"""The queue a message waits in, which is its guild's when queueing by guild, or else its channel's."""
+	if args.queue_by == "guild" and msg.guild:
+		return ("guild", msg.guild.id)
+	return ("channel", msg.channel.id)
+
+
 async def on_message(msg):
+	if msg.author.bot:
+		return "bot message"
+	messageCounter.inc()
+	log.info(f"Received {msg.content=} from {msg.author.display_name}")
+	if not messageScheduler:
+		return await handleMessage(msg)
+	queued = messageScheduler.submit(queueKey(msg), msg)
+	if queued == scheduler.BUSY:
+		log.warning(f"The queue of {queueKey(msg)} is full, so messages are turned away until it catches up.")
+		await msg.channel.send(
+			f"{msg.author.display_name} -- Sorry. The mice are still busy with the dice of this channel. "
+			"Try again in a moment."
+		)
+	return queued
+
+
+async def handleMessage(msg):
 	try:
-		if msg.author.bot:
-			return "bot message"
-		log.info(f"Received {msg.content=} from {msg.author.display_name}")
-		DiceParser.currentName = msg.author.display_name
-		reply = handleInput(msg.author, msg.content)
+		content = msg.content
+		if mice.isAliasImport(content):
+			content += await readAttachments(msg)
+		if pool and not mice.isLocalCommand(content):
+			reply = await pool.evaluate(msg.author, content)
+		else:
+			reply = await evaluate(msg.author, content)
 		if reply:
-			await msg.channel.send(reply)
+			# long replies come as a list of messages, to be sent in order
+			for part in render.fit(reply):
+				start = perf_counter()
+				await msg.channel.send(part)
+				sendStage.observe(perf_counter() - start)
 		else:
 			return "no dice"
 	except ParserTimeoutError as e:
+		timeoutCounter.inc()
 		await msg.channel.send(
 			f"{msg.author.display_name} -- Sorry. Those dice rolls are too big and complex for our little mice hands"
 		)
@@ -80,9 +297,37 @@ async def on_message(msg):
 		)
 		raise e
 	except Exception as e:
+		errorCounter.inc()
 		log.error(
 			f"{repr(e)} when handling on_message event with content {repr(msg.content)} from {msg.author.display_name}."
 		)
 
+
+def makeClient(shardCount=None, shardIds=None):
+	"""Returns a client with the handlers of the bot. A shard count makes it an AutoShardedClient,
+	which runs only shardIds if they are given, and 0 lets discord recommend the shard count."""
+	intents = discord.Intents.default()
+	intents.message_content = True
+	if shardCount is None:
+		made = discord.Client(intents=intents)
+	else:
+		made = discord.AutoShardedClient(intents=intents, shard_count=shardCount or None, shard_ids=shardIds)
+	for handler in (setup_hook, on_ready, on_guild_join, on_message):
+		made.event(handler)
+	made.before_identify_hook = before_identify_hook
+	return made
+
+
+client = makeClient(args.shard_count, args.shard_ids)
+
+
+def main():
+	try:
+		client.run(TOKEN)
+	finally:
+		if pool:
+			pool.close()
+
+
 if __name__ == '__main__':
-	client.run(TOKEN)
+	main()
@@ -0,0 +1,317 @@
+# Expression
+# the compiled form of a parsed message
+# the parser turns a message into a tree of the nodes below once,
+# and the tree can then be evaluated as many times as needed, drawing fresh rolls on every evaluation
+# numeric nodes evaluate to dicts of the form dict(text=..., result=...)
+# and expr nodes evaluate to the text of the message with its dice codes rolled
+# numeric nodes also describe themselves as a dice code, so a repeated roll can be named once for all its results
+
+from dataclasses import dataclass, field
+from functools import cached_property
+from math import isnan, nan
+from typing import Tuple
+
+import budget
+import render
+from rolling import HIGHEST, rollDice
+
+
+def fold(root, visit):
+	"""Calls visit(node, childResults) on every node of the tree, children first, and returns the result for the root.
+	The tree is walked with an explicit stack, so long messages can not exhaust the recursion limit."""
+	results = []
+	stack = [(root, False)]
+	while stack:
+		node, visited = stack.pop()
+		children = node.children
+		if visited:
+			if children:
+				args = results[-len(children):]
+				del results[-len(children):]
+			else:
+				args = ()
+			results.append(visit(node, args))
+		else:
+			stack.append((node, True))
+			stack.extend((child, False) for child in reversed(children))
+	return results[0]
+
+
+def countDice(node):
+	return fold(node, lambda node, counts: sum(counts) + (node.numDice if isinstance(node, Dice) else 0))
+
+
+def echoedLength(expression):
+	"""The characters of text that expression echoes from the message it was compiled from."""
+	if isinstance(expression, Concatenation):
+		return expression.echoedLength
+	if isinstance(expression, Text):
+		return len(expression.text)
+	return 0
+
+
+def countResults(expression):
+	"""The results that evaluating expression writes, each of which needs room in the reply."""
+	if isinstance(expression, Concatenation):
+		return expression.resultCount
+	return 1 if isinstance(expression, (Result, Repeat)) else 0
+
+
+def describe(node):
+	return fold(node, lambda node, codes: node.describe(*codes))
+
+
+def evaluate(expression):
+	if expression is None:
+		return None
+	step = budget.current().step
+
+	def visit(node, args):
+		step()
+		return node.evaluate(*args)
+
+	return fold(expression, visit)
+
+
+@dataclass(frozen=True)
+class Text:
+	text: str
+	children = ()
+
+	def evaluate(self):
+		return self.text
+
+
+@dataclass(frozen=True)
+class Error:
+	children = ()
+
+	def evaluate(self):
+		return '**<ERROR>**'
+
+
+@dataclass(frozen=True)
+class Concatenation:
+	parts: Tuple
+
+	@property
+	def children(self):
+		return self.parts
+
+	@cached_property
+	def echoed(self):
+		"""Which of the parts are text echoed from the message, rather than rolls."""
+		return [isinstance(part, Text) for part in self.parts]
+
+	@cached_property
+	def echoedLength(self):
+		return sum(len(part.text) for part in self.parts if isinstance(part, Text))
+
+	@cached_property
+	def resultCount(self):
+		return sum(isinstance(part, (Result, Repeat)) for part in self.parts)
+
+	def evaluate(self, *texts):
+		return "".join(render.fitEchoed(texts, self.echoed))
+
+
+@dataclass(frozen=True)
+class Result:
+	numeric: object
+
+	@property
+	def children(self):
+		return (self.numeric,)
+
+	def evaluate(self, value):
+		text = formatNumeric(value)
+		render.current().spendResult(text[len(value['text']):])
+		return text
+
+
+@dataclass(frozen=True)
+class Repeat:
+	"""Rolls the numeric expression repeats times, and lists the results after a single dice code for them all.
+	The numeric expression is evaluated here rather than as a child, so it can be rolled again for every repeat."""
+	numeric: object
+	repeats: int
+	before: str = ""
+	after: str = ""
+	children = ()
+
+	def evaluate(self):
+		results = [evaluate(self.numeric)['result'] for i in range(self.repeats)]
+		return render.current().spendResult(
+			f"{self.before}{describe(self.numeric)}{self.after} = {', '.join(map(formatResult, results))}"
+		)
+
+
+@dataclass(frozen=True)
+class Number:
+	value: float
+	children = ()
+
+	def evaluate(self):
+		return dict(text=str(self.value), result=self.value)
+
+	def describe(self):
+		return str(self.value)
+
+
+@dataclass(frozen=True)
+class Dice:
+	numDice: int
+	numSides: int
+	range: int
+	rangeSize: int
+	# the dice code as the user wrote it, like d20adv, which does not change which dice are rolled
+	code: str = field(default="", compare=False)
+	children = ()
+
+	def evaluate(self):
+		return rollDice(vars(self))
+
+	def describe(self):
+		if self.code:
+			return self.code
+		code = f"{self.numDice if self.numDice != 1 else ''}d{self.numSides}"
+		if self.rangeSize != self.numDice:
+			code += f"k{'h' if self.range == HIGHEST else 'l'}{self.rangeSize}"
+		return code
+
+
+@dataclass(frozen=True)
+class Sum:
+	left: object
+	operator: str
+	right: object
+
+	@property
+	def children(self):
+		return (self.left, self.right)
+
+	def evaluate(self, left, right):
+		return addValues(left, self.operator, right)
+
+	def describe(self, left, right):
+		return left + self.operator + right
+
+
+@dataclass(frozen=True)
+class Product:
+	left: object
+	operator: str
+	right: object
+
+	@property
+	def children(self):
+		return (self.left, self.right)
+
+	def evaluate(self, left, right):
+		return multiplyValues(left, self.operator, right)
+
+	def describe(self, left, right):
+		return left + self.operator + right
+
+
+@dataclass(frozen=True)
+class Quotient:
+	left: object
+	operator: str
+	right: object
+
+	@property
+	def children(self):
+		return (self.left, self.right)
+
+	def evaluate(self, left, right):
+		return divideValues(left, self.operator, right)
+
+	def describe(self, left, right):
+		return left + self.operator + right
+
+
+@dataclass(frozen=True)
+class Unary:
+	operator: str
+	operand: object
+
+	@property
+	def children(self):
+		return (self.operand,)
+
+	def evaluate(self, operand):
+		return unaryValue(self.operator, operand)
+
+	def describe(self, operand):
+		return self.operator + operand
+
+
+@dataclass(frozen=True)
+class Brackets:
+	open: str
+	inner: object
+	close: str
+
+	@property
+	def children(self):
+		return (self.inner,)
+
+	def evaluate(self, inner):
+		return bracketValue(self.open, inner, self.close)
+
+	def describe(self, inner):
+		return self.open + inner + self.close
+
+
+def formatNumeric(value):
+	text = value['text']
+	if text.isdigit() or text == '[]':
+		return text
+	return f"{text} = {formatResult(value['result'])}"
+
+
+def formatResult(result):
+	if isnan(result):
+		return "[DIVISION BY ZERO]"
+	result = f"{result:n}" if int(result) == result else f"{result:.2f}"
+	while "." in result and result[-1] == "0":
+		result = result[:-1]
+	return result
+
+
+def addValues(left, operator, right):
+	if '-' in operator:
+		right['result'] *= -1
+	text = left['text'] + operator + right['text']
+	result = left['result'] + right['result']
+	return dict(text=text, result=result)
+
+
+def multiplyValues(left, operator, right):
+	text = left['text'] + operator + right['text']
+	result = left['result'] * right['result']
+	return dict(text=text, result=result)
+
+
+def divideValues(left, operator, right):
+	if right['result']:
+		result = left['result'] / right['result']
+	else:
+		right['text'] = f"~~{right['text']}~~"
+		result = nan
+	text = left['text'] + operator + right['text']
+	return dict(text=text, result=result)
+
+
+def unaryValue(operator, operand):
+	text = operator + operand['text']
+	result = operand['result']
+	if '-' in operator:
+		result *= -1
+	return dict(text=text, result=result)
+
+
+def bracketValue(open, inner, close):
+	text = open + inner['text'] + close
+	return dict(text=text, result=inner['result'])
@@ -0,0 +1,154 @@
+# Launcher
+# runs the bot as several processes that each own a range of shards, so the guilds are spread over every core
+# discord sends the events of a guild to shard (guild id >> 22) % shard count, and each process runs discordUI as an
+# AutoShardedClient for its own range of shard ids, with the same arguments as every other process
+# discord only lets a bot identify one shard per max concurrency bucket every IDENTIFY_SECONDS,
+# so the processes share an IdentifyGate, which hands every identify its own slot in its bucket
+# each process writes its own log, audit and metrics files, named after its shards, see discordUI.perShard
+# the alias index of a process cannot see the aliases that other processes change, so it is turned off when sharded,
+# and every process keeps the roll history of its own guilds
+# run with `python launcher.py --processes 4 --shards 16 -- <arguments for discordUI>`
+
+import argparse
+import asyncio
+import importlib
+import multiprocessing
+import os
+import sys
+import time
+
+IDENTIFY_SECONDS = 5
+SNOWFLAKE_TIME_SHIFT = 22
+
+
+class IdentifyGate:
+	"""Spaces the identifies of every shard of every process IDENTIFY_SECONDS apart within each concurrency bucket."""
+
+	def __init__(self, maxConcurrency=1, interval=IDENTIFY_SECONDS, context=multiprocessing):
+		self.interval = interval
+		self.lock = context.Lock()
+		# the earliest time each bucket may identify next
+		self.slots = context.Array("d", maxConcurrency, lock=False)
+
+	def delay(self, shardId):
+		"""Takes the next identify slot of the bucket of shardId, and returns how many seconds away it is."""
+		with self.lock:
+			bucket = shardId % len(self.slots)
+			now = time.time()
+			slot = max(now, self.slots[bucket])
+			self.slots[bucket] = slot + self.interval
+		return slot - now
+
+	async def wait(self, shardId):
+		await asyncio.sleep(self.delay(shardId))
+
+
+def shardOf(guildId, shardCount):
+	return (guildId >> SNOWFLAKE_TIME_SHIFT) % shardCount
+
+
+def shardRanges(shardCount, processes):
+	"""Splits the shard ids into processes contiguous ranges, as even in size as they can be."""
+	processes = min(processes, shardCount)
+	return [range(shardCount * i // processes, shardCount * (i + 1) // processes) for i in range(processes)]
+
+
+def parseShardIds(text):
+	"""Parses shard ids written like 0-3,8,10-11."""
+	ids = []
+	for part in text.split(","):
+		first, dash, last = part.partition("-")
+		ids += range(int(first), int(last if dash else first) + 1)
+	return ids
+
+
+def formatShardIds(ids):
+	ids = list(ids)
+	if ids == list(range(ids[0], ids[-1] + 1)):
+		return str(ids[0]) if len(ids) == 1 else f"{ids[0]}-{ids[-1]}"
+	return ",".join(map(str, ids))
+
+
+def shardArguments(arguments, shardIds, shardCount):
+	"""Returns the discordUI arguments of the process that owns shardIds."""
+	return [*arguments, "--shard-count", str(shardCount), "--shard-ids", formatShardIds(shardIds)]
+
+
+def importBot(arguments, gate, sharded):
+	"""Imports discordUI with arguments, as the process that owns a range of shards."""
+	# discordUI reads its own arguments when it is imported
+	sys.argv = ["discordUI.py", *arguments]
+	discordUI = importlib.import_module("discordUI")
+	discordUI.identifyGate = gate
+	if sharded:
+		import mice
+		mice.aliasIndex = mice.AliasIndex(maxsize=0)
+	return discordUI
+
+
+def runShards(arguments, gate, sharded):
+	importBot(arguments, gate, sharded).main()
+
+
+def launch(
+	arguments, processes, shardCount, maxConcurrency=1, target=runShards, targetArgs=(),
+	identifySeconds=IDENTIFY_SECONDS,
+):
+	"""Runs target in a process for each range of shards, and waits for all of them. Returns their exit codes.
+	target is called with the discordUI arguments of its shards, the shared IdentifyGate,
+	whether there is more than one process, and then targetArgs."""
+	# processes are spawned, so none of them inherits the event loop, threads or connections of another
+	context = multiprocessing.get_context("spawn")
+	gate = IdentifyGate(maxConcurrency, identifySeconds, context)
+	ranges = shardRanges(shardCount, processes)
+	children = [
+		context.Process(
+			target=target,
+			args=(shardArguments(arguments, shardIds, shardCount), gate, len(ranges) > 1, *targetArgs),
+			name=f"shards {formatShardIds(shardIds)}",
+		)
+		for shardIds in ranges
+	]
+	for child in children:
+		child.start()
+	try:
+		for child in children:
+			child.join()
+	finally:
+		for child in children:
+			if child.is_alive():
+				child.terminate()
+				child.join()
+	return [child.exitcode for child in children]
+
+
+def main(argv=None):
+	argparser = argparse.ArgumentParser(
+		description="Runs the bot as several processes that each own a range of shards. "
+		"Arguments after -- are passed to every process of discordUI."
+	)
+	argparser.add_argument(
+		"--processes",
+		type=int, default=os.cpu_count(),
+		help="The number of processes to run. Defaults to the number of cores.",
+	)
+	argparser.add_argument(
+		"--shards",
+		type=int,
+		help="The number of shards to split the guilds into. Defaults to one per process.",
+	)
+	argparser.add_argument(
+		"--max-concurrency",
+		type=int, default=1,
+		help="How many shards discord lets the bot identify at once, from the max_concurrency of /gateway/bot. "
+		"Defaults to 1.",
+	)
+	argparser.add_argument("discordUI", nargs=argparse.REMAINDER, help="Arguments for discordUI, after --.")
+	args = argparser.parse_args(argv)
+	arguments = [arg for arg in args.discordUI if arg != "--"]
+	codes = launch(arguments, args.processes, args.shards or args.processes, args.max_concurrency)
+	return max(codes, key=abs)
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,10 @@
+# lextab.py. This file automatically created by PLY (version 3.11). Don't edit!
+_tabversion   = '3.10'
+_lextokens    = set(('CLOSE', 'DIE', 'DIVIDE', 'MINUS', 'MULTIPLY', 'NUMBER', 'OPEN', 'PLAINTEXT', 'PLUS', 'REPEAT', 'TIMES'))
+_lexreflags   = 114
+_lexliterals  = ''
+_lexstateinfo = {'INITIAL': 'inclusive'}
+_lexstatere   = {'INITIAL': [('(?P<t_REPEAT>\n\t(?<![\\w.])\n\t[1-9]\\d*\n\t\\s*[x×]\\s+\n\t(?=\\d*d[1-9])\n\t)|(?P<t_NUMBER>\n\t(?P<num>\n\t\t\\d+\n\t\t(\\.\\d+)?\n\t)\n\t(?!\\d*d[1-9])\n\t)|(?P<t_DIE>\n\t(?<!\\w)\n\t(?P<numDice>\\d+)?\n\td(?P<numSides>[1-9]\\d*)\n\t(?P<modifier>\n\t\tadv\n\t|\n\t\tdis\n\t|\n\t\t(?P<inclusive>[kd])?(?P<range>[hl])?(?P<rangeSize>\\d+)?\n\t)?\n\t)|(?P<t_TIMES>\n\t(?<=[\\w)\\]}])\n\t\\s*[x×][1-9]\\d*\n\t(?![\\w.])\n\t)|(?P<t_PLAINTEXT>\n(?:\n\t[^\\s\\d+\\-*/{}[\\]()d]\n|\n\t(?<=\\w)d\n|\n\td(?![1-9])\n|\n\t(?<=\\w)\\d(?=\\d*d[1-9])\n|\n\t\\s+(?![\\s+\\-*/{}[\\]()])\n)+\n)|(?P<t_CLOSE>\\s*[)\\]}](?:(?!\\s+[x×][1-9])\\s*)?)|(?P<t_OPEN>\\s*[{[(]\\s*)|(?P<t_PLUS>\\s*\\+\\s*)|(?P<t_MULTIPLY>\\s*\\*\\s*)|(?P<t_MINUS>\\s*-\\s*)|(?P<t_DIVIDE>\\s*/\\s*)', [None, ('t_REPEAT', 'REPEAT'), ('t_NUMBER', 'NUMBER'), None, None, ('t_DIE', 'DIE'), None, None, None, None, None, None, ('t_TIMES', 'TIMES'), (None, 'PLAINTEXT'), (None, 'CLOSE'), (None, 'OPEN'), (None, 'PLUS'), (None, 'MULTIPLY'), (None, 'MINUS'), (None, 'DIVIDE')])]}
+_lexstateignore = {'INITIAL': ''}
+_lexstateerrorf = {'INITIAL': 't_error'}
+_lexstateeoff = {}
@@ -0,0 +1,216 @@
+# Metrics
+# always on counters, and histograms of how long each stage of handling a message takes
+# recording only adds to a bucket count and a sum, so it costs a few hundred nanoseconds per stage,
+# and all the formatting is left to whoever reads the metrics
+# updates from the event loop and the database thread are not locked against each other,
+# so a rare race may lose a count, which is fine for monitoring
+# worker processes drain what they recorded after every message, and the bot merges it into its own metrics
+# render formats the metrics in the Prometheus text format, for the HTTP endpoint of serve or the file of writeFile
+
+from bisect import bisect_left
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import threading
+from time import perf_counter
+
+PREFIX = "dice_mice"
+BUCKETS = (
+	1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+	1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+STAGES = dict(
+	precheck="Searching a message for dice codes.",
+	lex="Splitting a message into tokens.",
+	parse="Building the expression tree of a message from its tokens.",
+	roll="Rolling one pool of dice.",
+	format="Formatting the rolls of one pool within the output budget of the reply.",
+	evaluate="Rolling and formatting a whole expression tree.",
+	database="Running one alias query or write.",
+	queue="Waiting in the queue of a channel for a worker.",
+	send="Sending a reply to discord.",
+)
+COUNTERS = dict(
+	messages="Messages received from people.",
+	dice="Messages with dice codes in them.",
+	timeouts="Messages abandoned for exceeding their budget or deadline.",
+	errors="Messages that failed with an unexpected error.",
+	dropped="Messages turned away because the queue of their channel was full.",
+)
+
+
+class Histogram:
+	def __init__(self, bounds=BUCKETS):
+		self.bounds = bounds
+		# the last bucket counts everything above the highest bound
+		self.counts = [0] * (len(bounds) + 1)
+		self.sum = 0.0
+
+	def observe(self, seconds):
+		self.counts[bisect_left(self.bounds, seconds)] += 1
+		self.sum += seconds
+
+	@property
+	def count(self):
+		return sum(self.counts)
+
+	def quantile(self, fraction):
+		"""Returns the upper bound of the bucket holding the given fraction of observations, or None if there are none."""
+		total = self.count
+		if not total:
+			return None
+		cumulative = 0
+		for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+			cumulative += count
+			if cumulative >= fraction * total:
+				return bound
+
+	def drain(self):
+		counts, total = self.counts, self.sum
+		self.counts = [0] * len(counts)
+		self.sum = 0.0
+		return counts, total
+
+	def merge(self, counts, total):
+		for i, count in enumerate(counts):
+			self.counts[i] += count
+		self.sum += total
+
+
+class Counter:
+	def __init__(self):
+		self.value = 0
+
+	def inc(self, amount=1):
+		self.value += amount
+
+	def drain(self):
+		value, self.value = self.value, 0
+		return value
+
+	def merge(self, value):
+		self.value += value
+
+
+stages = {name: Histogram() for name in STAGES}
+counters = {name: Counter() for name in COUNTERS}
+# functions returning dicts of numbers, read whenever the metrics are rendered
+gauges = {}
+
+
+def timed(stage):
+	"""Decorates a function to record each call to it into the histogram of stage."""
+	histogram = stages[stage]
+
+	def decorator(function):
+		@wraps(function)
+		def wrapper(*args, **kwargs):
+			start = perf_counter()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				histogram.observe(perf_counter() - start)
+		return wrapper
+	return decorator
+
+
+def reset():
+	for histogram in stages.values():
+		histogram.drain()
+	for counter in counters.values():
+		counter.drain()
+
+
+def drain():
+	"""Returns everything recorded since the last drain, and forgets it, so a worker process can send it to the bot."""
+	return (
+		{name: histogram.drain() for name, histogram in stages.items() if histogram.sum or any(histogram.counts)},
+		{name: counter.drain() for name, counter in counters.items() if counter.value},
+	)
+
+
+def merge(drained):
+	histograms, values = drained
+	for name, (counts, total) in histograms.items():
+		stages[name].merge(counts, total)
+	for name, value in values.items():
+		counters[name].merge(value)
+
+
+def render():
+	lines = [
+		f"# HELP {PREFIX}_stage_seconds How long each stage of handling a message takes.",
+		f"# TYPE {PREFIX}_stage_seconds histogram",
+	]
+	for name, histogram in stages.items():
+		cumulative = 0
+		for bound, count in zip(histogram.bounds + (float("inf"),), histogram.counts):
+			cumulative += count
+			le = "+Inf" if bound == float("inf") else repr(bound)
+			lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+		lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{name}"}} {histogram.sum!r}')
+		lines.append(f'{PREFIX}_stage_seconds_count{{stage="{name}"}} {cumulative}')
+	for name, counter in counters.items():
+		lines += [
+			f"# HELP {PREFIX}_{name}_total {COUNTERS[name]}",
+			f"# TYPE {PREFIX}_{name}_total counter",
+			f"{PREFIX}_{name}_total {counter.value}",
+		]
+	for group, read in gauges.items():
+		for name, value in read().items():
+			lines += [f"# TYPE {PREFIX}_{group}_{name} gauge", f"{PREFIX}_{group}_{name} {value!r}"]
+	return "\n".join(lines) + "\n"
+
+
+def summary():
+	"""Returns a short human readable summary of the metrics, with estimated percentiles of each stage."""
+	lines = [", ".join(f"{name} {counter.value}" for name, counter in counters.items())]
+	for name, histogram in stages.items():
+		count = histogram.count
+		if count:
+			lines.append(
+				f"{name}: {count} times, mean {formatSeconds(histogram.sum / count)}, "
+				f"p50 ≤ {formatSeconds(histogram.quantile(0.5))}, p99 ≤ {formatSeconds(histogram.quantile(0.99))}"
+			)
+	return "\n".join(lines)
+
+
+def formatSeconds(seconds):
+	if seconds == float("inf"):
+		return f"more than {BUCKETS[-1]}s"
+	if seconds < 1e-3:
+		return f"{seconds * 1e6:.3g}µs"
+	if seconds < 1:
+		return f"{seconds * 1e3:.3g}ms"
+	return f"{seconds:.3g}s"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+	def do_GET(self):
+		if self.path != "/metrics":
+			self.send_error(404)
+			return
+		body = render().encode()
+		self.send_response(200)
+		self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+
+def serve(port, host="127.0.0.1"):
+	"""Serves the metrics at http://host:port/metrics from a background thread, and returns the server."""
+	server = ThreadingHTTPServer((host, port), MetricsHandler)
+	threading.Thread(target=server.serve_forever, name="metrics server", daemon=True).start()
+	return server
+
+
+def writeFile(path):
+	"""Replaces the file at path with the current metrics, for the textfile collector of the Prometheus node exporter."""
+	temporary = f"{path}.{os.getpid()}.tmp"
+	with open(temporary, "w") as file:
+		file.write(render())
+	os.replace(temporary, path)
@@ -1,28 +1,107 @@
 #!/usr/bin/python3.8
+from collections import deque, namedtuple, OrderedDict
 import logging
 import re
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from time import perf_counter
 
+import database
+from DiceParser import (
+	budgeted,
+	expressionCache,
+	Context,
+	lexerRegexFlags,
+	rollExpression,
+	t_DIE,
+	ParserTimeoutError,
+)
 from db.models import Alias
-from DiceParser import parser, lexerRegexFlags, t_DIE
+from expression import fold, formatResult, Concatenation, Error, Result
+import metrics
+from odds import distribution, OddsTooComplexError, Summary, NEGLIGIBLE
+import render
+from render import MESSAGE_LIMIT
+from simulation import simulate, trialCap, HISTOGRAM_WIDTH
+import threading
 
 diceRegex = re.compile(t_DIE.__doc__, flags=lexerRegexFlags)
+# every dice code has a d followed by one of these, so these are where diceRegex could match
+dieSidesRegex = re.compile(r'[dD][1-9]')
+NONZERO_DIGITS = "123456789"
 aliasRegex = re.compile(r'\s*(?P<name>\w+)?\s*(?P<equals>=)?\s*(?P<definition>.*)')
+# import and export are only subcommands when they are not being defined as alias names themselves
+aliasBulkRegex = re.compile(r'\s*(?P<subcommand>import|export)\b(?!\s*=)\s*(?P<block>.*)', flags=re.DOTALL)
+aliasLineRegex = re.compile(r'\s*(?P<name>\w+)\s*=\s*(?P<definition>.*?)\s*$')
+oddsRegex = re.compile(
+	r'(?P<expression>.*?)\s*((?P<comparison>>=|<=|==?|>|<)\s*(?P<target>-?\d+(\.\d+)?))?\s*$',
+	flags=re.DOTALL,
+)
+simRegex = re.compile(r'\s*(?P<trials>\d+)\s+(?P<expression>.*\S)\s*$', flags=re.DOTALL)
+PERCENTILES = (5, 25, 50, 75, 95)
+MAX_INDEXED_USERS = 4096
+HISTORY_LENGTH = 10
+MAX_HISTORY_USERS = 4096
+HISTORY_LINE_LENGTH = 100
+MAX_IMPORTED_ALIASES = 200
+MAX_REPORTED_PROBLEMS = 10
+ALIAS_NAME_LENGTH = Alias.name.type.length
+ALIAS_DEFINITION_LENGTH = Alias.definition.type.length
+# commands the bot always handles itself, rather than in a worker process
+# the history is kept by the bot, so re-rolling it and listing it are among them
+LOCAL_COMMANDS = ("metrics", "!", "history")
+# the ids of the users allowed to run admin commands
+admins = set()
 
 log = logging.getLogger(__name__)
-
-engine = create_engine('sqlite:///db/db.sqlite3')
-Session = sessionmaker(bind=engine)
+precheckStage = metrics.stages["precheck"]
+diceCounter = metrics.counters["dice"]
 
 
 def handleInput(author, text):
 	if text.startswith("!"):
 		command = text[1:]
 		return handleCommand(author, text, command)
-	elif diceRegex.search(text):
-		res = parser.parse(text)
-		return f"{author.display_name} -- {res}"
+	start = perf_counter()
+	found = hasDice(text)
+	precheckStage.observe(perf_counter() - start)
+	if found:
+		diceCounter.inc()
+		return rollAndRecord(author, text, text)
+
+
+def rollAndRecord(author, text, source):
+	"""Compiles and rolls source, which is either the message text or the definition of the alias it invokes,
+	and records the compiled expression in the history of author, under the text they typed."""
+	def roll():
+		render.current().reserve(f"{author.display_name} -- ")
+		expression = expressionCache.get(source)
+		res = rollExpression(expression)
+		if expression is not None:
+			history.record(author.id, text, expression)
+		return res
+
+	return f"{author.display_name} -- {Context(author.display_name).run(roll)}"
+
+
+def hasDice(text):
+	"""Returns whether text has a dice code in it, like diceRegex.search, but much faster for messages without one.
+	Text without any digit from 1 to 9 is rejected by substring checks before any regex runs.
+	Otherwise diceRegex only runs from the start of the digits before each d that is followed by one,
+	and stops at the first dice code it finds.
+	The positions it finds are not handed on to the parser. A numeric expression can start well before its first
+	die, like (2+3)*d6, so the engine still lexes a message with dice from its start, once, and only when its
+	compiled expression is not already cached."""
+	for digit in NONZERO_DIGITS:
+		if digit in text:
+			break
+	else:
+		return False
+	for candidate in dieSidesRegex.finditer(text):
+		start = candidate.start()
+		while start and text[start - 1].isdecimal():
+			start -= 1
+		if diceRegex.match(text, start):
+			return True
+	return False
 
 
 def handleCommand(author, text, command):
@@ -31,10 +110,9 @@ def handleCommand(author, text, command):
 	if commandName in COMMANDS:
 		return COMMANDS[commandName](author, text, args)
 	else:
-		session = Session()
-		for alias in session.query(Alias).filter_by(user=author.id):
-			if alias.name == commandName:
-				return f"{author.display_name} -- {parser.parse(alias.definition)}"
+		definition = aliasIndex.get(author.id).get(commandName)
+		if definition is not None:
+			return rollAndRecord(author, text, definition)
 	log.debug(f"No command matching {commandName}")
 	return None
 
@@ -50,49 +128,414 @@ def parseCommand(command):
 
 
 def handleAlias(author, text, args):
+	bulk = aliasBulkRegex.match(args)
+	if bulk:
+		if bulk.group('subcommand') == 'import':
+			return importAliases(author, bulk.group('block'))
+		return exportAliases(author)
 	name, isDefining, definition = parseAlias(args)
 	log.debug(f"Alias command called with {name=}, {isDefining=}, {definition=}")
-	session = Session()
 	if not name:
-		aliases = session.query(Alias).filter_by(user=author.id)
-		if aliases.count():
+		aliases = aliasIndex.store(author.id, database.aliasesOf(author.id))
+		if aliases:
 			reply = [f"{author.display_name} has the following aliases defined:"]
-			for alias in aliases:
-				reply.append(f"{alias.name} = {alias.definition}")
+			for aliasName, aliasDefinition in aliases.items():
+				reply.append(f"{aliasName} = {aliasDefinition}")
 			reply = "\n".join(reply)
 		else:
 			reply = f'{author.display_name} has no aliases defined. Type "!alias <shorthand>=<text>" to define an alias.'
 	elif not isDefining:
-		res = session.query(Alias).filter_by(user=author.id, name=name)
-		if res.count():
-			alias = res[0]
-			return f"{author.display_name} -- {alias.name} is aliased to {alias.definition}"
+		aliasDefinition = aliasIndex.get(author.id).get(name)
+		if aliasDefinition is not None:
+			return f"{author.display_name} -- {name} is aliased to {aliasDefinition}"
 		else:
 			reply = f"{author.display_name} -- {name} is not aliased to anything."
 	elif not definition:
-		res = session.query(Alias).filter_by(user=author.id, name=name)
-		if res.count():
-			alias = res[0]
-			res.delete()
-			session.commit()
-			return f"{author.display_name} -- {name} is no longer aliased to {alias.definition}"
+		aliasDefinition = database.removeAlias(author.id, name)
+		if aliasDefinition is not None:
+			aliasIndex.discard(author.id, name)
+			return f"{author.display_name} -- {name} is no longer aliased to {aliasDefinition}"
 		else:
 			reply = f"{author.display_name} -- {name} is not aliased to anything."
 	elif definition:
-		alias = Alias(user=author.id, name=name, definition=definition)
-		session.add(alias)
-		session.commit()
+		database.addAlias(author.id, name, definition)
+		aliasIndex.set(author.id, name, definition)
 		reply = f"stored alias for {author.display_name} = {definition}"
 	log.debug(f"{reply=}")
 	return reply
 
 
+def importAliases(author, block):
+	"""Defines or redefines every alias in a block of "name = definition" lines, in one transaction.
+	Nothing is stored unless every line is valid, and every definition compiles."""
+	aliases, problems = parseAliasBlock(block)
+	if not aliases and not problems:
+		return f'{author.display_name} -- Type "!alias import" followed by lines of "<shorthand> = <text>".'
+	if len(aliases) > MAX_IMPORTED_ALIASES:
+		problems.append(f"at most {MAX_IMPORTED_ALIASES} aliases can be imported at once")
+	if problems:
+		shown = problems[:MAX_REPORTED_PROBLEMS]
+		if len(problems) > len(shown):
+			shown.append(f"and {len(problems) - len(shown)} more problems")
+		return "\n".join([f"{author.display_name} -- Nothing was imported, because:", *shown])
+	database.upsertAliases(author.id, aliases)
+	for name, definition in aliases.items():
+		aliasIndex.set(author.id, name, definition)
+	return f"{author.display_name} -- imported {len(aliases)} aliases."
+
+
+def parseAliasBlock(block):
+	"""Returns the aliases defined by a block of lines as a dict of names to definitions, and a list of problems.
+	Blank lines, code block fences and lines starting with # are ignored."""
+	aliases = {}
+	problems = []
+	for number, line in enumerate(block.splitlines(), 1):
+		stripped = line.strip()
+		if not stripped or stripped.startswith(("#", "```")):
+			continue
+		m = aliasLineRegex.fullmatch(line)
+		if not m or not m.group('definition'):
+			problems.append(f'line {number}: expected "<shorthand> = <text>"')
+			continue
+		name, definition = m.group('name'), m.group('definition')
+		if name in aliases:
+			problems.append(f"line {number}: {name} is defined more than once")
+		elif len(name) > ALIAS_NAME_LENGTH:
+			problems.append(f"line {number}: {name} is longer than {ALIAS_NAME_LENGTH} characters")
+		elif len(definition) > ALIAS_DEFINITION_LENGTH:
+			problems.append(f"line {number}: the definition is longer than {ALIAS_DEFINITION_LENGTH} characters")
+		elif not compiles(definition):
+			problems.append(f"line {number}: the definition of {name} could not be parsed")
+		aliases[name] = definition
+	return aliases, problems
+
+
+def compiles(definition):
+	"""Returns whether a definition compiles within the budget of one message, without any syntax errors.
+	The compiled expression is kept in the expression cache, ready for when the alias is run."""
+	try:
+		expression = budgeted(expressionCache.get, definition)
+	except ParserTimeoutError:
+		return False
+	return expression is not None and not fold(
+		expression, lambda node, errors: isinstance(node, Error) or any(errors)
+	)
+
+
+def exportAliases(author):
+	"""Returns every alias of the author as "name = definition" lines,
+	split into a list of code blocks that each fit in a message."""
+	aliases = aliasIndex.store(author.id, database.aliasesOf(author.id))
+	if not aliases:
+		return f'{author.display_name} has no aliases defined. Type "!alias <shorthand>=<text>" to define an alias.'
+	lines = [f"{name} = {definition}" for name, definition in sorted(aliases.items())]
+	return [f"```\n{chunk}\n```" for chunk in chunkLines(lines, MESSAGE_LIMIT - len("```\n\n```"))]
+
+
+def chunkLines(lines, limit):
+	"""Joins lines into as few chunks as possible, none of them longer than limit, without splitting any line."""
+	chunks = []
+	chunk = []
+	length = -1
+	for line in lines:
+		if chunk and length + 1 + len(line) > limit:
+			chunks.append("\n".join(chunk))
+			chunk = []
+			length = -1
+		chunk.append(line)
+		length += 1 + len(line)
+	if chunk:
+		chunks.append("\n".join(chunk))
+	return chunks
+
+
+def handleReroll(author, text, args):
+	"""Rolls the last dice message or alias of the author again, from its compiled expression."""
+	entry = history.last(author.id)
+	if entry is None:
+		return f"{author.display_name} -- You have not rolled anything recently."
+
+	def roll():
+		render.current().reserve(f"{author.display_name} -- ")
+		return rollExpression(entry.expression)
+
+	return f"{author.display_name} -- {Context(author.display_name).run(roll)}"
+
+
+def handleHistory(author, text, args):
+	entries = history.entries(author.id)
+	if not entries:
+		return f"{author.display_name} -- You have not rolled anything recently."
+	reply = [f'{author.display_name} -- your last rolls, most recent first. Type "!!" to roll the first again.']
+	for number, entry in enumerate(entries, 1):
+		line = " ".join(entry.text.split())
+		if len(line) > HISTORY_LINE_LENGTH:
+			line = line[:HISTORY_LINE_LENGTH - 1] + "…"
+		reply.append(f"{number}. {line}")
+	return "\n".join(reply)
+
+
+def handleMetrics(author, text, args):
+	if author.id not in admins:
+		return f"{author.display_name} -- Sorry. Only the admins of this bot can see its metrics."
+	return f"{author.display_name} -- metrics since the bot started:\n{metrics.summary()}"
+
+
+def isAliasImport(text):
+	if not text.startswith("!"):
+		return False
+	commandName, args = parseCommand(text[1:])
+	bulk = aliasBulkRegex.match(args)
+	return commandName == "alias" and bool(bulk) and bulk.group('subcommand') == 'import'
+
+
+def isLocalCommand(text):
+	return text.startswith("!") and parseCommand(text[1:])[0] in LOCAL_COMMANDS
+
+
 def parseAlias(args):
 	m = aliasRegex.match(args)
 	isDefining = m.group('equals') or m.group('definition')
 	return m.group('name'), isDefining, m.group('definition')
 
 
+class AliasIndex:
+	"""A bounded LRU index of each user's aliases, as dicts of alias names to definitions.
+	A user's aliases are loaded with one query when they are first needed, and handleAlias keeps them up to date,
+	so running an indexed alias needs no queries at all.
+	Aliases written to the database by anything else are only seen once the user is evicted or the index cleared."""
+
+	def __init__(self, maxsize=MAX_INDEXED_USERS, load=database.aliasesOf):
+		self.maxsize = maxsize
+		self.load = load
+		self.users = OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def get(self, userId):
+		"""Returns the aliases of a user. The dict is owned by the index, so do not change it."""
+		with self.lock:
+			if userId in self.users:
+				self.hits += 1
+				self.users.move_to_end(userId)
+				return self.users[userId]
+			self.misses += 1
+		return self.store(userId, self.load(userId))
+
+	def store(self, userId, aliases):
+		"""Replaces the indexed aliases of a user with a complete set loaded from the database."""
+		with self.lock:
+			self.users[userId] = aliases
+			self.users.move_to_end(userId)
+			while len(self.users) > self.maxsize:
+				self.users.popitem(last=False)
+				self.evictions += 1
+		return aliases
+
+	def set(self, userId, name, definition):
+		with self.lock:
+			if userId in self.users:
+				self.users[userId][name] = definition
+
+	def discard(self, userId, name):
+		with self.lock:
+			if userId in self.users:
+				self.users[userId].pop(name, None)
+
+	def clear(self):
+		with self.lock:
+			self.users.clear()
+
+	def stats(self):
+		lookups = self.hits + self.misses
+		return dict(
+			hits=self.hits,
+			misses=self.misses,
+			evictions=self.evictions,
+			size=len(self.users),
+			hitRate=self.hits / lookups if lookups else 0.0,
+		)
+
+
+HistoryEntry = namedtuple("HistoryEntry", "text expression")
+
+
+class History:
+	"""The last few dice messages and aliases each user rolled, with their compiled expressions,
+	so they can be rolled again without lexing or parsing.
+	Users are kept in LRU order, and the least recently active are evicted once there are more than maxsize."""
+
+	def __init__(self, length=HISTORY_LENGTH, maxsize=MAX_HISTORY_USERS):
+		self.length = length
+		self.maxsize = maxsize
+		self.users = OrderedDict()
+		self.lock = threading.Lock()
+		self.evictions = 0
+
+	def record(self, userId, text, expression):
+		with self.lock:
+			entries = self.users.get(userId)
+			if entries is None:
+				entries = self.users[userId] = deque(maxlen=self.length)
+			else:
+				self.users.move_to_end(userId)
+			entries.append(HistoryEntry(text, expression))
+			while len(self.users) > self.maxsize:
+				self.users.popitem(last=False)
+				self.evictions += 1
+
+	def merge(self, records):
+		"""Records the (userId, text, expression) tuples drained from the history journal of a worker process."""
+		for record in records:
+			self.record(*record)
+
+	def last(self, userId):
+		with self.lock:
+			entries = self.users.get(userId)
+			if not entries:
+				return None
+			self.users.move_to_end(userId)
+			return entries[-1]
+
+	def entries(self, userId):
+		"""Returns the history of a user, most recent first."""
+		with self.lock:
+			entries = self.users.get(userId)
+			if not entries:
+				return []
+			self.users.move_to_end(userId)
+			return list(reversed(entries))
+
+	def clear(self):
+		with self.lock:
+			self.users.clear()
+
+	def stats(self):
+		return dict(users=len(self.users), evictions=self.evictions)
+
+
+class HistoryJournal:
+	"""Stands in for the history in a worker process, collecting what is recorded there for the bot to merge."""
+
+	def __init__(self):
+		self.records = []
+
+	def record(self, userId, text, expression):
+		self.records.append((userId, text, expression))
+
+	def drain(self):
+		records, self.records = self.records, []
+		return records
+
+
+aliasIndex = AliasIndex()
+history = History()
+metrics.gauges["alias_index"] = lambda: aliasIndex.stats()
+metrics.gauges["expression_cache"] = expressionCache.stats
+metrics.gauges["history"] = lambda: history.stats()
+
+
+def handleOdds(author, text, args):
+	m = oddsRegex.match(args)
+	numeric = parseSingleNumeric(m.group('expression'))
+	if numeric is None:
+		return f'{author.display_name} -- Type "!odds <dice expression>", optionally followed by a comparison like ">= 15".'
+	try:
+		summary = budgeted(lambda: Summary(distribution(numeric)))
+	except (OddsTooComplexError, RecursionError) as e:
+		log.debug(f"Odds for {args=} are too complex: {e!r}")
+		return f"{author.display_name} -- Sorry. The odds of {m.group('expression')} are too complex to work out exactly."
+	if not summary.defined:
+		return f"{author.display_name} -- {m.group('expression')} always divides by zero."
+	reply = [
+		f"{author.display_name} -- odds for {m.group('expression')}: "
+		f"mean {formatStatistic(summary.mean)}, "
+		f"standard deviation {formatStatistic(summary.standardDeviation)}",
+		"percentiles: " + ", ".join(
+			f"{percent}%: {formatStatistic(summary.percentile(percent / 100))}" for percent in PERCENTILES
+		),
+	]
+	if m.group('comparison'):
+		target = float(m.group('target'))
+		chance = summary.chance(m.group('comparison'), target)
+		reply.append(f"P(result {m.group('comparison')} {m.group('target')}) = {chance:.2%}")
+	if summary.undefined > NEGLIGIBLE:
+		reply.append(f"P(division by zero) = {summary.undefined:.2%}")
+	return "\n".join(reply)
+
+
+def handleSim(author, text, args):
+	m = simRegex.match(args)
+	numeric = parseSingleNumeric(m.group('expression')) if m else None
+	if numeric is None:
+		return f'{author.display_name} -- Type "!sim <number of trials> <dice expression>", like "!sim 10000 4d6kh3".'
+	trials = int(m.group('trials'))
+	if not trials:
+		return f"{author.display_name} -- Sorry. Simulate at least 1 trial."
+	cap = trialCap(numeric)
+	if trials > cap:
+		trials = cap
+	if not trials:
+		return f"{author.display_name} -- Sorry. {m.group('expression')} is too big to simulate."
+	simulation = budgeted(simulate, numeric, trials)
+	reply = [f"{author.display_name} -- {trials} trials of {m.group('expression')}"]
+	if int(m.group('trials')) > trials:
+		reply[0] += f" (capped from {m.group('trials')})"
+	if simulation.results:
+		reply[0] += (
+			f": mean {formatStatistic(simulation.mean)}, "
+			f"standard deviation {formatStatistic(simulation.standardDeviation)}"
+		)
+		reply.append("percentiles: " + ", ".join(
+			f"{percent}%: {formatStatistic(simulation.percentile(percent / 100))}" for percent in PERCENTILES
+		))
+		reply.append(formatHistogram(simulation))
+	if simulation.undefined:
+		reply.append(f"divided by zero in {simulation.undefined / simulation.trials:.2%} of trials")
+	return "\n".join(reply)
+
+
+def formatHistogram(simulation):
+	bins = simulation.histogram()
+	labels = [
+		formatStatistic(low) if high - low in (0, 1) else f"{formatStatistic(low)} to {formatStatistic(high)}"
+		for low, high, count in bins
+	]
+	width = max(len(label) for label in labels)
+	most = max(count for low, high, count in bins)
+	lines = [
+		f"{label:>{width}} | {'#' * round(HISTOGRAM_WIDTH * count / most):<{HISTOGRAM_WIDTH}} {count / simulation.trials:.2%}"
+		for label, (low, high, count) in zip(labels, bins)
+	]
+	return "```\n" + "\n".join(lines) + "\n```"
+
+
+def formatStatistic(value):
+	value = round(value, 2)
+	return formatResult(int(value) if int(value) == value else value)
+
+
+def parseSingleNumeric(text):
+	"""Returns the numeric expression of text, if text holds exactly one expression and nothing but whitespace besides."""
+	if not text:
+		return None
+	expression = expressionCache.get(text)
+	parts = expression.parts if isinstance(expression, Concatenation) else (expression,)
+	results = [part for part in parts if isinstance(part, Result)]
+	others = [part for part in parts if not isinstance(part, Result) and getattr(part, 'text', '').strip() != '']
+	if len(results) != 1 or others:
+		return None
+	return results[0].numeric
+
+
 COMMANDS = dict(
 	alias=handleAlias,
+	odds=handleOdds,
+	sim=handleSim,
+	metrics=handleMetrics,
+	history=handleHistory,
 )
+# !! is the command named !
+COMMANDS["!"] = handleReroll
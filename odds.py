@@ -0,0 +1,241 @@
+# Odds
+# computes the exact probability distribution of a compiled expression, without rolling any dice
+# distributions are dicts mapping each possible result to its probability
+# a division by zero makes the result undefined, so the probabilities of a distribution may sum to less than one,
+# and the missing probability is the chance of dividing by zero
+# sums of whole numbers are combined by convolution (FFT based when numpy is installed),
+# and keeping the highest or lowest dice of a pool is solved by dynamic programming over the order statistics
+
+from functools import lru_cache
+from math import exp, lgamma, log, sqrt
+
+import budget
+from expression import (
+	Brackets,
+	Dice,
+	Number,
+	Product,
+	Quotient,
+	Result,
+	Sum,
+	Unary,
+)
+from rolling import HIGHEST, numpy
+
+MAX_CACHED_DISTRIBUTIONS = 512
+MAX_OUTCOMES = 100000
+MAX_OUTCOME_PAIRS = 1000000
+MAX_KEEP_WORK = 10000000
+FFT_SIZE = 512
+NEGLIGIBLE = 1e-12
+
+
+class OddsTooComplexError(Exception):
+	pass
+
+
+def distribution(node):
+	"""Returns the exact distribution of a numeric expression node."""
+	if isinstance(node, Result):
+		node = node.numeric
+	return numericDistribution(node)
+
+
+@lru_cache(maxsize=MAX_CACHED_DISTRIBUTIONS)
+def numericDistribution(node):
+	if isinstance(node, Number):
+		return {node.value: 1.0}
+	if isinstance(node, Dice):
+		return diceDistribution(node.numDice, node.numSides, node.range, node.rangeSize)
+	if isinstance(node, Brackets):
+		return numericDistribution(node.inner)
+	if isinstance(node, Unary):
+		operand = numericDistribution(node.operand)
+		return negate(operand) if '-' in node.operator else operand
+	left = numericDistribution(node.left)
+	right = numericDistribution(node.right)
+	if isinstance(node, Sum):
+		return add(left, negate(right) if '-' in node.operator else right)
+	if isinstance(node, Product):
+		return combine(left, right, lambda a, b: a * b)
+	if isinstance(node, Quotient):
+		return combine(left, right, lambda a, b: a / b if b else None)
+	raise TypeError(f"Can not compute the distribution of {type(node).__name__}.")
+
+
+@lru_cache(maxsize=MAX_CACHED_DISTRIBUTIONS)
+def diceDistribution(numDice, numSides, keep, keepSize):
+	if keepSize <= 0:
+		return {0: 1.0}
+	if keepSize >= numDice:
+		if numDice * (numSides - 1) + 1 > MAX_OUTCOMES:
+			raise OddsTooComplexError(f"{numDice}d{numSides} has too many possible results.")
+		return toSparse(numDice, power([1 / numSides] * numSides, numDice))
+	if numSides * keepSize ** 3 * numSides > MAX_KEEP_WORK:
+		raise OddsTooComplexError(f"Keeping {keepSize} of {numDice}d{numSides} is too complex to compute exactly.")
+	highest = keepHighest(numDice, numSides, keepSize)
+	if keep == HIGHEST:
+		return toSparse(keepSize, highest)
+	# the lowest dice are the highest dice of the same pool with every face flipped from v to numSides + 1 - v
+	return toSparse(keepSize, highest[::-1])
+
+
+def keepHighest(numDice, numSides, keepSize):
+	"""Returns the dense distribution of the sum of the highest keepSize dice, starting at a sum of keepSize.
+	Faces are visited from the highest down. While visiting face v the dice that are not yet placed are uniform over 1..v,
+	so the number of them showing v is binomially distributed with p = 1/v.
+	The states track how many dice have been placed, and the sum of those that are kept,
+	until keepSize dice have been placed and the kept sum is final."""
+	size = keepSize * numSides + 1
+	final = [0.0] * size
+	states = {0: [1.0] + [0.0] * (size - 1)}
+	checkTime = budget.current().checkTime
+	for face in range(numSides, 0, -1):
+		checkTime()
+		nextStates = {}
+		for placed, sums in states.items():
+			remaining = numDice - placed
+			needed = keepSize - placed
+			pmf = binomialHead(remaining, 1 / face, needed)
+			tail = max(0.0, 1.0 - sum(pmf))
+			for count, chance in enumerate(pmf):
+				if not chance:
+					continue
+				target = nextStates.setdefault(placed + count, [0.0] * size)
+				shift = face * count
+				for total, p in enumerate(sums):
+					if p:
+						target[total + shift] += p * chance
+			if tail > NEGLIGIBLE:
+				shift = face * needed
+				for total, p in enumerate(sums):
+					if p:
+						final[total + shift] += p * tail
+		states = nextStates
+	return final[keepSize:]
+
+
+def binomialHead(trials, p, count):
+	"""Returns the probabilities of 0 to count - 1 successes."""
+	if p >= 1:
+		return [float(k == trials) for k in range(count)]
+	return [
+		exp(
+			lgamma(trials + 1) - lgamma(k + 1) - lgamma(trials - k + 1)
+			+ k * log(p) + (trials - k) * log(1 - p)
+		) if k <= trials else 0.0
+		for k in range(count)
+	]
+
+
+def power(pmf, times):
+	result = [1.0]
+	while times:
+		if times & 1:
+			result = convolve(result, pmf)
+		times >>= 1
+		if times:
+			pmf = convolve(pmf, pmf)
+	return result
+
+
+def convolve(a, b):
+	if numpy is None:
+		checkTime = budget.current().checkTime
+		result = [0.0] * (len(a) + len(b) - 1)
+		for i, p in enumerate(a):
+			checkTime()
+			if p:
+				for j, q in enumerate(b):
+					result[i + j] += p * q
+		return result
+	if min(len(a), len(b)) < FFT_SIZE:
+		return numpy.convolve(a, b).tolist()
+	size = len(a) + len(b) - 1
+	result = numpy.fft.irfft(numpy.fft.rfft(a, size) * numpy.fft.rfft(b, size), size)
+	return numpy.clip(result, 0, None).tolist()
+
+
+def toSparse(offset, dense):
+	return {offset + i: p for i, p in enumerate(dense) if p > NEGLIGIBLE}
+
+
+def isWhole(dist):
+	return all(isinstance(value, int) for value in dist)
+
+
+def negate(dist):
+	return {-value: p for value, p in dist.items()}
+
+
+def add(left, right):
+	if isWhole(left) and isWhole(right):
+		leftOffset, rightOffset = min(left), min(right)
+		if max(left) - leftOffset + max(right) - rightOffset + 1 > MAX_OUTCOMES:
+			raise OddsTooComplexError("That expression has too many possible results.")
+		dense = convolve(toDense(left, leftOffset), toDense(right, rightOffset))
+		return toSparse(leftOffset + rightOffset, dense)
+	return combine(left, right, lambda a, b: a + b)
+
+
+def toDense(dist, offset):
+	dense = [0.0] * (max(dist) - offset + 1)
+	for value, p in dist.items():
+		dense[value - offset] = p
+	return dense
+
+
+def combine(left, right, operation):
+	"""Applies operation to every pair of results. An operation returning None marks the pair as undefined."""
+	if len(left) * len(right) > MAX_OUTCOME_PAIRS:
+		raise OddsTooComplexError("That expression has too many possible results.")
+	result = {}
+	checkTime = budget.current().checkTime
+	for a, p in left.items():
+		checkTime()
+		for b, q in right.items():
+			value = operation(a, b)
+			if value is None:
+				continue
+			if isinstance(value, float) and value.is_integer():
+				value = int(value)
+			result[value] = result.get(value, 0.0) + p * q
+	if len(result) > MAX_OUTCOMES:
+		raise OddsTooComplexError("That expression has too many possible results.")
+	return result
+
+
+class Summary:
+	"""Summary statistics of a distribution, conditioned on the result being defined."""
+
+	def __init__(self, dist):
+		self.values = sorted(dist)
+		self.defined = sum(dist.values())
+		self.probabilities = [dist[value] / self.defined for value in self.values] if self.defined else []
+		self.mean = sum(v * p for v, p in zip(self.values, self.probabilities))
+		variance = sum((v - self.mean) ** 2 * p for v, p in zip(self.values, self.probabilities))
+		self.standardDeviation = sqrt(max(variance, 0))
+		self.undefined = max(0.0, 1 - self.defined)
+
+	def percentile(self, fraction):
+		cumulative = 0
+		for value, p in zip(self.values, self.probabilities):
+			cumulative += p
+			if cumulative >= fraction - NEGLIGIBLE:
+				return value
+		return self.values[-1]
+
+	def chance(self, comparison, target):
+		"""The unconditional probability that the result compares to target, so division by zero never counts."""
+		test = COMPARISONS[comparison]
+		return sum(p for v, p in zip(self.values, self.probabilities) if test(v, target)) * self.defined
+
+
+COMPARISONS = {
+	">=": lambda a, b: a >= b,
+	">": lambda a, b: a > b,
+	"<=": lambda a, b: a <= b,
+	"<": lambda a, b: a < b,
+	"=": lambda a, b: a == b,
+	"==": lambda a, b: a == b,
+}
@@ -0,0 +1,52 @@
+
+# parsetab.py
+# This file is automatically generated. Do not edit.
+# pylint: disable=W,C,R
+_tabversion = '3.10'
+
+_lr_method = 'LALR'
+
+_lr_signature = 'leftexprOPENCLOSEleftTIMESleftPLUSMINUSleftMULTIPLYDIVIDEleftbracketsUNARYleftDIENUMBERCLOSE DIE DIVIDE MINUS MULTIPLY NUMBER OPEN PLAINTEXT PLUS REPEAT TIMESexpr : expr expr %prec exprexpr : PLAINTEXT\n\t| PLUS\n\t| MINUS\n\t| MULTIPLY\n\t| DIVIDE\n\t| OPEN\n\t| CLOSE %prec expr\n\t| TIMES\n\texpr : numeric %prec exprexpr : REPEAT numeric %prec exprexpr : numeric TIMESnumeric : numeric PLUS numeric\n\t| numeric MINUS numericnumeric : numeric MULTIPLY numericnumeric : numeric DIVIDE numericnumeric : PLUS numeric\n\t| MINUS numeric %prec UNARYnumeric : NUMBERnumeric : OPEN numeric CLOSE %prec bracketsnumeric : DIEexpr : error'
+    
+_lr_action_items = {'PLAINTEXT':([0,1,2,3,4,5,6,7,8,9,10,12,13,14,15,17,20,22,27,28,29,30,31,32,],[2,2,-2,-3,-4,-5,-6,-7,-8,-9,-10,-22,-19,-21,-1,-17,-18,-12,-11,-20,-13,-14,-15,-16,]),'PLUS':([0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23,24,25,26,27,28,29,30,31,32,],[3,3,-2,-3,-4,-5,-6,16,-8,-9,23,16,-22,-19,-21,3,16,-17,16,16,-18,23,-12,16,16,16,16,23,-20,-13,-14,-15,-16,]),'MINUS':([0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23,24,25,26,27,28,29,30,31,32,],[4,4,-2,-3,-4,-5,-6,18,-8,-9,24,18,-22,-19,-21,4,18,-17,18,18,-18,24,-12,18,18,18,18,24,-20,-13,-14,-15,-16,]),'MULTIPLY':([0,1,2,3,4,5,6,7,8,9,10,12,13,14,15,17,20,21,22,27,28,29,30,31,32,],[5,5,-2,-3,-4,-5,-6,-7,-8,-9,25,-22,-19,-21,5,25,-18,25,-12,25,-20,25,25,-15,-16,]),'DIVIDE':([0,1,2,3,4,5,6,7,8,9,10,12,13,14,15,17,20,21,22,27,28,29,30,31,32,],[6,6,-2,-3,-4,-5,-6,-7,-8,-9,26,-22,-19,-21,6,26,-18,26,-12,26,-20,26,26,-15,-16,]),'OPEN':([0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,22,23,24,25,26,27,28,29,30,31,32,],[7,7,-2,-3,-4,-5,-6,-7,-8,-9,-10,19,-22,-19,-21,-1,19,-17,19,19,-18,-12,19,19,19,19,-11,-20,-13,-14,-15,-16,]),'CLOSE':([0,1,2,3,4,5,6,7,8,9,10,12,13,14,15,17,20,21,22,27,28,29,30,31,32,],[8,8,-2,-3,-4,-5,-6,-7,-8,-9,-10,-22,-19,-21,-1,-17,-18,28,-12,-11,-20,-13,-14,-15,-16,]),'TIMES':([0,1,2,3,4,5,6,7,8,9,10,12,13,14,15,17,20,22,27,28,29,30,31,32,],[9,9,-2,-3,-4,-5,-6,-7,-8,-9,22,-22,-19,-21,9,-17,-18,-12,-11,-20,-13,-14,-15,-16,]),'REPEAT':([0,1,2,3,4,5,6,7,8,9,10,12,13,14,15,17,20,22,27,28,29,30,31,32,],[11,11,-2,-3,-4,-5,-6,-7,-8,-9,-10,-22,-19,-21,-1,-17,-18,-12,-11,-20,-13,-14,-15,-16,]),'error':([0,1,2,3,4,5,6,7,8,9,10,12,13,14,15,17,20,22,27,28,29,30,31,32,],[12,12,-2,-3,-4,-5,-6,-7,-8,-9,-10,-22,-19,-21,-1,-17,-18,-12,-11,-20,-13,-14,-15,-16,]),'NUMBER':([0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,22,23,24,25,26,27,28,29,30,31,32,],[13,13,-2,13,13,-5,-6,13,-8,-9,-10,13,-22,-19,-21,13,13,-17,13,13,-18,-12,13,13,13,13,-11,-20,-13,-14,-15,-16,]),'DIE':([0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,22,23,24,25,26,27,28,29,30,31,32,],[14,14,-2,14,14,-5,-6,14,-8,-9,-10,14,-22,-19,-21,14,14,-17,14,14,-18,-12,14,14,14,14,-11,-20,-13,-14,-15,-16,]),'$end':([1,2,3,4,5,6,7,8,9,10,12,13,14,15,17,20,22,27,28,29,30,31,32,],[0,-2,-3,-4,-5,-6,-7,-8,-9,-10,-22,-19,-21,-1,-17,-18,-12,-11,-20,-13,-14,-15,-16,]),}
+
+_lr_action = {}
+for _k, _v in _lr_action_items.items():
+   for _x,_y in zip(_v[0],_v[1]):
+      if not _x in _lr_action:  _lr_action[_x] = {}
+      _lr_action[_x][_k] = _y
+del _lr_action_items
+
+_lr_goto_items = {'expr':([0,1,15,],[1,15,15,]),'numeric':([0,1,3,4,7,11,15,16,18,19,23,24,25,26,],[10,10,17,20,21,27,10,17,20,21,29,30,31,32,]),}
+
+_lr_goto = {}
+for _k, _v in _lr_goto_items.items():
+   for _x, _y in zip(_v[0], _v[1]):
+       if not _x in _lr_goto: _lr_goto[_x] = {}
+       _lr_goto[_x][_k] = _y
+del _lr_goto_items
+_lr_productions = [
+  ("S' -> expr","S'",1,None,None,None),
+  ('expr -> expr expr','expr',2,'p_expr2exprexpr','DiceParser.py',216),
+  ('expr -> PLAINTEXT','expr',1,'p_expr2PLAINTEXT','DiceParser.py',228),
+  ('expr -> PLUS','expr',1,'p_expr2PLAINTEXT','DiceParser.py',229),
+  ('expr -> MINUS','expr',1,'p_expr2PLAINTEXT','DiceParser.py',230),
+  ('expr -> MULTIPLY','expr',1,'p_expr2PLAINTEXT','DiceParser.py',231),
+  ('expr -> DIVIDE','expr',1,'p_expr2PLAINTEXT','DiceParser.py',232),
+  ('expr -> OPEN','expr',1,'p_expr2PLAINTEXT','DiceParser.py',233),
+  ('expr -> CLOSE','expr',1,'p_expr2PLAINTEXT','DiceParser.py',234),
+  ('expr -> TIMES','expr',1,'p_expr2PLAINTEXT','DiceParser.py',235),
+  ('expr -> numeric','expr',1,'p_expr2numeric','DiceParser.py',242),
+  ('expr -> REPEAT numeric','expr',2,'p_expr2REPEAT','DiceParser.py',248),
+  ('expr -> numeric TIMES','expr',2,'p_expr2TIMES','DiceParser.py',254),
+  ('numeric -> numeric PLUS numeric','numeric',3,'p_numeric2PLUSMINUS','DiceParser.py',260),
+  ('numeric -> numeric MINUS numeric','numeric',3,'p_numeric2PLUSMINUS','DiceParser.py',261),
+  ('numeric -> numeric MULTIPLY numeric','numeric',3,'p_numeric2MULTIPLY','DiceParser.py',267),
+  ('numeric -> numeric DIVIDE numeric','numeric',3,'p_numeric2DIVIDE','DiceParser.py',273),
+  ('numeric -> PLUS numeric','numeric',2,'p_numeric2UNARY_PLUSMINUS','DiceParser.py',279),
+  ('numeric -> MINUS numeric','numeric',2,'p_numeric2UNARY_PLUSMINUS','DiceParser.py',280),
+  ('numeric -> NUMBER','numeric',1,'p_numeric2NUMBER','DiceParser.py',286),
+  ('numeric -> OPEN numeric CLOSE','numeric',3,'p_numeric2brackets','DiceParser.py',292),
+  ('numeric -> DIE','numeric',1,'p_numeric2DIE','DiceParser.py',298),
+  ('expr -> error','expr',1,'p_expr2error','DiceParser.py',305),
+]
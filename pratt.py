@@ -0,0 +1,269 @@
+# Pratt
+# a hand-written engine for the grammar of DiceParser, without ply
+# a single regex scanner produces the same tokens as the ply lexer,
+# and a Pratt parser builds the same expression trees as the LALR tables, including where they recover from errors
+# the binding powers mirror the precedence table: + and - bind at 20, * and / at 30, and unary minus at 40,
+# while unary plus binds its operand at 20, so +2*3 is +(2*3) and -2*3 is (-2)*3
+# at the top level, + - and brackets only start a numeric expression when a numeric token could follow them,
+# otherwise they are plain text
+# a syntax error inside a numeric expression discards everything after the last complete operand
+# that the LALR parser could reduce, and is then rendered as an error marker before the offending token
+# a syntax error at the end of the message fails the whole message, as it does with ply
+# a repeat count before a numeric expression takes the whole expression, and one after it only follows a numeric
+# expression with dice at the top level, so anywhere else it is plain text,
+# or a syntax error inside a numeric expression
+
+from contextlib import contextmanager
+import logging
+import re
+from time import perf_counter
+
+import budget
+from DiceParser import (
+	budgeted,
+	compileWithTables,
+	dieValue,
+	lexerRegexFlags,
+	numberValue,
+	lexStage,
+	parseStage,
+	repeat,
+	rollExpression,
+	t_CLOSE,
+	t_DIE,
+	t_DIVIDE,
+	t_MINUS,
+	t_MULTIPLY,
+	t_NUMBER,
+	t_OPEN,
+	t_PLAINTEXT,
+	t_PLUS,
+	t_REPEAT,
+	t_TIMES,
+)
+from expression import (
+	Brackets,
+	Concatenation,
+	countDice,
+	Dice,
+	Error,
+	Number,
+	Product,
+	Quotient,
+	Result,
+	Sum,
+	Text,
+	Unary,
+)
+
+MAX_DEPTH = 200
+
+log = logging.getLogger("parser")
+
+END = None
+RULES = (
+	("REPEAT", t_REPEAT.__doc__),
+	("NUMBER", t_NUMBER.__doc__),
+	("DIE", t_DIE.__doc__),
+	("TIMES", t_TIMES.__doc__),
+	("OPEN", t_OPEN),
+	("CLOSE", t_CLOSE),
+	("PLUS", t_PLUS),
+	("MINUS", t_MINUS),
+	("MULTIPLY", t_MULTIPLY),
+	("DIVIDE", t_DIVIDE),
+	("PLAINTEXT", t_PLAINTEXT),
+)
+scanner = re.compile("|".join(f"(?P<{name}>{rule})" for name, rule in RULES), flags=lexerRegexFlags)
+
+LEAVES = ("NUMBER", "DIE")
+NUMERIC_STARTS = ("NUMBER", "DIE", "PLUS", "MINUS", "OPEN")
+# the tables reduce a bracket at the top level to text when another bracket follows it
+BRACKETED_STARTS = ("NUMBER", "DIE", "PLUS", "MINUS")
+BINARY = dict(PLUS=(20, Sum), MINUS=(20, Sum), MULTIPLY=(30, Product), DIVIDE=(30, Quotient))
+UNARY = dict(PLUS=20, MINUS=40)
+
+
+class Recover(Exception):
+	"""Unwinds the parse to the nearest operator whose left operand can be kept."""
+
+
+class EndOfInput(Exception):
+	pass
+
+
+class TooDeep(Exception):
+	pass
+
+
+def scan(text):
+	"""Returns the types, values and positions of the tokens of text."""
+	spendToken = budget.current().spendTokens
+	types, values, positions = [], [], []
+	position = 0
+	while position < len(text):
+		match = scanner.match(text, position)
+		if match is None:
+			log.error(f"Unable to tokenise {text[position]!r} at position {position} in {text!r}.")
+			position += 1
+			continue
+		spendToken()
+		type = match.lastgroup
+		if type == "NUMBER":
+			value = numberValue(match.group('num'))
+		elif type == "DIE":
+			value = dieValue(match.groupdict(), match.group())
+		else:
+			value = match.group()
+		types.append(type)
+		values.append(value)
+		positions.append(position)
+		position = match.end()
+	return types, values, positions
+
+
+def compileExpression(text):
+	"""Compiles a message into the same expression tree as DiceParser.compileWithTables."""
+	start = perf_counter()
+	parser = Parser(text)
+	scanned = perf_counter()
+	lexStage.observe(scanned - start)
+	try:
+		expression = parser.message()
+	except EndOfInput:
+		expression = None
+	except TooDeep:
+		return compileWithTables(text)
+	parseStage.observe(perf_counter() - scanned)
+	return expression
+
+
+class Parser:
+	def __init__(self, text):
+		self.text = text
+		self.types, self.values, self.positions = scan(text)
+		self.position = 0
+		self.depth = 0
+		# set between a syntax error and the error marker that replaces the discarded tokens
+		self.recovering = False
+
+	def peek(self):
+		return self.types[self.position] if self.position < len(self.types) else END
+
+	def take(self):
+		self.position += 1
+		return self.types[self.position - 1], self.values[self.position - 1]
+
+	def message(self):
+		parts = []
+		while self.recovering or self.position < len(self.types):
+			parts.append(self.item())
+		if not parts:
+			self.fail()
+		return parts[0] if len(parts) == 1 else Concatenation(tuple(parts))
+
+	def item(self):
+		if self.recovering:
+			self.recovering = False
+			return Error()
+		type, value = self.take()
+		if type in LEAVES:
+			return self.result(self.operators(leaf(type, value), 0))
+		if type in UNARY and self.peek() in LEAVES:
+			return self.result(self.operators(self.unary(type, value), 0))
+		if type == "OPEN" and self.peek() in BRACKETED_STARTS:
+			try:
+				numeric = self.brackets(value)
+			except Recover:
+				return Text(value)
+			return self.result(self.operators(numeric, 0))
+		if type == "REPEAT":
+			# the scanner only matches a repeat count right before a die
+			return repeat(self.operators(leaf(*self.take()), 0), before=value)
+		return Text(value)
+
+	def result(self, numeric):
+		if not self.recovering and self.peek() == "TIMES" and countDice(numeric):
+			return repeat(numeric, after=self.take()[1])
+		return Result(numeric)
+
+	def numeric(self, power):
+		type = self.peek()
+		if type not in NUMERIC_STARTS:
+			self.fail()
+		type, value = self.take()
+		if type in LEAVES:
+			left = leaf(type, value)
+		elif type == "OPEN":
+			left = self.brackets(value)
+		else:
+			left = self.unary(type, value)
+		return self.operators(left, power)
+
+	def operators(self, left, power):
+		while not self.recovering:
+			type = self.peek()
+			if type not in BINARY or BINARY[type][0] <= power:
+				break
+			operatorPower, node = BINARY[type]
+			operator = self.take()[1]
+			try:
+				right = self.numeric(operatorPower)
+			except Recover:
+				break
+			left = node(left, operator, right)
+		return left
+
+	def unary(self, type, operator):
+		with self.nested():
+			return Unary(operator, self.numeric(UNARY[type]))
+
+	def brackets(self, open):
+		with self.nested():
+			inner = self.numeric(0)
+		if self.recovering:
+			raise Recover()
+		if self.peek() != "CLOSE":
+			self.fail()
+		return Brackets(open, inner, self.take()[1])
+
+	@contextmanager
+	def nested(self):
+		"""Counts how deeply brackets and unary operators are nested,
+		so deep nesting falls back to the LALR tables rather than overflowing the stack."""
+		self.depth += 1
+		if self.depth > MAX_DEPTH:
+			raise TooDeep()
+		try:
+			yield
+		finally:
+			self.depth -= 1
+
+	def fail(self):
+		"""Reports a syntax error at the next token, and starts recovering from it."""
+		if self.position >= len(self.types):
+			log.error("Parser ran out of tokens to parse.")
+			raise EndOfInput()
+		value = repr(self.values[self.position])
+		log.error(
+			f"Unable to parse the token {value} of type {self.types[self.position]} "
+			f"at position {self.positions[self.position]} in {self.text!r}."
+		)
+		self.recovering = True
+		raise Recover()
+
+
+def leaf(type, value):
+	if type == "NUMBER":
+		return Number(value)
+	return Dice(value['numDice'], value['numSides'], value['range'], value['rangeSize'], value['code'])
+
+
+class PrattParser:
+	"""Parses and rolls messages like DiceParser.parser, with the hand-written engine."""
+
+	def parse(self, text):
+		return budgeted(lambda: rollExpression(compileExpression(text)))
+
+
+parser = PrattParser()
@@ -0,0 +1,197 @@
+# Render
+# formats rolls within the output budget of a message, and fits replies into discord messages
+# a reply can only show MESSAGE_LIMIT characters, or MESSAGE_LIMIT in each of MAX_SPLIT_MESSAGES messages when
+# replies are split, so a list of rolls is only formatted while the message has characters left to show it
+# a list that does not fit shows as many rolls from its start and end as it can, and elides the middle,
+# and once the characters are spent, lists only say how many rolls they hold,
+# so the text of a huge pool is never built only to be thrown away
+# every result, and the marker of a list that did not fit, is charged against the budget too, first from room kept for
+# RESULT_WIDTH characters per result, and once that is spent as well, lists shrink to a bare ellipsis,
+# so a message of many pools still has room for the results at its end
+# should a reply with all of its echoed text elided still be too long, a run of rolls from its middle is merged into
+# a single marker, so its first and last results are always shown
+# the message text echoed around the rolls is the first thing to give way: it keeps room for at most half the reply,
+# and when the reply would still be too long, one span from the middle of the echoed text is elided,
+# so the results at the end of a long message are never the part that is cut off
+# the output budget is kept per thread, like the budget of budget.py
+
+from contextlib import contextmanager
+from math import inf
+import threading
+
+MESSAGE_LIMIT = 2000
+MAX_SPLIT_MESSAGES = 5
+ELLIPSIS = "…"
+# room kept for the results that follow the rolls, like " = 3159"
+RESULT_RESERVE = 32
+# room kept for each result of a message, like " = 341", and for a marker like "[… 100 rolls …]"
+RESULT_WIDTH = 24
+
+# whether long replies are split into several messages, rather than cut short
+split = False
+
+
+class Output:
+	def __init__(self, characters=inf):
+		self.limit = self.characters = characters
+		self.reserved = 0
+		self.resultRoom = 0
+
+	def spend(self, text):
+		self.characters -= len(text)
+		return text
+
+	def reserve(self, text):
+		"""Keeps room for text that is always shown whole, like the name the reply starts with."""
+		self.spend(text)
+		self.reserved += len(text)
+
+	def reserveEchoed(self, characters, results=0):
+		"""Keeps room for the results after the rolls, RESULT_WIDTH for each of results within half of the budget,
+		and for up to half of what is left for the echoed message text, which is characters long."""
+		self.characters -= RESULT_RESERVE
+		self.resultRoom = max(0, min(results * RESULT_WIDTH, self.characters // 2))
+		self.characters -= self.resultRoom
+		self.characters -= min(characters, self.characters // 2)
+
+	def spendResult(self, text):
+		"""Spends text that stands for a result or a list of rolls, from the room kept for results while it lasts."""
+		kept = min(len(text), self.resultRoom)
+		self.resultRoom -= kept
+		self.characters -= len(text) - kept
+		return text
+
+
+UNLIMITED = Output()
+state = threading.local()
+
+
+def current():
+	return getattr(state, 'output', UNLIMITED)
+
+
+@contextmanager
+def limit(output):
+	"""Makes output the output budget of this thread for the duration of the block."""
+	previous = current()
+	state.output = output
+	try:
+		yield output
+	finally:
+		state.output = previous
+
+
+def setSplit(enabled):
+	global split
+	split = enabled
+
+
+def replyCharacters():
+	"""The most characters one reply can show."""
+	return MESSAGE_LIMIT * (MAX_SPLIT_MESSAGES if split else 1)
+
+
+def formatList(items, width):
+	"""Formats items like str(list(items)), within the output budget of this thread.
+	width is the most characters any one item and its separator take, so the shown items are picked without
+	formatting the others. items can be any sequence that can be sliced, like a numpy array."""
+	output = current()
+	count = len(items)
+	if count * width <= output.characters:
+		return output.spend("[" + ", ".join(map(str, items)) + "]")
+	elided = f"{ELLIPSIS} {count} rolls {ELLIPSIS}"
+	shown = int(max(0, output.characters - len(elided) - 2) // width)
+	if shown < 2:
+		if max(output.characters, output.resultRoom) < len(elided) + 2:
+			elided = ELLIPSIS
+		return output.spendResult(f"[{elided}]")
+	head = items[:shown - shown // 2]
+	tail = items[count - shown // 2:]
+	return output.spend(
+		"[" + ", ".join(map(str, head)) + f", {ELLIPSIS} {count - shown} more {ELLIPSIS}, " + ", ".join(map(str, tail)) + "]"
+	)
+
+
+def fitEchoed(texts, echoed):
+	"""Returns the parts of a reply, texts, with one span from the middle of the echoed message text elided so the reply
+	fits in the output budget of this thread. echoed says which of the parts are echoed text, and the others, the rolls
+	and their results, are never shortened, but are merged into one marker from the middle if they alone are too long."""
+	output = current()
+	excess = output.reserved + sum(map(len, texts)) - output.limit
+	if excess <= 0:
+		return texts
+	length = sum(len(text) for text, isEchoed in zip(texts, echoed) if isEchoed)
+	# the span is counted in characters of echoed text only, and replaced by a single ellipsis
+	kept = length - excess - len(ELLIPSIS)
+	if kept < 0:
+		return mergeMiddle(["" if isEchoed else text for text, isEchoed in zip(texts, echoed)], excess - length)
+	start = kept - kept // 2
+	end = length - kept // 2
+	fitted = []
+	position = 0
+	for text, isEchoed in zip(texts, echoed):
+		if isEchoed:
+			cutFrom = min(max(start - position, 0), len(text))
+			cutTo = min(max(end - position, 0), len(text))
+			marker = ELLIPSIS if position <= start < position + len(text) else ""
+			position += len(text)
+			text = text[:cutFrom] + marker + text[cutTo:]
+		fitted.append(text)
+	return fitted
+
+
+def mergeMiddle(texts, excess):
+	"""Replaces a run of parts from the middle of texts, but never the first or last, with one marker that says how
+	many it holds, so texts are excess characters shorter, or as short as they can be."""
+	start = end = len(texts) // 2
+	removed = merged = 0
+	marker = ""
+	while removed - len(marker) < excess and (start > 1 or end < len(texts) - 1):
+		# the run grows to the right and left in turn, so it stays in the middle
+		if end < len(texts) - 1 and (end - start) % 2 == 0 or start <= 1:
+			text = texts[end]
+			end += 1
+		else:
+			start -= 1
+			text = texts[start]
+		removed += len(text)
+		merged += bool(text)
+		marker = f"{ELLIPSIS} {merged} more {ELLIPSIS}"
+	if excess <= 0 or not merged:
+		return texts
+	return texts[:start] + [marker] + texts[end:]
+
+
+def fit(reply):
+	"""Returns a reply, or the list of messages of a reply, as a list of messages that discord accepts.
+	A message over the limit is cut short, or split into at most MAX_SPLIT_MESSAGES messages when replies are split."""
+	messages = []
+	for message in [reply] if isinstance(reply, str) else reply:
+		if len(message) <= MESSAGE_LIMIT:
+			messages.append(message)
+		elif split:
+			messages += splitMessage(message)
+		else:
+			messages.append(shorten(message, MESSAGE_LIMIT))
+	return messages
+
+
+def shorten(text, limit):
+	return text if len(text) <= limit else text[:limit - len(ELLIPSIS)] + ELLIPSIS
+
+
+def splitMessage(text, limit=MESSAGE_LIMIT, count=MAX_SPLIT_MESSAGES):
+	"""Splits text into at most count messages of at most limit characters, preferring to split at line breaks,
+	then at spaces. Whatever does not fit in the last message is cut short."""
+	messages = []
+	while len(text) > limit and len(messages) < count - 1:
+		end = text.rfind("\n", 0, limit + 1)
+		if end <= 0:
+			end = text.rfind(" ", 0, limit + 1)
+		if end <= 0:
+			end = limit
+		messages.append(text[:end])
+		# the line break or space that the text was split at is not needed in either message
+		text = text[end + 1:] if text[end:end + 1] in ("\n", " ") else text[end:]
+	messages.append(shorten(text, limit))
+	return [message for message in messages if message]
@@ -0,0 +1,199 @@
+# RNG
+# the sources of randomness that dice are rolled from
+# a source draws random bytes in bulk into a buffer, and turns them into rolls by rejection sampling:
+# each roll takes the smallest machine word that can hold the number of sides, and words from the top of
+# the word's range that would favour the low faces are thrown away, so every face is exactly as likely
+# DiceRandom draws its bytes from a seedable generator, numpy's PCG64 if numpy is installed or else the Mersenne Twister
+# of the random module, so the same seed always rolls the same dice on the same installation,
+# and SecureDiceRandom draws them from the operating system, for tables that do not trust a predictable generator
+# rolling.py rolls every die from the source that is current on its thread, see rolling.using
+# a big pool can instead be rolled as the number of dice that land on each face, with one multinomial draw,
+# made of a binomial draw per face, so its cost depends on the number of sides rather than the number of dice
+# binomial draws use inversion for small means, and the BTRS transformed rejection sampler of Hörmann otherwise
+
+from array import array
+from math import floor, lgamma, log, sqrt
+import os
+from random import Random
+import threading
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+BUFFER_BYTES = 64 * 1024
+# binomial draws with a smaller mean than this are drawn by inversion
+INVERSION_MEAN = 10
+# the array type codes of unsigned words of 1, 2, 4 and 8 bytes
+WORD_CODES = {array(code).itemsize: code for code in "QLIHB"}
+WORD_BYTES = tuple(sorted(WORD_CODES))
+
+
+class DiceRandom:
+	"""Rolls dice from a buffer of random bytes, which is refilled in bulk from a seedable generator."""
+
+	secure = False
+
+	def __init__(self, seed=None, bufferBytes=BUFFER_BYTES):
+		self.seed = seed
+		self.random = numpy.random.default_rng(seed) if numpy else Random(seed)
+		self.bufferBytes = bufferBytes
+		self.buffer = b""
+		self.position = 0
+		self.lock = threading.Lock()
+
+	def randomBytes(self, count):
+		if numpy:
+			return self.random.bytes(count)
+		return self.random.getrandbits(count * 8).to_bytes(count, "little")
+
+	def take(self, count):
+		"""Returns the next count random bytes, refilling the buffer when it runs low."""
+		with self.lock:
+			if count > len(self.buffer) - self.position:
+				if count > self.bufferBytes:
+					return self.randomBytes(count)
+				self.buffer = self.buffer[self.position:] + self.randomBytes(self.bufferBytes)
+				self.position = 0
+			start = self.position
+			self.position += count
+			return self.buffer[start:self.position]
+
+	def rolls(self, numSides, count):
+		"""Returns a list of count rolls of a die with numSides sides."""
+		if numSides == 1:
+			return [1] * count
+		size = wordBytes(numSides)
+		if size is None:
+			return [self.bigRoll(numSides) for i in range(count)]
+		code = WORD_CODES[size]
+		span = 1 << (8 * size)
+		# the largest multiple of numSides that fits in a word, so every face has as many words below it
+		limit = span - span % numSides
+		rolls = []
+		while len(rolls) < count:
+			words = array(code, self.take(size * wordsNeeded(count - len(rolls), span, limit)))
+			rolls += [word % numSides + 1 for word in words if word < limit]
+		del rolls[count:]
+		return rolls
+
+	def array(self, numSides, count):
+		"""Returns a numpy array of count rolls of a die with numSides sides, drawn from the same bytes as rolls."""
+		size = wordBytes(numSides)
+		if numSides == 1 or size is None or size > 4:
+			# numpy can only do arithmetic on words that fit in an int64 without losing their top bit
+			return numpy.array(self.rolls(numSides, count), dtype=object if numSides > 1 << 62 else numpy.int64)
+		dtype = numpy.dtype(f"<u{size}")
+		span = 1 << (8 * size)
+		limit = span - span % numSides
+		chunks = []
+		remaining = count
+		while remaining > 0:
+			words = numpy.frombuffer(self.take(size * wordsNeeded(remaining, span, limit)), dtype=dtype)
+			if limit < span:
+				words = words[words < limit]
+			chunks.append(words[:remaining])
+			remaining -= len(chunks[-1])
+		words = numpy.concatenate(chunks) if len(chunks) > 1 else chunks[0]
+		# every face fits in the word, so only the rolls are widened, for summing without overflow
+		return (words % numSides + 1).astype(numpy.int64)
+
+	def uniform(self):
+		"""Returns a float drawn uniformly from the open interval (0, 1)."""
+		return ((int.from_bytes(self.take(7), "little") >> 3) + 0.5) / (1 << 53)
+
+	def binomial(self, trials, chance):
+		"""Returns how many of trials independent events, each with the given chance, happen."""
+		if chance > 0.5:
+			return trials - self.binomial(trials, 1 - chance)
+		if trials <= 0 or chance <= 0:
+			return 0
+		if trials * chance < INVERSION_MEAN:
+			return self.invertedBinomial(trials, chance)
+		return self.transformedRejectionBinomial(trials, chance)
+
+	def invertedBinomial(self, trials, chance):
+		odds = chance / (1 - chance)
+		while True:
+			u = self.uniform()
+			probability = (1 - chance) ** trials
+			count = 0
+			while u > probability and count < trials:
+				u -= probability
+				count += 1
+				probability *= odds * (trials - count + 1) / count
+			# rounding can leave u above the probability of every count, so that draw starts again
+			if u <= probability:
+				return count
+
+	def transformedRejectionBinomial(self, trials, chance):
+		spread = sqrt(trials * chance * (1 - chance))
+		b = 1.15 + 2.53 * spread
+		a = -0.0873 + 0.0248 * b + 0.01 * chance
+		c = trials * chance + 0.5
+		alpha = (2.83 + 5.1 / b) * spread
+		acceptAll = 0.92 - 4.2 / b
+		mode = floor((trials + 1) * chance)
+		logOdds = log(chance / (1 - chance))
+		h = lgamma(mode + 1) + lgamma(trials - mode + 1)
+		while True:
+			u = self.uniform() - 0.5
+			v = self.uniform()
+			us = 0.5 - abs(u)
+			count = floor((2 * a / us + b) * u + c)
+			if count < 0 or count > trials:
+				continue
+			if us >= 0.07 and v <= acceptAll:
+				return count
+			v = log(v * alpha / (a / (us * us) + b))
+			if v <= h - lgamma(count + 1) - lgamma(trials - count + 1) + (count - mode) * logOdds:
+				return count
+
+	def counts(self, numSides, count):
+		"""Returns how many of count dice with numSides sides land on each face, lowest face first.
+		Each face takes its binomial share of the dice that did not land on the faces before it."""
+		counts = []
+		remaining = count
+		for face in range(numSides - 1):
+			landed = self.binomial(remaining, 1 / (numSides - face))
+			counts.append(landed)
+			remaining -= landed
+		counts.append(remaining)
+		return counts
+
+	def bigRoll(self, numSides):
+		"""Rolls a die too big for a machine word, from as many bytes as it needs."""
+		bits = (numSides - 1).bit_length()
+		size = (bits + 7) // 8
+		while True:
+			value = int.from_bytes(self.take(size), "little") >> (size * 8 - bits)
+			if value < numSides:
+				return value + 1
+
+
+class SecureDiceRandom(DiceRandom):
+	"""Rolls dice from bytes drawn from the operating system's cryptographically secure generator."""
+
+	secure = True
+
+	def __init__(self, bufferBytes=BUFFER_BYTES):
+		super().__init__(None, bufferBytes)
+
+	def randomBytes(self, count):
+		return os.urandom(count)
+
+
+def wordBytes(numSides):
+	"""Returns the bytes in the smallest word that can hold the number of sides, or None if no word is big enough."""
+	for size in WORD_BYTES:
+		if numSides < 1 << (8 * size):
+			return size
+	return None
+
+
+def wordsNeeded(count, span, limit):
+	"""Returns how many words to draw to expect count of them to be accepted, with a margin so one draw is usually
+	enough."""
+	expected = count * span // limit + 1
+	return expected + (expected - count) + 8 if limit < span else count
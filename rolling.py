@@ -0,0 +1,182 @@
+# Rolling
+# draws the rolls for a pool of dice, and sums the highest or lowest of them that are kept
+# when numpy is installed, pools of at least VECTORISED_POOL_SIZE dice are drawn in a single batch,
+# and the kept dice are selected with a partial partition rather than a full sort
+# without numpy, or for small pools, the rolls are drawn as a list by the pure python backend
+# pools of at least COUNTED_POOL_SIZE dice, with at least DICE_PER_COUNTED_SIDE dice for every side,
+# are rolled as the number of dice landing on each face instead, and rendered as those counts,
+# so they cost a die of the budget per side rather than per die, and pools of up to MAX_COUNTED_DICE are allowed
+# either way the rolls come from the source of randomness current on the thread (see rng.py),
+# which is shared by every thread unless one is given its own with using
+
+from contextlib import contextmanager
+import os
+import threading
+from time import perf_counter
+
+import audit
+import budget
+import metrics
+import render
+from rng import DiceRandom, SecureDiceRandom
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+VECTORISED_POOL_SIZE = 32
+COUNTED_POOL_SIZE = 1000
+DICE_PER_COUNTED_SIDE = 32
+MAX_COUNTED_DICE = 10**9
+ROLLS_BETWEEN_CHECKS = 1024
+
+HIGHEST, LOWEST = range(2)
+PYTHON, NUMPY = "python", "numpy"
+rollStage = metrics.stages["roll"]
+formatStage = metrics.stages["format"]
+
+FAST, SECURE = "fast", "secure"
+SOURCES = (FAST, SECURE)
+
+backend = NUMPY if numpy else PYTHON
+source = DiceRandom()
+state = threading.local()
+
+
+def reseed():
+	"""Gives a forked process its own source of randomness, so it never rolls the same dice as its parent."""
+	global source
+	source = SecureDiceRandom() if source.secure else DiceRandom()
+
+
+def setSource(name=FAST, seed=None):
+	"""Replaces the shared source of randomness. Only the fast source can be seeded."""
+	global source
+	if name == SECURE:
+		if seed is not None:
+			raise ValueError("The secure source of randomness can not be seeded.")
+		source = SecureDiceRandom()
+	elif name == FAST:
+		source = DiceRandom(seed)
+	else:
+		raise ValueError(f"Unknown source of randomness {name!r}. Use one of {', '.join(SOURCES)}.")
+
+
+def current():
+	return getattr(state, 'source', source)
+
+
+@contextmanager
+def using(diceSource):
+	"""Rolls every die on this thread from diceSource for the duration of the block,
+	like a DiceRandom with a seed, to replay the rolls of a request."""
+	previous = getattr(state, 'source', None)
+	state.source = diceSource
+	try:
+		yield diceSource
+	finally:
+		if previous is None:
+			del state.source
+		else:
+			state.source = previous
+
+
+if hasattr(os, 'register_at_fork'):
+	os.register_at_fork(after_in_child=reseed)
+
+
+def setBackend(name):
+	global backend
+	if name == NUMPY and numpy is None:
+		raise ValueError("The numpy roll backend requires numpy to be installed.")
+	if name not in (PYTHON, NUMPY):
+		raise ValueError(f"Unknown roll backend {name!r}.")
+	backend = name
+
+
+def isCounted(numDice, numSides):
+	return numDice >= COUNTED_POOL_SIZE and numDice >= numSides * DICE_PER_COUNTED_SIDE
+
+
+def rollDice(tok):
+	if isCounted(tok['numDice'], tok['numSides']):
+		return rollCounted(tok)
+	start = perf_counter()
+	limit = budget.current()
+	limit.spendDice(tok['numDice'])
+	diceSource = current()
+	if backend == NUMPY and tok['numDice'] >= VECTORISED_POOL_SIZE:
+		rolls = diceSource.array(tok['numSides'], tok['numDice'])
+		result = int(vectorisedKeptSum(rolls, tok['range'], tok['rangeSize']))
+	else:
+		rolls = []
+		for rolled in range(0, tok['numDice'], ROLLS_BETWEEN_CHECKS):
+			limit.checkTime()
+			rolls += diceSource.rolls(tok['numSides'], min(ROLLS_BETWEEN_CHECKS, tok['numDice'] - rolled))
+		result = keptSum(rolls, tok['range'], tok['rangeSize'])
+	name, auditLog = audit.current()
+	if auditLog.granularity != audit.OFF:
+		auditLog.recordRolls(name, tok['numSides'], rolls if isinstance(rolls, list) else rolls.tolist())
+	rolled = perf_counter()
+	rollStage.observe(rolled - start)
+	if len(rolls) == 1:
+		text = render.current().spend(str(rolls[0]))
+	else:
+		text = render.formatList(rolls, len(str(tok['numSides'])) + 2)
+	formatStage.observe(perf_counter() - rolled)
+	return dict(result=result, text=text)
+
+
+def rollCounted(tok):
+	"""Rolls a pool as how many dice land on each face, and renders it as those counts, highest face first."""
+	start = perf_counter()
+	if tok['numDice'] > MAX_COUNTED_DICE:
+		raise budget.ParserTimeoutError(f"Exceeded the maximum of {MAX_COUNTED_DICE} dice in one pool.")
+	budget.current().spendDice(tok['numSides'])
+	counts = current().counts(tok['numSides'], tok['numDice'])
+	result = countedKeptSum(counts, tok['range'], tok['rangeSize'])
+	name, auditLog = audit.current()
+	if auditLog.granularity != audit.OFF:
+		auditLog.recordCounts(name, tok['numSides'], counts)
+	rolled = perf_counter()
+	rollStage.observe(rolled - start)
+	faces = [f"{face}×{counts[face - 1]}" for face in range(len(counts), 0, -1) if counts[face - 1]]
+	text = render.formatList(faces, max(map(len, faces)) + 2)
+	formatStage.observe(perf_counter() - rolled)
+	return dict(result=result, text=text)
+
+
+def countedKeptSum(counts, keep, keepSize):
+	"""Sums the highest or lowest keepSize dice of a pool, given how many dice landed on each face."""
+	faces = range(len(counts), 0, -1) if keep == HIGHEST else range(1, len(counts) + 1)
+	total = 0
+	for face in faces:
+		if keepSize <= 0:
+			break
+		kept = min(counts[face - 1], keepSize)
+		total += face * kept
+		keepSize -= kept
+	return total
+
+
+def keptSum(rolls, keep, keepSize):
+	rolls = sorted(rolls)
+	max = len(rolls)
+	min = 0
+	if keep == HIGHEST:
+		min = len(rolls) - keepSize
+	else:
+		max = keepSize
+	return sum(rolls[min: max])
+
+
+def vectorisedKeptSum(rolls, keep, keepSize):
+	numDice = len(rolls)
+	if keepSize <= 0:
+		return 0
+	if keepSize >= numDice:
+		return rolls.sum()
+	if keep == HIGHEST:
+		return numpy.partition(rolls, numDice - keepSize)[numDice - keepSize:].sum()
+	return numpy.partition(rolls, keepSize - 1)[:keepSize].sum()
@@ -0,0 +1,94 @@
+# Scheduler
+# queues messages per channel, or per guild, and serves the queues with a fixed set of async workers
+# the workers take turns between the queues that have work, one message at a time, so a channel spamming pools only
+# holds up its own queue, and every other channel still gets the next turn
+# a queue only has one message handled at a time, so the replies in a channel come in the order it was typed in
+# each queue holds at most queueSize messages, and a message that finds its queue full is turned away,
+# so a flood can never queue more work than the bot will get to soon
+# the first message turned away after its queue was last empty is BUSY, so the channel can be told once,
+# and the rest are DROPPED silently
+# everything runs on the event loop, so nothing here needs a lock
+
+import asyncio
+from collections import deque
+import logging
+from time import perf_counter
+
+import metrics
+
+WORKERS = 4
+QUEUE_SIZE = 20
+QUEUED = "queued"
+BUSY = "busy"
+DROPPED = "dropped"
+
+log = logging.getLogger("scheduler")
+queueStage = metrics.stages["queue"]
+droppedCounter = metrics.counters["dropped"]
+
+
+class Scheduler:
+	def __init__(self, handle, workers=WORKERS, queueSize=QUEUE_SIZE):
+		"""handle is the coroutine function that every queued job is awaited with."""
+		self.handle = handle
+		self.workerCount = workers
+		self.queueSize = queueSize
+		# the jobs of every key with work queued or being handled, with the time they were queued
+		self.queues = {}
+		# the keys with jobs waiting and none being handled, in the order of their turns
+		self.ready = deque()
+		self.turns = asyncio.Semaphore(0)
+		self.overflowing = set()
+		self.tasks = []
+
+	def start(self):
+		# the loop only keeps a weak reference to its tasks
+		self.tasks = [asyncio.create_task(self.work()) for i in range(self.workerCount)]
+
+	def close(self):
+		for task in self.tasks:
+			task.cancel()
+		self.tasks = []
+
+	def submit(self, key, job):
+		"""Queues job behind the other jobs of key. Returns QUEUED, or BUSY or DROPPED if the queue of key is full."""
+		queue = self.queues.get(key)
+		if queue is None:
+			queue = self.queues[key] = deque()
+			self.ready.append(key)
+			self.turns.release()
+		elif len(queue) >= self.queueSize:
+			droppedCounter.inc()
+			if key in self.overflowing:
+				return DROPPED
+			self.overflowing.add(key)
+			return BUSY
+		queue.append((perf_counter(), job))
+		return QUEUED
+
+	async def work(self):
+		while True:
+			await self.turns.acquire()
+			key = self.ready.popleft()
+			queue = self.queues[key]
+			queued, job = queue.popleft()
+			queueStage.observe(perf_counter() - queued)
+			try:
+				await self.handle(job)
+			except Exception as e:
+				log.debug(f"{repr(e)} from a job queued for {key}")
+			finally:
+				if queue:
+					self.ready.append(key)
+					self.turns.release()
+				else:
+					del self.queues[key]
+					self.overflowing.discard(key)
+
+	def stats(self):
+		return dict(
+			queues=len(self.queues),
+			depth=sum(map(len, self.queues.values())),
+			deepest=max(map(len, self.queues.values()), default=0),
+			workers=len(self.tasks),
+		)
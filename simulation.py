@@ -0,0 +1,240 @@
+# Simulation
+# evaluates a compiled numeric expression for many trials in one batch
+# every dice node is sampled once for all trials as a trials-wide array, and operators apply elementwise over the arrays
+# with numpy the arrays are numpy arrays, otherwise they are plain lists
+# numpy draws the dice of a few trials at a time, so no more than SAMPLE_BYTES of rolls are held at once,
+# and pools big enough to be rolled as counts of each face (see rolling.py) are drawn as those counts
+# divisions by zero are recorded as nan, just like when rolling
+# unless a seed is given, the samplers are seeded from the source of randomness of the thread, see rolling.current,
+# so a seeded source, like that of --seed or rolling.using, simulates the same trials every time
+
+from math import isnan, nan, sqrt
+from random import Random
+
+import budget
+from expression import (
+	countDice,
+	fold,
+	Brackets,
+	Dice,
+	Number,
+	Product,
+	Quotient,
+	Result,
+	Sum,
+	Unary,
+)
+from rolling import current, HIGHEST, isCounted, keptSum, numpy
+
+MAX_TRIALS = 1000000
+MAX_SIMULATED_DICE = 20000000 if numpy else 1000000
+TRIALS_BETWEEN_CHECKS = 1024
+SAMPLE_BYTES = 16 * 1024 * 1024
+MAX_INT64 = 2**63 - 1
+HISTOGRAM_BARS = 20
+HISTOGRAM_WIDTH = 30
+SEED_BYTES = 8
+
+
+def trialCap(node):
+	"""The most trials a single request may simulate for node, so that no expression costs more than
+	MAX_SIMULATED_DICE rolls, and none needs more than SAMPLE_BYTES for the rolls of a single trial."""
+	if numpy and fold(node, lambda node, flags: any(flags) or (isinstance(node, Dice) and not fitsInSample(node))):
+		return 0
+	return min(MAX_TRIALS, MAX_SIMULATED_DICE // max(1, countDice(node)))
+
+
+def fitsInSample(node):
+	"""Whether numpy can sample a trial of the dice node without holding more than SAMPLE_BYTES of rolls.
+	Pools that keep every die are summed a slice of dice at a time, so only pools that keep some of their dice
+	have to hold every roll of a trial at once."""
+	if node.rangeSize >= node.numDice or isCounted(node.numDice, node.numSides) or isHuge(node):
+		return True
+	return node.numDice * 8 <= SAMPLE_BYTES
+
+
+def isHuge(node):
+	"""Whether the rolls or the sums of the dice node might not fit in an int64, so numpy can not sample it."""
+	return node.numSides * max(1, node.numDice) > MAX_INT64
+
+
+def simulate(node, trials, seed=None):
+	"""Evaluates the numeric expression node for the given number of trials, and returns the Simulation of the results.
+	Without a seed, the trials are seeded from the source of randomness of this thread."""
+	if isinstance(node, Result):
+		node = node.numeric
+	if seed is None:
+		seed = int.from_bytes(current().take(SEED_BYTES), "little")
+	sampler = NumpySampler(trials, seed) if numpy else PythonSampler(trials, seed)
+	checkTime = budget.current().checkTime
+
+	def visit(node, args):
+		checkTime()
+		return sampler.visit(node, args)
+
+	return Simulation(sampler.results(fold(node, visit)))
+
+
+class NumpySampler:
+	def __init__(self, trials, seed):
+		self.trials = trials
+		self.generator = numpy.random.default_rng(seed)
+
+	def visit(self, node, args):
+		if isinstance(node, Number):
+			return numpy.full(self.trials, node.value, dtype=float)
+		if isinstance(node, Dice):
+			return self.roll(node)
+		if isinstance(node, Brackets):
+			return args[0]
+		if isinstance(node, Unary):
+			return -args[0] if '-' in node.operator else args[0]
+		left, right = args
+		if isinstance(node, Sum):
+			return left - right if '-' in node.operator else left + right
+		if isinstance(node, Product):
+			return left * right
+		if isinstance(node, Quotient):
+			with numpy.errstate(divide='ignore', invalid='ignore'):
+				return numpy.where(right != 0, left / numpy.where(right != 0, right, 1), nan)
+		raise TypeError(f"Can not simulate {type(node).__name__}.")
+
+	def roll(self, node):
+		if node.rangeSize <= 0:
+			return numpy.zeros(self.trials)
+		if isHuge(node):
+			# python ints have no upper bound, so the pure python sampler rolls these, from a seed drawn here
+			sampler = PythonSampler(self.trials, int(self.generator.integers(MAX_INT64)))
+			return numpy.array(sampler.roll(node), dtype=float)
+		if isCounted(node.numDice, node.numSides):
+			sample, width = self.countedSums, node.numSides
+		else:
+			sample, width = self.rolledSums, node.numDice
+		rows = max(1, SAMPLE_BYTES // (8 * width))
+		checkTime = budget.current().checkTime
+		sums = []
+		for start in range(0, self.trials, rows):
+			checkTime()
+			sums.append(sample(node, min(rows, self.trials - start)))
+		return numpy.concatenate(sums).astype(float)
+
+	def rolledSums(self, node, rows):
+		"""Sums the kept dice of each of rows trials, from rolls of every die."""
+		numDice, keepSize = node.numDice, node.rangeSize
+		if keepSize >= numDice:
+			columns = max(1, SAMPLE_BYTES // (8 * rows))
+			return sum(
+				self.generator.integers(1, node.numSides, size=(rows, min(columns, numDice - start)), endpoint=True)
+				.sum(axis=1)
+				for start in range(0, numDice, columns)
+			)
+		rolls = self.generator.integers(1, node.numSides, size=(rows, numDice), endpoint=True)
+		if node.range == HIGHEST:
+			rolls = numpy.partition(rolls, numDice - keepSize, axis=1)[:, numDice - keepSize:]
+		else:
+			rolls = numpy.partition(rolls, keepSize - 1, axis=1)[:, :keepSize]
+		return rolls.sum(axis=1)
+
+	def countedSums(self, node, rows):
+		"""Sums the kept dice of each of rows trials, from how many dice landed on each face."""
+		counts = self.generator.multinomial(node.numDice, [1 / node.numSides] * node.numSides, size=rows)
+		faces = numpy.arange(1, node.numSides + 1)
+		if node.range == HIGHEST:
+			counts, faces = counts[:, ::-1], faces[::-1]
+		# each face keeps its dice until the faces before it have kept keepSize dice
+		before = numpy.cumsum(counts, axis=1) - counts
+		kept = numpy.minimum(counts, numpy.maximum(node.rangeSize - before, 0))
+		return (kept * faces).sum(axis=1)
+
+	def results(self, values):
+		return values.tolist()
+
+
+class PythonSampler:
+	def __init__(self, trials, seed):
+		self.trials = trials
+		self.random = Random(seed)
+
+	def visit(self, node, args):
+		if isinstance(node, Number):
+			return [node.value] * self.trials
+		if isinstance(node, Dice):
+			return self.roll(node)
+		if isinstance(node, Brackets):
+			return args[0]
+		if isinstance(node, Unary):
+			return [-a for a in args[0]] if '-' in node.operator else args[0]
+		left, right = args
+		if isinstance(node, Sum):
+			if '-' in node.operator:
+				return [a - b for a, b in zip(left, right)]
+			return [a + b for a, b in zip(left, right)]
+		if isinstance(node, Product):
+			return [a * b for a, b in zip(left, right)]
+		if isinstance(node, Quotient):
+			return [a / b if b else nan for a, b in zip(left, right)]
+		raise TypeError(f"Can not simulate {type(node).__name__}.")
+
+	def roll(self, node):
+		numDice, numSides = node.numDice, node.numSides
+		if numSides > MAX_INT64:
+			# choices can only pick from ranges with fewer items than a machine word can count
+			randint = self.random.randint
+
+			def draw():
+				return [randint(1, numSides) for i in range(numDice)]
+		else:
+			faces = range(1, numSides + 1)
+			choices = self.random.choices
+
+			def draw():
+				return choices(faces, k=numDice)
+		checkTime = budget.current().checkTime
+		results = []
+		for start in range(0, self.trials, TRIALS_BETWEEN_CHECKS):
+			checkTime()
+			results += [
+				keptSum(draw(), node.range, node.rangeSize)
+				for i in range(min(TRIALS_BETWEEN_CHECKS, self.trials - start))
+			]
+		return results
+
+	def results(self, values):
+		return values
+
+
+class Simulation:
+	"""The results of a batch of trials, with a histogram and summary statistics of the defined results."""
+
+	def __init__(self, results):
+		self.trials = len(results)
+		self.results = sorted(result for result in results if not isnan(result))
+		self.undefined = self.trials - len(self.results)
+		count = len(self.results)
+		self.mean = sum(self.results) / count if count else nan
+		variance = sum((result - self.mean) ** 2 for result in self.results) / count if count else nan
+		self.standardDeviation = sqrt(variance) if count else nan
+
+	def percentile(self, fraction):
+		index = min(len(self.results) - 1, max(0, int(fraction * len(self.results) + 0.5) - 1))
+		return self.results[index]
+
+	def histogram(self, bars=HISTOGRAM_BARS):
+		"""Returns a list of (low, high, count) bins that split the range of results into at most bars equal widths.
+		Whole number results get one bin per value when there are few enough of them,
+		and results that are all the same get a single bin."""
+		if not self.results:
+			return []
+		low, high = self.results[0], self.results[-1]
+		if high == low:
+			return [(low, high, len(self.results))]
+		whole = all(float(result).is_integer() for result in (low, high))
+		if whole and high - low + 1 <= bars:
+			width = 1
+			bars = int(high - low + 1)
+		else:
+			width = (high - low) / bars
+		counts = [0] * bars
+		for result in self.results:
+			counts[min(bars - 1, int((result - low) / width))] += 1
+		return [(low + i * width, low + (i + 1) * width, count) for i, count in enumerate(counts)]
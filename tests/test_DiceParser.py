@@ -1,16 +1,41 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+from ply import lex, yacc
 import re
+import sys
+from tempfile import TemporaryDirectory
+import types
 import unittest
+from unittest.mock import patch
 
 from DiceParser import (
 	lexer, parser,
 	HIGHEST, LOWEST,
-	p_expr2numeric,
-	p_numeric2PLUSMINUS,
-	p_numeric2brackets,
-	p_numeric2DIE,
+	compileExpression,
+	Budget,
+	Context,
+	ExpressionCache,
 	ParserTimeoutError,
 )
+import audit
 import DiceParser
+from expression import (
+	addValues,
+	bracketValue,
+	describe,
+	evaluate,
+	formatNumeric,
+	Concatenation,
+	Dice,
+	Number,
+	Repeat,
+	Result,
+	Text,
+)
+import lextab
+import parsetab
+from rng import DiceRandom
+from rolling import rollDice
 
 
 class TestLexer(unittest.TestCase):
@@ -120,6 +145,20 @@ class TestLexer(unittest.TestCase):
 				plaintext += str(tok.value)
 			self.assertEqual(plaintext, expectedPlaintext)
 
+	def test_plainTextTokens_coverWholeRuns(self):
+		for text, expected in (
+			("Hello world", [("PLAINTEXT", "Hello world")]),
+			("hello  d20", [("PLAINTEXT", "hello  "), ("DIE", None)]),
+			("odd dog", [("PLAINTEXT", "odd dog")]),
+			("a  + b", [("PLAINTEXT", "a"), ("PLUS", "  + "), ("PLAINTEXT", "b")]),
+			("x2d6", [("PLAINTEXT", "x2d"), ("NUMBER", 6)]),
+			("see (this)", [("PLAINTEXT", "see"), ("OPEN", " ("), ("PLAINTEXT", "this"), ("CLOSE", ")")]),
+			("lowest\n d\n20", [("PLAINTEXT", "lowest\n d\n"), ("NUMBER", 20)]),
+		):
+			lexer.input(text)
+			tokens = [(tok.type, None if tok.type == "DIE" else tok.value) for tok in lexer]
+			self.assertEqual(tokens, expected, f"text is `{text}`")
+
 	def test_numericTokens(self):
 		for text, value in (
 			('0', 0),
@@ -297,6 +336,112 @@ class TestParser(unittest.TestCase):
 		DiceParser.MAX_EXECUTION_SECONDS = old_MAX
 
 
+class TestCompiledExpressions(unittest.TestCase):
+	def test_compilingDice_producesExpressionTree(self):
+		expression = compileExpression("a 2d20kh1")
+		self.assertEqual(expression, Concatenation((Text("a "), Result(Dice(2, 20, HIGHEST, 1)))))
+
+	def test_longPlainText_compilesIntoFewParts(self):
+		text = "The rogue sneaks past the guard, quietly; " * 50 + "d20 then " * 3
+		expression = compileExpression(text)
+		self.assertEqual(len(expression.parts), 7)
+		self.assertEqual(expression.parts[0], Text("The rogue sneaks past the guard, quietly; " * 50))
+
+	def test_evaluatingCompiledExpression_rollsFreshDice(self):
+		expression = compileExpression("100d1000")
+		self.assertNotEqual(evaluate(expression), evaluate(expression))
+
+	def test_evaluatingCompiledExpression_matchesParsing(self):
+		for text in (
+			'Hello world',
+			'4++-+8 --- 1',
+			'60/(2+8*0.5)/5',
+			'4/0',
+			'8 - 3 ) / 2',
+			'(8-3  after) / 2',
+		):
+			self.assertEqual(evaluate(compileExpression(text)), parser.parse(text))
+
+	def test_whenTextIsRepeated_thenCacheHits(self):
+		cache = ExpressionCache(maxsize=2)
+		first = cache.get("d20+5")
+		self.assertIs(cache.get("d20+5"), first)
+		self.assertEqual(cache.stats(), dict(hits=1, misses=1, evictions=0, size=1))
+
+	def test_whenCacheIsFull_thenLeastRecentlyUsedIsEvicted(self):
+		cache = ExpressionCache(maxsize=2)
+		cache.get("d4")
+		cache.get("d6")
+		cache.get("d4")
+		cache.get("d8")
+		self.assertEqual(cache.stats(), dict(hits=1, misses=3, evictions=1, size=2))
+		self.assertIn("d4", cache.expressions)
+		self.assertNotIn("d6", cache.expressions)
+
+
+class TestRepeat(unittest.TestCase):
+	def test_repeatTokens(self):
+		for text, expected in (
+			("6x 4d6kh3", [("REPEAT", "6x "), ("DIE", None)]),
+			("12 × d20", [("REPEAT", "12 × "), ("DIE", None)]),
+			("4d6kh3 x6", [("DIE", None), ("TIMES", " x6")]),
+			("2x more", [("NUMBER", 2), ("PLAINTEXT", "x more")]),
+			("d6 x2y", [("DIE", None), ("PLAINTEXT", " x"), ("NUMBER", 2), ("PLAINTEXT", "y")]),
+			("(2+3) x4", [("OPEN", "("), ("NUMBER", 2), ("PLUS", "+"), ("NUMBER", 3), ("CLOSE", ")"), ("TIMES", " x4")]),
+			("x2/2.53", [("PLAINTEXT", "x"), ("NUMBER", 2), ("DIVIDE", "/"), ("NUMBER", 2.53)]),
+		):
+			lexer.input(text)
+			tokens = [(tok.type, None if tok.type == "DIE" else tok.value) for tok in lexer]
+			self.assertEqual(tokens, expected, f"text is `{text}`")
+
+	def test_repeatBeforeOrAfter_compilesIntoRepeat(self):
+		stats = Dice(4, 6, HIGHEST, 3)
+		self.assertEqual(compileExpression("6x 4d6kh3"), Repeat(stats, 6, before="6x "))
+		self.assertEqual(
+			compileExpression("rolls 4d6kh3 x6 for stats"),
+			Concatenation((Text("rolls "), Repeat(stats, 6, after=" x6"), Text(" for stats"))),
+		)
+		self.assertEqual(
+			compileExpression("x2 damage"),
+			Concatenation((Text("x"), Result(Number(2)), Text(" damage"))),
+		)
+
+	def test_repeatWithoutDice_staysText(self):
+		for text, expected in (
+			("d20 to hit, damage is 10 x2 on crit", r"\d{1,2} to hit, damage is 10 x2 on crit$"),
+			("(2+3) x4", r"\(2\+3\) = 5 x4$"),
+			("x2/2.53", r"x2/2\.53 = 0\.79$"),
+		):
+			res = parser.parse(text)
+			self.assertTrue(re.match(expected, res), f"`{text}` was parsed into `{res}`")
+
+	def test_repeat_rollsEveryRepeat(self):
+		for text, expectedRegexp in (
+			("rolls 6x 4d6kh3 for stats", r"rolls 6x 4d6kh3 = \d{1,2}(, \d{1,2}){5} for stats$"),
+			("attacks d20+5 x3", r"attacks d20\+5 x3 = \d{1,2}, \d{1,2}, \d{1,2}$"),
+			("2x d20adv", r"2x d20adv = \d{1,2}, \d{1,2}$"),
+			("3d6dl1 x2", r"3d6dl1 x2 = \d{1,2}, \d{1,2}$"),
+		):
+			res = parser.parse(text)
+			self.assertTrue(re.match(expectedRegexp, res), f"`{text}` was parsed into `{res}`")
+
+	def test_describe_writesDiceCode(self):
+		for text, code in (
+			("d20 + 5", "d20 + 5"),
+			("4d6kh3", "4d6kh3"),
+			("4d6dh1", "4d6dh1"),
+			("D20dis+2", "D20dis+2"),
+			("(2d8/-2)", "(2d8/-2)"),
+		):
+			self.assertEqual(describe(compileExpression(text).numeric), code)
+		self.assertEqual(describe(Dice(4, 6, LOWEST, 3)), "4d6kl3")
+
+	def test_whenOverCaps_thenRaisesBeforeRolling(self):
+		for text in (f"{DiceParser.MAX_REPEATS + 1}x d6", f"{DiceParser.MAX_REPEATS}x 101d6", "2d6 x99999"):
+			with self.assertRaises(ParserTimeoutError, msg=text):
+				compileExpression(text)
+
+
 class TestParseFunctions(unittest.TestCase):
 	def test_expr2numeric(self):
 		for token, expectedOutput in (
@@ -312,11 +457,10 @@ class TestParseFunctions(unittest.TestCase):
 			(dict(text='19- 5', result=14), '19- 5 = 14'),
 			(dict(text='1- 4', result=-3), '1- 4 = -3'),
 		):
-			p = [None, token]
-			p_expr2numeric(p)
+			res = formatNumeric(token)
 			self.assertEqual(
-				p[0], expectedOutput,
-				f"The token {token} produced `{p[0]}`, but was expecting `{expectedOutput}`."
+				res, expectedOutput,
+				f"The token {token} produced `{res}`, but was expecting `{expectedOutput}`."
 			)
 
 	def test_numeric2PLUSMINUS(self):
@@ -338,10 +482,9 @@ class TestParseFunctions(unittest.TestCase):
 			),
 
 		):
-			p = [None, prev, cur, next]
-			p_numeric2PLUSMINUS(p)
-			self.assertEqual(p[0]['result'], prev['result'] + next['result'])
-			self.assertEqual(p[0]['text'], prev['text'] + cur + next['text'])
+			res = addValues(prev, cur, next)
+			self.assertEqual(res['result'], prev['result'] + next['result'])
+			self.assertEqual(res['text'], prev['text'] + cur + next['text'])
 
 	def test_numeric2brackets(self):
 		for prev, cur, next in (
@@ -361,10 +504,9 @@ class TestParseFunctions(unittest.TestCase):
 				' } ',
 			),
 		):
-			p = [None, prev, cur, next]
-			p_numeric2brackets(p)
-			self.assertEqual(p[0]['result'], cur['result'])
-			self.assertEqual(p[0]['text'], prev + cur['text'] + next)
+			res = bracketValue(prev, cur, next)
+			self.assertEqual(res['result'], cur['result'])
+			self.assertEqual(res['text'], prev + cur['text'] + next)
 
 	def test_numeric2DIE(self):
 		for token in (
@@ -411,9 +553,87 @@ class TestParseFunctions(unittest.TestCase):
 			dict(numDice=12, numSides=2, range=HIGHEST, rangeSize=11),
 			dict(numDice=12, numSides=1, range=LOWEST, rangeSize=1),
 		):
-			p = [None, token]
-			p_numeric2DIE(p)
-			res = int(p[0]['result'])
+			res = int(rollDice(token)['result'])
 			min = token['rangeSize']
 			max = token['rangeSize'] * token['numSides']
 			self.assertTrue(min <= res <= max, f"The token {token} produced {res}.")
+
+
+class TestDiceEngine(unittest.TestCase):
+	def tearDown(self):
+		audit.configure()
+		DiceParser.setEngine(DiceParser.PLY)
+
+	def test_everyThread_hasEngineOfItsOwn(self):
+		engine = DiceParser.currentEngine()
+		self.assertIs(DiceParser.currentEngine(), engine)
+		with ThreadPoolExecutor(1) as executor:
+			other = executor.submit(DiceParser.currentEngine).result()
+		self.assertIsNot(other, engine)
+		self.assertIsNot(other.lexer, engine.lexer)
+		self.assertIsNot(other.tables, engine.tables)
+		DiceParser.setEngine(DiceParser.PRATT)
+		self.assertEqual(DiceParser.currentEngine().name, DiceParser.PRATT)
+
+	def test_concurrentParses_areRolledAndAuditedForTheirOwnUser(self):
+		with TemporaryDirectory() as directory:
+			auditLog = audit.AuditLog(os.path.join(directory, "rolls.audit"), audit.DIE)
+
+			def roll(sides):
+				context = Context(f"user {sides}", auditLog=auditLog)
+				return [parser.parse(f"(1+{sides}) * 2d{sides} and 3d{sides}", context) for i in range(20)]
+
+			with ThreadPoolExecutor(8) as executor:
+				replies = dict(zip(range(2, 10), executor.map(roll, range(2, 10))))
+			auditLog.close()
+			records = list(audit.readRecords(auditLog.path))
+		for sides, texts in replies.items():
+			for text in texts:
+				self.assertRegex(text, rf"^\(1\+{sides}\) \* \[\d+, \d+\] = \d+ and \[\d+, \d+, \d+\] = \d+$")
+		self.assertEqual(len(records), 8 * 20 * 5)
+		self.assertTrue(all(name == f"user {numSides}" for _, name, numSides, _, _ in records))
+
+	def test_contextSource_replaysRolls(self):
+		engine = DiceParser.DiceEngine()
+		first = engine.parse("roll 10d20 and d100", Context(source=DiceRandom(3)))
+		self.assertEqual(engine.parse("roll 10d20 and d100", Context(source=DiceRandom(3))), first)
+
+	def test_contextBudget_limitsParse(self):
+		with self.assertRaises(ParserTimeoutError):
+			parser.parse("d20 + 3d6", Context(budget=Budget(dice=3)))
+
+
+class TestTables(unittest.TestCase):
+	"""The tables are generated ahead of time, so these fail whenever they are stale.
+	Run `python DiceParser.py` to regenerate them."""
+
+	def test_parserTables_matchGrammar(self):
+		grammar = yacc.ParserReflect(vars(DiceParser))
+		grammar.get_all()
+		self.assertEqual(parsetab._lr_signature, grammar.signature())
+
+	def test_lexerTables_matchTokenRules(self):
+		rules = lex.lex(module=DiceParser, reflags=DiceParser.lexerRegexFlags)
+		self.assertEqual(lextab._lexreflags, DiceParser.lexerRegexFlags)
+		# rules of equal length may be ordered differently, and can never match the same text, so only the set matters
+		tables = [regex for regex, names in lextab._lexstatere['INITIAL']]
+		self.assertEqual(splitRules(tables), splitRules(rules.lexstateretext['INITIAL']))
+
+	def test_loadLexer_whenTablesMissing_thenRaises(self):
+		with self.assertRaisesRegex(DiceParser.TablesError, "missing"):
+			DiceParser.loadLexer("missinglextab")
+
+	def test_loadLexer_whenTablesStale_thenRaises(self):
+		stale = types.ModuleType("stalelextab")
+		stale.__dict__.update({name: value for name, value in vars(lextab).items() if name.startswith("_lex")})
+		stale._tabversion = lextab._tabversion
+		renamed = [(regex.replace("(?P<t_TIMES>", "(?P<t_OTHER>"), names) for regex, names in lextab._lexstatere["INITIAL"]]
+		stale._lexstatere = {"INITIAL": renamed}
+		self.assertTrue(DiceParser.tablesMatch(lextab))
+		with patch.dict(sys.modules, stalelextab=stale):
+			with self.assertRaisesRegex(DiceParser.TablesError, "out of date"):
+				DiceParser.loadLexer("stalelextab")
+
+
+def splitRules(masterRegexes):
+	return sorted(rule for regex in masterRegexes for rule in ("|" + regex).split("|(?P<t_")[1:])
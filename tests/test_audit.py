@@ -0,0 +1,133 @@
+import os
+import subprocess
+import sys
+import time
+from tempfile import TemporaryDirectory
+import unittest
+
+import audit
+from audit import (
+	AuditLog,
+	formatRecord,
+	readRecords,
+	DIE, MESSAGE, OFF,
+	MAX_RECORDED_SIDES,
+	MAX_RECORDED_VALUE,
+	RECORD,
+)
+from DiceParser import parser, Context
+
+
+class Test_AuditLog(unittest.TestCase):
+	def setUp(self):
+		self.directory = TemporaryDirectory()
+		self.path = os.path.join(self.directory.name, "rolls.audit")
+
+	def tearDown(self):
+		audit.configure()
+		self.directory.cleanup()
+
+	def test_whenAuditingDice_thenEveryDieIsRecorded(self):
+		auditLog = AuditLog(self.path, DIE)
+		auditLog.recordRolls("Bob", 6, [4, 1, 6])
+		auditLog.recordRolls("Théo", 20, [17])
+		auditLog.close()
+		records = [record[1:] for record in readRecords(self.path)]
+		self.assertEqual(records, [
+			("Bob", 6, 1, 4),
+			("Bob", 6, 1, 1),
+			("Bob", 6, 1, 6),
+			("Théo", 20, 1, 17),
+		])
+		self.assertEqual(os.path.getsize(self.path), len(audit.MAGIC) + 4 * RECORD.size)
+
+	def test_whenAuditingMessages_thenRollsAreTalliedPerMessage(self):
+		auditLog = AuditLog(self.path, MESSAGE)
+		with auditLog.message("Bob"):
+			auditLog.recordRolls("Bob", 6, [4, 1, 6])
+			auditLog.recordRolls("Bob", 20, [17])
+		with auditLog.message("Bob"):
+			pass
+		auditLog.close()
+		self.assertEqual([record[1:] for record in readRecords(self.path)], [("Bob", 0, 4, 28)])
+
+	def test_whenAuditingCounts_thenEachFaceIsRecorded(self):
+		for granularity, expected in (
+			(DIE, [("Bob", 6, 2, 4), ("Bob", 6, 5, 30)]),
+			(MESSAGE, [("Bob", 6, 7, 34)]),
+		):
+			auditLog = AuditLog(self.path, granularity)
+			auditLog.recordCounts("Bob", 6, [0, 2, 0, 0, 0, 5])
+			auditLog.close()
+			self.assertEqual([record[1:] for record in readRecords(self.path)], expected)
+			os.remove(self.path)
+
+	def test_whenDiceAreTooBigForTheirFields_thenTheFieldsSaturate(self):
+		sides, roll = 5 * 10**9, 2**64
+		for granularity, expected in (
+			(DIE, [("Bob", MAX_RECORDED_SIDES, 1, 4 * 10**9), ("Bob", MAX_RECORDED_SIDES, 1, MAX_RECORDED_VALUE)]),
+			(MESSAGE, [("Bob", MAX_RECORDED_SIDES, 2, MAX_RECORDED_VALUE)]),
+		):
+			auditLog = AuditLog(self.path, granularity)
+			auditLog.recordRolls("Bob", sides, [4 * 10**9, roll])
+			auditLog.close()
+			self.assertEqual([record[1:] for record in readRecords(self.path)], expected)
+			os.remove(self.path)
+
+	def test_parsingDiceTooBigForTheirFields_isStillAudited(self):
+		for granularity in (DIE, MESSAGE):
+			audit.configure(self.path, granularity)
+			reply = parser.parse("d5000000000 and 3d10000000000000000000000", Context("Bob"))
+			audit.configure()
+			self.assertRegex(reply, r"^\d+ and \[\d+, \d+, \d+] = \d+$")
+			self.assertIn(MAX_RECORDED_VALUE, [value for _, _, _, _, value in readRecords(self.path)])
+			os.remove(self.path)
+
+	def test_whenAuditingIsOff_thenNothingIsWritten(self):
+		auditLog = AuditLog(None, OFF)
+		auditLog.recordRolls("Bob", 6, [4, 1, 6])
+		auditLog.close()
+		self.assertEqual(auditLog.buffer, bytearray())
+
+	def test_whenBufferFills_thenBackgroundWriterFlushes(self):
+		auditLog = AuditLog(self.path, DIE, flushBytes=RECORD.size * 10, flushSeconds=60)
+		auditLog.recordRolls("Bob", 6, [1] * 10)
+		for i in range(100):
+			if os.path.exists(self.path) and os.path.getsize(self.path) > len(audit.MAGIC):
+				break
+			time.sleep(0.01)
+		self.assertEqual(len(list(readRecords(self.path))), 10)
+		auditLog.close()
+
+	def test_parsingAMessage_isAuditedUnderTheRollersName(self):
+		audit.configure(self.path, DIE)
+		parser.parse("roll 3d6 and d20", Context("Bob"))
+		audit.configure()
+		records = list(readRecords(self.path))
+		self.assertEqual([(name, numSides) for _, name, numSides, _, _ in records], [("Bob", 6)] * 3 + [("Bob", 20)])
+
+	def test_rejectsUnknownGranularity(self):
+		with self.assertRaises(ValueError):
+			AuditLog(self.path, "every other die")
+
+
+class Test_reader(unittest.TestCase):
+	def test_formatsRecords(self):
+		self.assertTrue(formatRecord(0, "Bob", 6, 1, 4).endswith(" Bob rolled 4/6"))
+		self.assertTrue(formatRecord(0, "Bob", 6, 3, 11).endswith(" Bob rolled 3d6 totalling 11"))
+		self.assertTrue(formatRecord(0, "Bob", 0, 4, 28).endswith(" Bob rolled 4 dice totalling 28"))
+		self.assertTrue(formatRecord(0, "Bob", MAX_RECORDED_SIDES, 1, 7).endswith(f" Bob rolled 7/{MAX_RECORDED_SIDES}+"))
+
+	def test_decodesFileFromCommandLine(self):
+		with TemporaryDirectory() as directory:
+			path = os.path.join(directory, "rolls.audit")
+			auditLog = AuditLog(path, DIE)
+			auditLog.recordRolls("Bob", 8, [3, 5])
+			auditLog.close()
+			output = subprocess.run(
+				[sys.executable, "-m", "audit", path],
+				capture_output=True, text=True, check=True,
+			).stdout.splitlines()
+		self.assertEqual(len(output), 2)
+		self.assertTrue(output[0].endswith("Bob rolled 3/8"))
+		self.assertTrue(output[1].endswith("Bob rolled 5/8"))
@@ -0,0 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import unittest
+
+from budget import (
+	current,
+	limit,
+	Budget,
+	ParserTimeoutError,
+	UNLIMITED,
+)
+import DiceParser
+from DiceParser import parser
+import rolling
+
+
+class Test_Budget(unittest.TestCase):
+	def test_whenDiceRunOut_thenRaises(self):
+		budget = Budget(dice=10)
+		budget.spendDice(10)
+		with self.assertRaises(ParserTimeoutError):
+			budget.spendDice(1)
+
+	def test_whenTokensRunOut_thenRaises(self):
+		budget = Budget(tokens=2)
+		budget.spendTokens()
+		budget.spendTokens()
+		with self.assertRaises(ParserTimeoutError):
+			budget.spendTokens()
+
+	def test_whenTimeRunsOut_thenRaises(self):
+		budget = Budget(seconds=0)
+		with self.assertRaises(ParserTimeoutError):
+			budget.checkTime()
+
+	def test_limitsNest_andRestoreThePreviousBudget(self):
+		outer, inner = Budget(), Budget()
+		self.assertIs(current(), UNLIMITED)
+		with limit(outer):
+			with limit(inner):
+				self.assertIs(current(), inner)
+			self.assertIs(current(), outer)
+		self.assertIs(current(), UNLIMITED)
+
+
+class Test_budgetedParsing(unittest.TestCase):
+	def test_whenTooManyDice_thenRaisesBeforeRolling(self):
+		# pools of few sides are rolled as counts of each face, so the dice are dice of many sides
+		sides = DiceParser.MAX_DICE
+		with self.assertRaises(ParserTimeoutError):
+			parser.parse(f"{DiceParser.MAX_DICE + 1}d{sides}")
+		with self.assertRaises(ParserTimeoutError):
+			parser.parse(f"{DiceParser.MAX_DICE}d{sides} + d6")
+
+	def test_whenCountedPoolHasTooManySides_thenRaises(self):
+		sides = DiceParser.MAX_DICE + 1
+		with self.assertRaises(ParserTimeoutError):
+			parser.parse(f"{sides * rolling.DICE_PER_COUNTED_SIDE}d{sides}")
+
+	def test_whenTooManyTokens_thenRaises(self):
+		with self.assertRaises(ParserTimeoutError):
+			parser.parse("1+" * DiceParser.MAX_TOKENS + "d4")
+
+	def test_parsingInWorkerThreads_succeeds_withoutStartingThreads(self):
+		with ThreadPoolExecutor(4) as executor:
+			threads = threading.active_count()
+			results = list(executor.map(parser.parse, ["d20+5"] * 40 + ["3d6adv"] * 40))
+			self.assertLessEqual(threading.active_count(), threads + 4)
+		self.assertTrue(all(results))
+
+	def test_budgetOfOneThread_doesNotLeakIntoAnother(self):
+		errors = []
+
+		def parseSlowly():
+			try:
+				with limit(Budget(seconds=0)):
+					DiceParser.compileExpression("d20")
+			except ParserTimeoutError as e:
+				errors.append(e)
+
+		thread = threading.Thread(target=parseSlowly)
+		thread.start()
+		thread.join()
+		self.assertEqual(len(errors), 1)
+		self.assertTrue(parser.parse("d20"))
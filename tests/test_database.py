@@ -0,0 +1,54 @@
+import os
+import tempfile
+import threading
+import unittest
+
+import database
+from db.models import Alias
+
+
+class TestDatabase(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.engine = database.configure(f"sqlite:///{os.path.join(self.directory.name, 'aliases.sqlite3')}")
+		Alias.metadata.create_all(self.engine)
+
+	def tearDown(self):
+		self.engine.dispose()
+		self.directory.cleanup()
+		Alias.metadata.create_all(database.configure("sqlite:///:memory:"))
+
+	def test_fileDatabase_usesWriteAheadLog(self):
+		with self.engine.connect() as connection:
+			self.assertEqual(connection.execute("PRAGMA journal_mode").scalar(), "wal")
+			self.assertEqual(connection.execute("PRAGMA synchronous").scalar(), 1)
+
+	def test_addsListsAndRemovesAliases(self):
+		database.addAlias(1, "slam", "slams for d6")
+		database.addAlias(1, "stab", "d4")
+		database.addAlias(2, "slam", "d8")
+		self.assertEqual(database.aliasesOf(1), dict(slam="slams for d6", stab="d4"))
+		self.assertEqual(database.removeAlias(1, "slam"), "slams for d6")
+		self.assertIsNone(database.removeAlias(1, "slam"))
+		self.assertEqual(database.aliasesOf(1), dict(stab="d4"))
+		self.assertEqual(database.aliasesOf(2), dict(slam="d8"))
+
+	def test_whenBlockRaises_thenSessionIsRolledBack(self):
+		with self.assertRaises(KeyError):
+			with database.session() as session:
+				session.add(Alias(user=1, name="slam", definition="d6"))
+				session.flush()
+				raise KeyError()
+		self.assertEqual(database.aliasesOf(1), {})
+
+	def test_queries_runOnDatabaseThread_fromAnyThread(self):
+		@database.onDatabaseThread
+		def threadName():
+			return threading.current_thread().name
+
+		@database.onDatabaseThread
+		def nested():
+			return threadName()
+
+		self.assertTrue(threadName().startswith("database"))
+		self.assertTrue(nested().startswith("database"))
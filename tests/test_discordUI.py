@@ -1,7 +1,8 @@
 from asyncio import run
 import logging
+import threading
 import unittest
-from unittest.mock import AsyncMock, Mock
+from unittest.mock import AsyncMock, Mock, patch
 
 import discordUI
 from discordUI import (
@@ -34,6 +35,12 @@ class Test_on_guild_join(unittest.IsolatedAsyncioTestCase):
 			self.assertEqual(logs.output[1], f"INFO:main:sent greeting to {channel.name=}")
 
 
+class Test_evaluate(unittest.IsolatedAsyncioTestCase):
+	async def test_evaluatesOnAnEvaluationThread(self):
+		with patch("discordUI.handleInput", lambda author, content: threading.current_thread().name):
+			self.assertTrue((await discordUI.evaluate(Mock(), "d20")).startswith("evaluate"))
+
+
 class Test_on_message(unittest.TestCase):
 	def test_doesNothing_whenMessageIsFromSelf(self):
 		discordUI.client = Mock()
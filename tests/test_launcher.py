@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+
+import launcher
+from launcher import IdentifyGate, formatShardIds, parseShardIds, shardArguments, shardOf, shardRanges
+
+
+def recordShards(arguments, gate, sharded, directory):
+	"""Stands in for a process of the bot, writing down its arguments and when it may identify its first shard."""
+	shardIds = parseShardIds(arguments[arguments.index("--shard-ids") + 1])
+	with open(os.path.join(directory, formatShardIds(shardIds)), "w") as file:
+		file.write(f"{sharded} {gate.delay(shardIds[0])}")
+
+
+class TestShards(unittest.TestCase):
+	def test_shardRanges_splitEveryShardEvenly(self):
+		self.assertEqual(shardRanges(8, 3), [range(0, 2), range(2, 5), range(5, 8)])
+		self.assertEqual(shardRanges(2, 4), [range(0, 1), range(1, 2)])
+		for shardCount, processes in ((16, 4), (7, 3), (1, 1)):
+			shards = [shard for ids in shardRanges(shardCount, processes) for shard in ids]
+			self.assertEqual(shards, list(range(shardCount)))
+
+	def test_shardIds_roundTrip(self):
+		for text, ids in (("3", [3]), ("0-3", [0, 1, 2, 3]), ("0-1,4,6-7", [0, 1, 4, 6, 7])):
+			self.assertEqual(parseShardIds(text), ids)
+		self.assertEqual(formatShardIds(range(4, 8)), "4-7")
+		self.assertEqual(formatShardIds([0, 1, 4]), "0,1,4")
+
+	def test_shardOf_usesTimestampOfSnowflake(self):
+		self.assertEqual(shardOf(41771983423143937, 1), 0)
+		self.assertEqual(shardOf(5 << 22, 4), 1)
+		self.assertEqual(shardOf((5 << 22) + 12345, 4), 1)
+
+	def test_shardArguments_addShardsOfProcess(self):
+		self.assertEqual(
+			shardArguments(["--workers", "2"], range(4, 8), 16),
+			["--workers", "2", "--shard-count", "16", "--shard-ids", "4-7"],
+		)
+
+
+class TestIdentifyGate(unittest.TestCase):
+	def test_delay_spacesIdentifiesOfEachBucket(self):
+		gate = IdentifyGate(maxConcurrency=2, interval=100)
+		delays = [gate.delay(shardId) for shardId in range(6)]
+		for shardId, delay in enumerate(delays):
+			self.assertAlmostEqual(delay, 100 * (shardId // 2), delta=1, msg=f"{shardId=}")
+
+	def test_launch_sharesGateBetweenProcesses(self):
+		with tempfile.TemporaryDirectory() as directory:
+			codes = launcher.launch(
+				["--verbose"], 3, 6, target=recordShards, targetArgs=(directory,), identifySeconds=100,
+			)
+			self.assertEqual(codes, [0, 0, 0])
+			self.assertEqual(sorted(os.listdir(directory)), ["0-1", "2-3", "4-5"])
+			delays = []
+			for name in os.listdir(directory):
+				with open(os.path.join(directory, name)) as file:
+					sharded, delay = file.read().split()
+				self.assertEqual(sharded, "True")
+				delays.append(float(delay))
+		self.assertEqual([round(delay, -2) for delay in sorted(delays)], [0, 100, 200])
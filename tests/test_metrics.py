@@ -0,0 +1,92 @@
+from urllib.request import urlopen
+import unittest
+
+from DiceParser import parser
+import metrics
+from metrics import Histogram
+
+
+class TestHistogram(unittest.TestCase):
+	def test_observe_countsIntoBucketOfUpperBound(self):
+		histogram = Histogram((1, 2, 4))
+		for seconds in (0.5, 1, 1.5, 3, 100):
+			histogram.observe(seconds)
+		self.assertEqual(histogram.counts, [2, 1, 1, 1])
+		self.assertEqual(histogram.sum, 106)
+		self.assertEqual(histogram.count, 5)
+
+	def test_quantile_returnsUpperBoundOfBucket(self):
+		histogram = Histogram((1, 2, 4))
+		self.assertIsNone(histogram.quantile(0.5))
+		for seconds in (0.5, 0.5, 1.5, 3):
+			histogram.observe(seconds)
+		self.assertEqual(histogram.quantile(0.5), 1)
+		self.assertEqual(histogram.quantile(0.99), 4)
+		histogram.observe(5)
+		self.assertEqual(histogram.quantile(1), float("inf"))
+
+	def test_drainAndMerge_moveObservations(self):
+		source, destination = Histogram((1,)), Histogram((1,))
+		source.observe(0.5)
+		destination.merge(*source.drain())
+		destination.merge(*source.drain())
+		self.assertEqual(source.count, 0)
+		self.assertEqual(destination.counts, [1, 0])
+		self.assertEqual(destination.sum, 0.5)
+
+
+class TestMetrics(unittest.TestCase):
+	def setUp(self):
+		metrics.reset()
+
+	def tearDown(self):
+		metrics.reset()
+
+	def test_timed_recordsEveryCallIntoStage(self):
+		@metrics.timed("database")
+		def query(fails):
+			if fails:
+				raise KeyError()
+
+		query(False)
+		with self.assertRaises(KeyError):
+			query(True)
+		self.assertEqual(metrics.stages["database"].count, 2)
+
+	def test_drain_onlyIncludesWhatWasRecorded(self):
+		metrics.stages["parse"].observe(1e-5)
+		metrics.counters["dice"].inc()
+		drained = metrics.drain()
+		self.assertEqual(set(drained[0]), {"parse"})
+		self.assertEqual(drained[1], dict(dice=1))
+		self.assertEqual(metrics.drain(), ({}, {}))
+		metrics.merge(drained)
+		self.assertEqual(metrics.stages["parse"].count, 1)
+		self.assertEqual(metrics.counters["dice"].value, 1)
+
+	def test_parsingAMessage_timesEachStage(self):
+		parser.parse("roll 3d6 and 200d6")
+		for stage in ("lex", "parse", "evaluate"):
+			self.assertEqual(metrics.stages[stage].count, 1, stage)
+		for stage in ("roll", "format"):
+			self.assertEqual(metrics.stages[stage].count, 2, stage)
+
+	def test_render_writesPrometheusText(self):
+		metrics.stages["lex"].observe(3e-6)
+		metrics.counters["messages"].inc(2)
+		text = metrics.render()
+		self.assertIn('dice_mice_stage_seconds_bucket{stage="lex",le="2.5e-06"} 0', text)
+		self.assertIn('dice_mice_stage_seconds_bucket{stage="lex",le="5e-06"} 1', text)
+		self.assertIn('dice_mice_stage_seconds_bucket{stage="lex",le="+Inf"} 1', text)
+		self.assertIn('dice_mice_stage_seconds_count{stage="lex"} 1', text)
+		self.assertIn("# TYPE dice_mice_messages_total counter\ndice_mice_messages_total 2\n", text)
+
+	def test_serve_servesRenderedMetrics(self):
+		metrics.counters["errors"].inc()
+		server = metrics.serve(0)
+		try:
+			with urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+				self.assertIn("dice_mice_errors_total 1", response.read().decode())
+		finally:
+			server.shutdown()
+			server.server_close()
@@ -1,27 +1,39 @@
 from collections import namedtuple
 import re
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 import unittest
 from unittest.mock import Mock
 
+import database
+from db.models import Alias
 import mice
+import render
+import rolling
 from mice import (
 	handleInput,
 	COMMANDS,
 	handleCommand,
 	parseCommand,
 	handleAlias,
-	Alias,
+	handleOdds,
+	handleSim,
+	handleMetrics,
+	handleReroll,
+	handleHistory,
+	AliasIndex,
+	History,
 )
 
 Author = namedtuple("Author", "id display_name")
-mice.engine = create_engine('sqlite:///:memory:')
-mice.Session = sessionmaker(bind=mice.engine)
-Alias.metadata.create_all(mice.engine)
+database.configure('sqlite:///:memory:')
+Alias.metadata.create_all(database.engine)
 
 
 class Test_handleInput(unittest.TestCase):
+	def test_whenMessageIsNearTheLimit_thenTheReplyEndsInItsResult(self):
+		reply = handleInput(Author(0, "Bob"), "x" * 1995 + " d20")
+		self.assertEqual(render.fit(reply), [reply])
+		self.assertRegex(reply, r"^Bob -- x+…x+ \d+$")
+
 	def test_doesNothing_whenMessageHasNoDice(self):
 		author = Author(0, "a user wanting to talk")
 		for text in (
@@ -48,6 +60,15 @@ class Test_handleInput(unittest.TestCase):
 			self.assertNotEqual(reply, "no dice")
 
 
+class Test_hasDice(unittest.TestCase):
+	def test_agreesWithDiceRegex(self):
+		for text in (
+			"", "hello world", "indi12", "4+4d", "d\n67", "d0", "d20", "D20", "2d6", "x2d6", "x d6", "12d0d4",
+			"_d4", "d&d at 8pm", "3rd floor d", "é2d6", "٣d6", "hit for d20adv+3", "dd2", "ad1 bd2 d3",
+		):
+			self.assertEqual(mice.hasDice(text), bool(mice.diceRegex.search(text)), repr(text))
+
+
 class Test_handleCommand(unittest.TestCase):
 	def test_delegatesToCorrectHandler(self):
 		msg = Mock(name="msg")
@@ -82,13 +103,17 @@ class Test_handleCommand(unittest.TestCase):
 
 
 class Test_handleAlias(unittest.TestCase):
+	def setUp(self):
+		mice.aliasIndex.clear()
+
 	def tearDown(self):
-		session = mice.Session()
-		session.query(Alias).delete()
+		with database.session() as session:
+			session.query(Alias).delete()
+		mice.aliasIndex.clear()
 
 	def test_storesAlias_whenDefinedByUser(self):
 		msg = Mock()
-		session = mice.Session()
+		session = database.Session()
 		for userId, content, name, definition in (
 			(0, "slam = slams for d6", "slam", "slams for d6"),
 			(86400, "rapier = d20adv + 5 then hit for d8", "rapier", "d20adv + 5 then hit for d8"),
@@ -103,7 +128,7 @@ class Test_handleAlias(unittest.TestCase):
 
 	def test_showsAlias_ifExists(self):
 		msg = Mock()
-		session = mice.Session()
+		session = database.Session()
 		for authorName, authorId, content, name, definition in (
 			("Bill", 0, "slam", "slam", "slams for d6"),
 			("Bert", 86400, " rapier ", "rapier", "d20adv + 5 then hit for d8"),
@@ -128,7 +153,7 @@ class Test_handleAlias(unittest.TestCase):
 
 	def test_givenAliasExists_whenDefinitionNotSpecified_thenDelete(self):
 		msg = Mock()
-		session = mice.Session()
+		session = database.Session()
 		for authorName, authorId, content, name, definition in (
 			("Bill", 0, "slam=", "slam", "slams for d6"),
 			("Bert", 86400, " rapier = ", "rapier", "d20adv + 5 then hit for d8"),
@@ -152,7 +177,7 @@ class Test_handleAlias(unittest.TestCase):
 			self.assertEqual(reply, f"{authorName} -- {name.strip()} is not aliased to anything.")
 
 	def test_whenNoArgumentsGiven_thenPrintAllAliases(self):
-		session = mice.Session()
+		session = database.Session()
 		msg = Mock()
 		msg.author.id = 21027
 		msg.author.display_name = "Dymorius"
@@ -186,7 +211,7 @@ class Test_handleAlias(unittest.TestCase):
 
 	def test_whenCommandIsAnAlias_thenParseDefinition(self):
 		msg = Mock()
-		session = mice.Session()
+		session = database.Session()
 		for authorName, authorId, name, definition, definitionRegex in (
 			("Bill", 0, "slam", "slams for d6", r"slams for \d"),
 			("Bert", 86400, "rapier", "d20adv + 5 then hit for d8", r"\[\d{1,2}, \d{1,2}\] \+ 5 = \d{1,2} then hit for \d"),
@@ -201,3 +226,234 @@ class Test_handleAlias(unittest.TestCase):
 			expectedReply = f"{authorName} -- {definitionRegex}"
 			self.assertTrue(reply, f"Alias {name} was not executed")
 			self.assertTrue(re.match(expectedReply, reply), f"{reply=} does not match desired {expectedReply=}")
+
+	def test_whenAliasIsDefinedAndDeleted_thenIndexFollows(self):
+		author = Author(31, "Bob")
+		misses = mice.aliasIndex.misses
+		self.assertIsNone(handleCommand(author, "!slam", "slam"))
+		handleAlias(author, "!alias slam = slams for d1", "slam = slams for d1")
+		self.assertEqual(handleCommand(author, "!slam", "slam"), "Bob -- slams for 1")
+		handleAlias(author, "!alias slam =", "slam =")
+		self.assertIsNone(handleCommand(author, "!slam", "slam"))
+		self.assertEqual(mice.aliasIndex.misses - misses, 1)
+
+
+class Test_importAndExportAliases(unittest.TestCase):
+	def setUp(self):
+		mice.aliasIndex.clear()
+		self.author = Author(77, "Bob")
+
+	def tearDown(self):
+		with database.session() as session:
+			session.query(Alias).delete()
+		mice.aliasIndex.clear()
+
+	def test_import_upsertsEveryAlias(self):
+		database.addAlias(self.author.id, "slam", "slams for d6")
+		block = "```\n# my fighter\nslam = slams for d1+1\n\n  stab=d4  \n```"
+		reply = handleAlias(self.author, "!alias import", "import\n" + block)
+		self.assertEqual(reply, "Bob -- imported 2 aliases.")
+		self.assertEqual(database.aliasesOf(self.author.id), dict(slam="slams for d1+1", stab="d4"))
+		self.assertEqual(handleCommand(self.author, "!slam", "slam"), "Bob -- slams for 1+1 = 2")
+
+	def test_whenAnyLineIsInvalid_thenImportsNothing(self):
+		block = "slam = d6\nnot an alias\nstab = 1+(2*\nslam = d8\nlong = " + "x" * 600
+		reply = handleAlias(self.author, "!alias import", "import\n" + block).split("\n")
+		self.assertEqual(reply, [
+			"Bob -- Nothing was imported, because:",
+			'line 2: expected "<shorthand> = <text>"',
+			"line 3: the definition of stab could not be parsed",
+			"line 4: slam is defined more than once",
+			"line 5: the definition is longer than 512 characters",
+		])
+		self.assertEqual(database.aliasesOf(self.author.id), {})
+
+	def test_whenImportIsDefinedAsName_thenDefinesAlias(self):
+		handleAlias(self.author, "!alias import = d20", "import = d20")
+		self.assertEqual(database.aliasesOf(self.author.id), {"import": "d20"})
+
+	def test_export_splitsAliasesIntoMessages(self):
+		aliases = {f"alias{i:03}": "d20 + " * 80 + "4" for i in range(20)}
+		database.upsertAliases(self.author.id, aliases)
+		reply = handleAlias(self.author, "!alias export", "export")
+		self.assertGreater(len(reply), 1)
+		self.assertTrue(all(len(part) <= mice.MESSAGE_LIMIT for part in reply))
+		block = "\n".join(reply)
+		self.assertEqual(mice.parseAliasBlock(block), (aliases, []))
+
+
+class Test_AliasIndex(unittest.TestCase):
+	def setUp(self):
+		self.load = Mock(side_effect=lambda userId: dict(slam=f"slams for d{userId}"))
+		self.index = AliasIndex(maxsize=2, load=self.load)
+
+	def test_whenUserIsIndexed_thenDoesNotLoad(self):
+		for i in range(3):
+			self.assertEqual(self.index.get(6), dict(slam="slams for d6"))
+		self.load.assert_called_once_with(6)
+		self.assertEqual(self.index.stats(), dict(hits=2, misses=1, evictions=0, size=1, hitRate=2 / 3))
+
+	def test_whenFull_thenEvictsLeastRecentlyUsedUser(self):
+		for userId in (4, 6, 4, 8, 4, 6):
+			self.index.get(userId)
+		self.assertEqual([call.args[0] for call in self.load.call_args_list], [4, 6, 8, 6])
+		self.assertEqual(self.index.stats()["evictions"], 2)
+
+	def test_setAndDiscard_updateIndexedUsersOnly(self):
+		self.index.get(4)
+		self.index.set(4, "stab", "d4")
+		self.index.set(6, "stab", "d6")
+		self.index.discard(4, "slam")
+		self.assertEqual(self.index.get(4), dict(stab="d4"))
+		self.assertEqual(self.index.get(6), dict(slam="slams for d6"))
+
+
+class Test_History(unittest.TestCase):
+	def test_keepsLastEntriesOfEachUser(self):
+		history = History(length=2)
+		for text in ("d4", "d6", "d8"):
+			history.record(1, text, text.upper())
+		self.assertEqual([entry.text for entry in history.entries(1)], ["d8", "d6"])
+		self.assertEqual(history.last(1).expression, "D8")
+		self.assertIsNone(history.last(2))
+		self.assertEqual(history.entries(2), [])
+
+	def test_whenFull_thenEvictsLeastRecentlyActiveUser(self):
+		history = History(maxsize=2)
+		for userId in (4, 6, 4, 8):
+			history.record(userId, "d20", None)
+		self.assertIsNone(history.last(6))
+		self.assertIsNotNone(history.last(4))
+		self.assertEqual(history.stats(), dict(users=2, evictions=1))
+
+	def test_merge_recordsJournalOfWorker(self):
+		journal = mice.HistoryJournal()
+		journal.record(3, "d20", "expression")
+		history = History()
+		history.merge(journal.drain())
+		self.assertEqual(history.last(3), ("d20", "expression"))
+		self.assertEqual(journal.drain(), [])
+
+
+class Test_handleReroll(unittest.TestCase):
+	def setUp(self):
+		mice.history.clear()
+		self.author = Author(12, "Bob")
+
+	def tearDown(self):
+		mice.history.clear()
+		with database.session() as session:
+			session.query(Alias).delete()
+		mice.aliasIndex.clear()
+
+	def test_rerollsLastDiceMessageWithoutParsing(self):
+		handleInput(self.author, "hits for d1+2")
+		mice.expressionCache.clear()
+		misses = mice.expressionCache.misses
+		self.assertEqual(handleReroll(self.author, "!!", ""), "Bob -- hits for 1+2 = 3")
+		self.assertEqual(mice.expressionCache.misses, misses)
+
+	def test_rerollsAliasInvocation(self):
+		database.addAlias(self.author.id, "slam", "slams for d1")
+		handleCommand(self.author, "!slam", "slam")
+		self.assertEqual(handleReroll(self.author, "!!", ""), "Bob -- slams for 1")
+		self.assertEqual(mice.history.last(self.author.id).text, "!slam")
+
+	def test_whenNothingWasRolled_thenSaysSo(self):
+		handleInput(self.author, "hello world")
+		self.assertEqual(handleReroll(self.author, "!!", ""), "Bob -- You have not rolled anything recently.")
+
+	def test_history_listsMostRecentFirst(self):
+		for text in ("d20+5", "casts  fireball\nfor 8d6 " + "!" * 200):
+			handleInput(self.author, text)
+		reply = handleHistory(self.author, "!history", "").split("\n")
+		self.assertEqual(len(reply), 3)
+		self.assertEqual(reply[1], "1. casts fireball for 8d6 " + "!" * 76 + "…")
+		self.assertEqual(reply[2], "2. d20+5")
+
+
+class Test_handleMetrics(unittest.TestCase):
+	def tearDown(self):
+		mice.admins.clear()
+
+	def test_whenAuthorIsNotAdmin_thenRefuses(self):
+		reply = handleMetrics(Author(5, "Bob"), "!metrics", "")
+		self.assertEqual(reply, "Bob -- Sorry. Only the admins of this bot can see its metrics.")
+
+	def test_whenAuthorIsAdmin_thenRepliesWithSummary(self):
+		mice.admins.add(5)
+		handleInput(Author(5, "Bob"), "hits for d6")
+		reply = handleMetrics(Author(5, "Bob"), "!metrics", "")
+		self.assertTrue(reply.startswith("Bob -- metrics since the bot started:\n"), reply)
+		self.assertIn("\nprecheck: ", reply)
+
+
+class Test_handleOdds(unittest.TestCase):
+	def test_repliesWithSummary(self):
+		author = Author(0, "Bob")
+		reply = handleOdds(author, "!odds d20", "d20")
+		self.assertEqual(reply, (
+			"Bob -- odds for d20: mean 10.5, standard deviation 5.77\n"
+			"percentiles: 5%: 1, 25%: 5, 50%: 10, 75%: 15, 95%: 19"
+		))
+
+	def test_whenComparisonGiven_thenRepliesWithChance(self):
+		author = Author(0, "Bob")
+		for args, chance in (
+			("d20 >= 15", "P(result >= 15) = 30.00%"),
+			("d20adv+5>=15", "P(result >= 15) = 79.75%"),
+			("2d6 < 7", "P(result < 7) = 41.67%"),
+			("d4 = 2", "P(result = 2) = 25.00%"),
+		):
+			reply = handleOdds(author, f"!odds {args}", args)
+			self.assertEqual(reply.split("\n")[-1], chance, f"{args=}")
+
+	def test_whenDivisionByZeroPossible_thenRepliesWithItsChance(self):
+		reply = handleOdds(Author(0, "Bob"), "!odds d6/(d2-1)", "d6/(d2-1)")
+		self.assertEqual(reply.split("\n")[-1], "P(division by zero) = 50.00%")
+
+	def test_whenNotASingleExpression_thenRepliesWithUsage(self):
+		for args in ("", "hello", "d20 and d8", "d0"):
+			reply = handleOdds(Author(0, "Bob"), f"!odds {args}", args)
+			self.assertIn('Type "!odds <dice expression>"', reply, f"{args=}")
+
+	def test_whenTooComplex_thenRepliesWithApology(self):
+		reply = handleOdds(Author(0, "Bob"), "!odds 1000000d1000000", "1000000d1000000")
+		self.assertIn("too complex", reply)
+
+
+class Test_handleSim(unittest.TestCase):
+	def test_repliesWithSummaryAndHistogram(self):
+		reply = handleSim(Author(0, "Bob"), "!sim 1000 2d6", "1000 2d6")
+		lines = reply.split("\n")
+		self.assertTrue(lines[0].startswith("Bob -- 1000 trials of 2d6: mean "), lines[0])
+		self.assertTrue(lines[1].startswith("percentiles: 5%: "), lines[1])
+		self.assertEqual(lines[2], "```")
+		self.assertTrue(lines[3].startswith(" 2 | "), lines[3])
+		self.assertTrue(lines[13].startswith("12 | "), lines[13])
+		self.assertEqual(lines[14], "```")
+
+	def test_whenTooManyTrials_thenCapsThem(self):
+		reply = handleSim(Author(0, "Bob"), "!sim 999999999 d20", "999999999 d20")
+		self.assertIn("(capped from 999999999)", reply.split("\n")[0])
+
+	def test_whenNoTrials_thenAsksForAtLeastOne(self):
+		reply = handleSim(Author(0, "Bob"), "!sim 0 d20", "0 d20")
+		self.assertEqual(reply, "Bob -- Sorry. Simulate at least 1 trial.")
+
+	def test_whenResultIsConstant_thenDrawsOneBar(self):
+		lines = handleSim(Author(0, "Bob"), "!sim 100 5/2", "100 5/2").split("\n")
+		self.assertEqual(lines[2:], ["```", "2.5 | " + "#" * 30 + " 100.00%", "```"])
+
+	def test_seededSource_repeatsTheSimulation(self):
+		replies = []
+		for i in range(2):
+			rolling.setSource(rolling.FAST, 12)
+			replies.append(handleSim(Author(0, "Bob"), "!sim 500 4d6kh3", "500 4d6kh3"))
+		rolling.setSource()
+		self.assertEqual(replies[0], replies[1])
+
+	def test_whenArgumentsAreInvalid_thenRepliesWithUsage(self):
+		for args in ("", "d20", "100", "100 hello", "many d20"):
+			reply = handleSim(Author(0, "Bob"), f"!sim {args}", args)
+			self.assertIn('Type "!sim <number of trials> <dice expression>"', reply, f"{args=}")
@@ -0,0 +1,88 @@
+from itertools import product
+import time
+import unittest
+
+from DiceParser import compileExpression
+from odds import (
+	diceDistribution,
+	distribution,
+	OddsTooComplexError,
+	Summary,
+)
+from rolling import HIGHEST, LOWEST
+
+
+def enumerateRolls(numDice, numSides, keep, keepSize):
+	dist = {}
+	for rolls in product(range(1, numSides + 1), repeat=numDice):
+		rolls = sorted(rolls)
+		kept = rolls[numDice - keepSize:] if keep == HIGHEST else rolls[:keepSize]
+		dist[sum(kept)] = dist.get(sum(kept), 0) + 1 / numSides ** numDice
+	return dist
+
+
+class Test_diceDistribution(unittest.TestCase):
+	def test_matchesEnumeratingEveryRoll(self):
+		for numDice, numSides, keep, keepSize in (
+			(1, 6, HIGHEST, 1),
+			(2, 6, HIGHEST, 2),
+			(4, 6, HIGHEST, 3),
+			(4, 6, LOWEST, 3),
+			(2, 20, HIGHEST, 1),
+			(2, 20, LOWEST, 1),
+			(5, 4, HIGHEST, 2),
+			(5, 4, LOWEST, 4),
+			(3, 1, HIGHEST, 2),
+		):
+			expected = enumerateRolls(numDice, numSides, keep, keepSize)
+			dist = diceDistribution(numDice, numSides, keep, keepSize)
+			self.assertEqual(set(dist), set(expected), f"{numDice}d{numSides} keeping {keepSize}")
+			for value, p in expected.items():
+				self.assertAlmostEqual(dist[value], p, places=12)
+
+	def test_whenNoDiceAreKept_thenResultIsZero(self):
+		self.assertEqual(diceDistribution(0, 6, HIGHEST, 0), {0: 1.0})
+		self.assertEqual(diceDistribution(3, 6, LOWEST, 0), {0: 1.0})
+
+	def test_largeKeepHighest_isSubSecond(self):
+		start = time.perf_counter()
+		dist = diceDistribution(20, 20, HIGHEST, 5)
+		self.assertLess(time.perf_counter() - start, 1)
+		self.assertAlmostEqual(sum(dist.values()), 1)
+
+	def test_whenPoolIsTooLarge_thenRaises(self):
+		with self.assertRaises(OddsTooComplexError):
+			diceDistribution(1000000, 1000000, HIGHEST, 1000000)
+
+
+class Test_distribution(unittest.TestCase):
+	def summarise(self, text):
+		return Summary(distribution(compileExpression(text)))
+
+	def test_summarisesExpressions(self):
+		for text, mean in (
+			("4d6kh3", 12.2446),
+			("d20adv", 13.825),
+			("d20dis", 7.175),
+			("d20adv+5", 18.825),
+			("8d6/2", 14),
+			("2d6*2", 14),
+			("-d4", -2.5),
+			("(d6+1)*(d6-1)", 11.25),
+			("3", 3),
+		):
+			self.assertAlmostEqual(self.summarise(text).mean, mean, places=3, msg=text)
+
+	def test_percentilesAndChances(self):
+		summary = self.summarise("d20")
+		self.assertEqual(summary.percentile(0.5), 10)
+		self.assertEqual(summary.percentile(0.95), 19)
+		self.assertAlmostEqual(summary.chance(">=", 15), 0.3)
+		self.assertAlmostEqual(summary.chance("<", 15), 0.7)
+		self.assertAlmostEqual(summary.chance("=", 20), 0.05)
+
+	def test_divisionByZero_isUndefined(self):
+		summary = self.summarise("d6/(d2-1)")
+		self.assertAlmostEqual(summary.undefined, 0.5)
+		self.assertAlmostEqual(summary.mean, 3.5)
+		self.assertAlmostEqual(summary.chance(">=", 1), 0.5)
@@ -0,0 +1,106 @@
+import ast
+import logging
+import os
+import random
+import unittest
+
+import DiceParser
+from DiceParser import compileWithTables, ParserTimeoutError
+from expression import Brackets, Number
+import pratt
+import rolling
+
+FUZZ_CASES = 3000
+FUZZ_PIECES = (
+	"1", "20", "3.5", "d6", "2d20kh1", "4d6l3", "d0",
+	"+", "-", "*", "/", "(", ")", " ", "a", "to", "-d", "!", "2x ", " x3", "x2",
+)
+
+
+def corpus():
+	"""The string constants of the DiceParser tests, which cover the corners of the grammar."""
+	with open(os.path.join(os.path.dirname(__file__), "test_DiceParser.py")) as file:
+		tree = ast.parse(file.read())
+	return sorted(set(
+		node.value for node in ast.walk(tree)
+		if isinstance(node, ast.Constant) and isinstance(node.value, str)
+	))
+
+
+def seed(value):
+	rolling.setSource(rolling.FAST, value)
+
+
+def compiled(compile, text):
+	"""Returns the expression tree of text, or the error raised when its repeats are over their caps."""
+	try:
+		return compile(text)
+	except ParserTimeoutError as e:
+		return repr(e)
+
+
+def fuzz(seed):
+	generator = random.Random(seed)
+	for i in range(FUZZ_CASES):
+		yield "".join(generator.choice(FUZZ_PIECES) for j in range(generator.randint(1, 12)))
+
+
+class TestPratt(unittest.TestCase):
+	def setUp(self):
+		logging.disable(logging.CRITICAL)
+
+	def tearDown(self):
+		logging.disable(logging.NOTSET)
+
+	def assertSameTree(self, text):
+		self.assertEqual(compiled(pratt.compileExpression, text), compiled(compileWithTables, text), text)
+
+	def test_corpus_compilesLikeTables(self):
+		for text in corpus():
+			self.assertSameTree(text)
+
+	def test_fuzz_compilesLikeTables(self):
+		for seed in range(3):
+			for text in fuzz(seed):
+				self.assertSameTree(text)
+
+	def test_precedence(self):
+		self.assertEqual(pratt.compileExpression("+2*3").numeric.operator, "+")
+		self.assertEqual(pratt.compileExpression("-2*3").numeric.operator, "*")
+		self.assertEqual(pratt.parser.parse("2+3*4-6/2"), "2+3*4-6/2 = 11")
+
+	def test_whenErrorIsAtEnd_thenReturnsNone(self):
+		for text in ("", "1+", "(2*", "3-(4+"):
+			self.assertIsNone(pratt.compileExpression(text), text)
+
+	def test_deepNesting_fallsBackToTables(self):
+		depth = pratt.MAX_DEPTH + 10
+		text = "2*" + "(" * depth + "1" + ")" * depth
+		node = pratt.compileExpression(text)
+		self.assertEqual(node, compileWithTables(text))
+		node = node.numeric.right
+		for i in range(depth):
+			self.assertIsInstance(node, Brackets)
+			node = node.inner
+		self.assertEqual(node, Number(1))
+
+	def test_parsesLikeTables(self):
+		for text in ("hits for 2d20kh1+5 and (d4+1)*2", "4/0", "1+(2*", "Hello world"):
+			seed(7)
+			expected = DiceParser.parser.parse(text)
+			seed(7)
+			self.assertEqual(pratt.parser.parse(text), expected)
+
+
+class TestSetEngine(unittest.TestCase):
+	def tearDown(self):
+		DiceParser.setEngine(DiceParser.PLY)
+
+	def test_whenPratt_thenCompilesWithPratt(self):
+		DiceParser.setEngine(DiceParser.PRATT)
+		self.assertIs(DiceParser.currentEngine().compiler, pratt.compileExpression)
+		self.assertEqual(DiceParser.parser.parse("1+2"), "1+2 = 3")
+
+	def test_whenUnknown_thenRaises(self):
+		with self.assertRaises(ValueError):
+			DiceParser.setEngine("earley")
@@ -0,0 +1,131 @@
+import unittest
+
+from DiceParser import budgetedParse
+import render
+from render import MESSAGE_LIMIT, ELLIPSIS, Output, fit, fitEchoed, formatList, splitMessage
+
+
+class Test_formatList(unittest.TestCase):
+	def test_listThatFits_isFormattedWhole(self):
+		with render.limit(Output(100)) as output:
+			self.assertEqual(formatList([3, 1, 4], 3), "[3, 1, 4]")
+			self.assertEqual(output.characters, 91)
+
+	def test_unlimitedOutput_formatsEverything(self):
+		self.assertEqual(formatList(list(range(5000)), 6), str(list(range(5000))))
+
+	def test_longList_showsStartAndEnd(self):
+		with render.limit(Output(60)):
+			text = formatList(list(range(1, 101)), 5)
+		self.assertTrue(text.startswith("[1, 2, 3, "), text)
+		self.assertTrue(text.endswith(", 99, 100]"), text)
+		self.assertIn(f"{ELLIPSIS} 91 more {ELLIPSIS}", text)
+		self.assertLessEqual(len(text), 60)
+
+	def test_spentOutput_countsRolls_untilItCanNot(self):
+		with render.limit(Output(20)) as output:
+			self.assertEqual(formatList(list(range(100)), 4), f"[{ELLIPSIS} 100 rolls {ELLIPSIS}]")
+			self.assertEqual(formatList(list(range(7)), 3), f"[{ELLIPSIS}]")
+			self.assertEqual(output.characters, 2)
+
+	def test_spentRoomForResults_shrinksListsToEllipsis(self):
+		with render.limit(Output(200)) as output:
+			output.reserveEchoed(120, results=2)
+			self.assertEqual(output.resultRoom, 2 * render.RESULT_WIDTH)
+			output.spend(" " * output.characters)
+			self.assertEqual(formatList(list(range(100)), 4), f"[{ELLIPSIS} 100 rolls {ELLIPSIS}]")
+			self.assertEqual(output.spendResult(" = 4950"), " = 4950")
+			self.assertEqual(formatList(list(range(100)), 4), f"[{ELLIPSIS} 100 rolls {ELLIPSIS}]")
+			self.assertEqual(formatList(list(range(100)), 4), f"[{ELLIPSIS}]")
+			self.assertEqual((output.characters, output.resultRoom), (0, 8))
+
+
+class Test_fitEchoed(unittest.TestCase):
+	def test_partsThatFit_areKept(self):
+		with render.limit(Output(20)):
+			self.assertEqual(fitEchoed(("roll ", "[3, 4] = 7"), [True, False]), ("roll ", "[3, 4] = 7"))
+
+	def test_middleOfEchoedText_isElided(self):
+		with render.limit(Output(30)) as output:
+			output.reserve("Bob -- ")
+			texts = fitEchoed(("a" * 40, "[3, 4] = 7", " bb"), [True, False, True])
+		self.assertEqual(texts, [f"aaaaaa{ELLIPSIS}aaa", "[3, 4] = 7", " bb"])
+
+	def test_manyShortEchoedParts_loseOneSpan(self):
+		texts = ("4", " ") * 1000
+		with render.limit(Output(MESSAGE_LIMIT)) as output:
+			output.reserve("Bob -- ")
+			fitted = fitEchoed(texts, [text == " " for text in texts])
+		reply = "".join(fitted)
+		self.assertEqual(len(reply), MESSAGE_LIMIT - len("Bob -- "))
+		self.assertEqual(reply.count(ELLIPSIS), 1)
+		self.assertEqual(reply.count(" "), 1000 - len("Bob -- ") - len(ELLIPSIS))
+		self.assertTrue(reply.startswith("4 4 4 ") and reply.endswith(" 4 4 4 "), reply)
+		self.assertRegex(reply, rf"^(4 )+4*{ELLIPSIS}4*( 4)+ $")
+
+	def test_results_areNeverShortened(self):
+		with render.limit(Output(10)):
+			self.assertEqual(fitEchoed(("a" * 5, "[3, 4] = 7"), [True, False]), ["", "[3, 4] = 7"])
+
+	def test_tooManyResults_mergeFromTheMiddle(self):
+		texts = [f"[{i}] = {i}" for i in range(10, 20)]
+		with render.limit(Output(50)):
+			fitted = fitEchoed(texts, [False] * len(texts))
+		self.assertEqual(fitted, texts[:2] + [f"{ELLIPSIS} 6 more {ELLIPSIS}"] + texts[8:])
+		self.assertLessEqual(len("".join(fitted)), 50)
+
+
+class Test_fit(unittest.TestCase):
+	def tearDown(self):
+		render.setSplit(False)
+
+	def test_shortReply_isOneMessage(self):
+		self.assertEqual(fit("Bob -- 12"), ["Bob -- 12"])
+		self.assertEqual(fit(["a", "b"]), ["a", "b"])
+
+	def test_longReply_isCutShort(self):
+		messages = fit("x" * 5000)
+		self.assertEqual(len(messages), 1)
+		self.assertEqual(len(messages[0]), MESSAGE_LIMIT)
+		self.assertTrue(messages[0].endswith(ELLIPSIS))
+
+	def test_longReply_isSplit_whenRepliesAreSplit(self):
+		render.setSplit(True)
+		messages = fit("word " * 1000)
+		self.assertEqual(len(messages), 3)
+		self.assertTrue(all(len(message) <= MESSAGE_LIMIT for message in messages))
+		self.assertEqual(" ".join(messages).strip(), ("word " * 1000).strip())
+
+	def test_splitMessage_prefersLineBreaks_andStopsAtCount(self):
+		self.assertEqual(splitMessage("aaaa bb\ncc dd", 8), ["aaaa bb", "cc dd"])
+		self.assertEqual(splitMessage("abcdefghij", 4), ["abcd", "efgh", "ij"])
+		self.assertEqual(splitMessage("abcdefghij", 4, 2), ["abcd", f"efg{ELLIPSIS}"])
+
+
+class Test_budgetedRender(unittest.TestCase):
+	def tearDown(self):
+		render.setSplit(False)
+
+	def test_hugePools_fitInOneReply(self):
+		text = budgetedParse("hits for 900d6 then 800d6 and d20+2")
+		self.assertLessEqual(len(text), MESSAGE_LIMIT + 100)
+		self.assertIn(f"[{ELLIPSIS} 800 rolls {ELLIPSIS}]", text)
+		self.assertRegex(text, r"and \d+\+2 = \d+$")
+
+	def test_longMessageEndingInRoll_keepsTheResult(self):
+		text = budgetedParse("x" * 1990 + " 3d6")
+		self.assertLessEqual(len(text), MESSAGE_LIMIT)
+		self.assertEqual(fit(text), [text])
+		self.assertIn(ELLIPSIS, text)
+		self.assertRegex(text, r"^x+…x+ \[\d, \d, \d] = \d+$")
+
+	def test_manyPools_keepTheirFinalResults(self):
+		text = budgetedParse("100d6 " * 40 + "and d20+2")
+		self.assertEqual(fit(text), [text])
+		self.assertIn(f"[{ELLIPSIS} 100 rolls {ELLIPSIS}]", text)
+		self.assertRegex(text, r"\] = \d+ and \d+\+2 = \d+$")
+
+	def test_splitReplies_showMoreRolls(self):
+		short = budgetedParse("900d6 and 900d6")
+		render.setSplit(True)
+		self.assertGreater(len(budgetedParse("900d6 and 900d6")), 2 * len(short))
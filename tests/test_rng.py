@@ -0,0 +1,127 @@
+from collections import Counter
+from math import sqrt
+import unittest
+
+import rolling
+from rng import DiceRandom, SecureDiceRandom, numpy, wordBytes
+
+ROLLS = 60000
+BUCKETS = 50
+SIDES = (2, 3, 6, 7, 20, 100, 255, 256, 1000, 65537, 2**40, 2**70)
+
+
+def chiSquareLimit(degrees, z=3.72):
+	"""Returns the chi-square statistic that uniform rolls only exceed once in ten thousand runs,
+	by the Wilson-Hilferty approximation."""
+	return degrees * (1 - 2 / (9 * degrees) + z * sqrt(2 / (9 * degrees))) ** 3
+
+
+def chiSquare(rolls, numSides):
+	"""Returns the chi-square statistic of rolls against a uniform die, and its degrees of freedom,
+	grouping the faces of big dice into BUCKETS equal ranges."""
+	buckets = min(numSides, BUCKETS)
+	counts = Counter((roll - 1) * buckets // numSides for roll in rolls)
+	expected = [
+		len(rolls) * (-(-(numSides * (i + 1)) // buckets) - -(-(numSides * i) // buckets)) / numSides
+		for i in range(buckets)
+	]
+	return sum((counts[i] - expected[i]) ** 2 / expected[i] for i in range(buckets)), buckets - 1
+
+
+class TestDiceRandom(unittest.TestCase):
+	def assertUniform(self, rolls, numSides):
+		self.assertEqual(len(rolls), ROLLS)
+		self.assertTrue(all(1 <= roll <= numSides for roll in rolls), f"{numSides=}")
+		statistic, degrees = chiSquare(rolls, numSides)
+		self.assertLess(statistic, chiSquareLimit(degrees), f"{numSides=}")
+
+	def test_rolls_areUniform(self):
+		for numSides in SIDES:
+			self.assertUniform(DiceRandom(numSides).rolls(numSides, ROLLS), numSides)
+
+	@unittest.skipUnless(numpy, "numpy is not installed")
+	def test_array_isUniform(self):
+		for numSides in SIDES:
+			self.assertUniform(DiceRandom(numSides).array(numSides, ROLLS).tolist(), numSides)
+
+	@unittest.skipUnless(numpy, "numpy is not installed")
+	def test_array_rollsTheSameDiceAsRolls(self):
+		for numSides in (6, 255, 1000, 65537):
+			self.assertEqual(DiceRandom(1).array(numSides, 500).tolist(), DiceRandom(1).rolls(numSides, 500))
+
+	def test_rolls_ofOneSidedDie_areOne(self):
+		self.assertEqual(DiceRandom().rolls(1, 3), [1, 1, 1])
+
+	def test_sameSeed_rollsSameDice(self):
+		first, second = DiceRandom(5), DiceRandom(5)
+		for numSides in (6, 20, 2**70):
+			self.assertEqual(first.rolls(numSides, 1000), second.rolls(numSides, 1000))
+		self.assertNotEqual(DiceRandom(5).rolls(20, 100), DiceRandom(6).rolls(20, 100))
+
+	def test_take_spansRefillsOfTheBuffer(self):
+		source, refills = DiceRandom(3, bufferBytes=10), DiceRandom(3)
+		taken = source.take(7) + source.take(7) + source.take(6)
+		self.assertEqual(taken, refills.randomBytes(10) + refills.randomBytes(10))
+		self.assertEqual(len(source.take(25)), 25)
+
+	def test_wordBytes_isSmallestWordHoldingSides(self):
+		self.assertEqual(wordBytes(2), 1)
+		self.assertEqual(wordBytes(255), 1)
+		self.assertEqual(wordBytes(256), 2)
+		self.assertEqual(wordBytes(65537), 4)
+		self.assertEqual(wordBytes(2**40), 8)
+		self.assertIsNone(wordBytes(2**64))
+
+	def test_binomial_hasMeanAndVarianceOfBinomial(self):
+		source = DiceRandom(2)
+		for trials, chance in ((20, 0.1), (100, 0.3), (10**6, 1 / 6), (50, 0.9)):
+			draws = [source.binomial(trials, chance) for i in range(20000)]
+			mean = sum(draws) / len(draws)
+			variance = sum((draw - mean) ** 2 for draw in draws) / (len(draws) - 1)
+			expected = trials * chance * (1 - chance)
+			self.assertAlmostEqual(mean, trials * chance, delta=5 * sqrt(expected / len(draws)), msg=f"{trials=}")
+			self.assertAlmostEqual(variance, expected, delta=0.05 * expected, msg=f"{trials=}")
+			self.assertTrue(all(0 <= draw <= trials for draw in draws))
+
+	def test_counts_areUniform(self):
+		source = DiceRandom(3)
+		for numSides in (2, 6, 20, 100):
+			counts = source.counts(numSides, ROLLS)
+			self.assertEqual(sum(counts), ROLLS)
+			expected = ROLLS / numSides
+			statistic = sum((count - expected) ** 2 / expected for count in counts)
+			self.assertLess(statistic, chiSquareLimit(numSides - 1), f"{numSides=}")
+
+	def test_secure_rollsInRange(self):
+		source = SecureDiceRandom()
+		for numSides in (2, 20, 65537, 2**70):
+			self.assertTrue(all(1 <= roll <= numSides for roll in source.rolls(numSides, 1000)), f"{numSides=}")
+
+
+class TestSources(unittest.TestCase):
+	def tearDown(self):
+		rolling.setSource()
+
+	def test_using_rollsFromItsSourceOnlyOnItsThread(self):
+		shared = rolling.current()
+		with rolling.using(DiceRandom(9)) as source:
+			self.assertIs(rolling.current(), source)
+			with rolling.using(DiceRandom(10)) as inner:
+				self.assertIs(rolling.current(), inner)
+			self.assertIs(rolling.current(), source)
+		self.assertIs(rolling.current(), shared)
+
+	def test_using_seededSource_replaysRolls(self):
+		tok = dict(numDice=50, numSides=20, range=rolling.HIGHEST, rangeSize=50)
+		with rolling.using(DiceRandom(4)):
+			first = rolling.rollDice(tok)
+		with rolling.using(DiceRandom(4)):
+			self.assertEqual(rolling.rollDice(tok), first)
+
+	def test_setSource_refusesToSeedSecureSource(self):
+		rolling.setSource(rolling.SECURE)
+		self.assertTrue(rolling.current().secure)
+		with self.assertRaises(ValueError):
+			rolling.setSource(rolling.SECURE, 1)
+		with self.assertRaises(ValueError):
+			rolling.setSource("dice bag")
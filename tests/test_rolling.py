@@ -0,0 +1,107 @@
+import unittest
+from unittest.mock import patch
+
+from budget import Budget, limit, ParserTimeoutError
+from DiceParser import lexer
+import rolling
+from rolling import (
+	HIGHEST, LOWEST,
+	countedKeptSum,
+	keptSum,
+	numpy,
+	rollDice,
+	setBackend,
+	vectorisedKeptSum,
+)
+
+
+class Test_keptSum(unittest.TestCase):
+	def test_sumsKeptDice(self):
+		for rolls, keep, keepSize, expected in (
+			([], HIGHEST, 0, 0),
+			([4], HIGHEST, 1, 4),
+			([4], LOWEST, 0, 0),
+			([2, 6, 3, 5], HIGHEST, 3, 14),
+			([2, 6, 3, 5], LOWEST, 3, 10),
+			([2, 6, 3, 5], HIGHEST, 4, 16),
+			([2, 6, 3, 5], LOWEST, 1, 2),
+			([1, 1, 20, 20], HIGHEST, 2, 40),
+		):
+			self.assertEqual(keptSum(rolls, keep, keepSize), expected, f"{rolls=} {keep=} {keepSize=}")
+
+	@unittest.skipUnless(numpy, "numpy is not installed")
+	def test_vectorisedKeptSum_matchesSortedSelection(self):
+		generator = numpy.random.default_rng(8)
+		for numDice in (32, 33, 100, 1000):
+			rolls = generator.integers(1, 20, size=numDice, endpoint=True)
+			for keep in (HIGHEST, LOWEST):
+				for keepSize in (0, 1, 2, numDice // 2, numDice - 1, numDice):
+					self.assertEqual(
+						vectorisedKeptSum(rolls.copy(), keep, keepSize),
+						keptSum(rolls.tolist(), keep, keepSize),
+						f"{numDice=} {keep=} {keepSize=}",
+					)
+
+
+class Test_rollDice(unittest.TestCase):
+	def tearDown(self):
+		setBackend(rolling.NUMPY if numpy else rolling.PYTHON)
+
+	def test_rejectsUnknownBackend(self):
+		with self.assertRaises(ValueError):
+			setBackend("abacus")
+
+	def test_everyDiceCode_rollsWithinRange_onEveryBackend(self):
+		backends = [rolling.PYTHON] + ([rolling.NUMPY] if numpy else [])
+		for backend in backends:
+			setBackend(backend)
+			for code in (
+				"40d6", "40d6kh3", "40d6kl3", "40d6dh3", "40d6dl3",
+				"40d6k3", "40d6d3", "40d6h3", "40d6l3", "40d6kh", "40d6dl",
+				"40d20adv", "40d20dis", "40d6k50", "999d6kh10",
+			):
+				lexer.input(code)
+				tok = lexer.token().value
+				res = rollDice(tok)
+				self.assertTrue(
+					tok['rangeSize'] <= res['result'] <= tok['rangeSize'] * tok['numSides'],
+					f"{code} rolled {res['result']} with the {backend} backend",
+				)
+				self.assertEqual(res['text'].count(",") + 1, tok['numDice'])
+
+	@unittest.skipUnless(numpy, "numpy is not installed")
+	@patch.object(rolling, "COUNTED_POOL_SIZE", float("inf"))
+	def test_vectorisedPool_coversEveryFaceEvenly(self):
+		setBackend(rolling.NUMPY)
+		res = rollDice(dict(numDice=60000, numSides=6, range=HIGHEST, rangeSize=60000))
+		rolls = [int(roll) for roll in res['text'][1:-1].split(", ")]
+		for face in range(1, 7):
+			self.assertAlmostEqual(rolls.count(face), 10000, delta=500)
+		self.assertEqual(res['result'], sum(rolls))
+
+
+class Test_rollCounted(unittest.TestCase):
+	def test_countedKeptSum_matchesSortedSelection(self):
+		rolls = [3, 1, 4, 1, 5, 2, 6, 5, 3, 5]
+		counts = [rolls.count(face) for face in range(1, 7)]
+		for keep in (HIGHEST, LOWEST):
+			for keepSize in range(len(rolls) + 1):
+				self.assertEqual(countedKeptSum(counts, keep, keepSize), keptSum(rolls, keep, keepSize))
+
+	def test_bigPool_isRenderedAsCountsOfEachFace(self):
+		res = rollDice(dict(numDice=60000, numSides=6, range=HIGHEST, rangeSize=60000))
+		counts = dict(part.split("×") for part in res['text'][1:-1].split(", "))
+		self.assertEqual(list(counts), ["6", "5", "4", "3", "2", "1"])
+		for count in counts.values():
+			self.assertAlmostEqual(int(count), 10000, delta=500)
+		self.assertEqual(res['result'], sum(int(face) * int(count) for face, count in counts.items()))
+
+	def test_bigPool_costsOneDiePerSide(self):
+		with limit(Budget(dice=6)) as budget:
+			res = rollDice(dict(numDice=10**8, numSides=6, range=LOWEST, rangeSize=3))
+		self.assertEqual(budget.dice, 0)
+		self.assertEqual(res['result'], 3)
+
+	def test_whenPoolIsOverMaximum_thenRaises(self):
+		with self.assertRaises(ParserTimeoutError):
+			rollDice(dict(numDice=rolling.MAX_COUNTED_DICE + 1, numSides=6, range=HIGHEST, rangeSize=1))
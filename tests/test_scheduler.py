@@ -0,0 +1,74 @@
+import asyncio
+import unittest
+
+import metrics
+import scheduler
+from scheduler import Scheduler, QUEUED, BUSY, DROPPED
+
+
+class TestScheduler(unittest.IsolatedAsyncioTestCase):
+	def setUp(self):
+		metrics.reset()
+		self.handled = []
+		self.release = asyncio.Event()
+
+	def tearDown(self):
+		metrics.reset()
+
+	async def handle(self, job):
+		await self.release.wait()
+		self.handled.append(job)
+
+	async def drain(self, jobs):
+		self.release.set()
+		while len(self.handled) < jobs:
+			await asyncio.sleep(0)
+
+	async def test_workers_takeTurnsBetweenQueues(self):
+		queues = Scheduler(self.handle, workers=1)
+		for i in range(4):
+			queues.submit("busy", f"busy {i}")
+		queues.submit("quiet", "quiet 0")
+		queues.submit("other", "other 0")
+		queues.start()
+		await self.drain(6)
+		queues.close()
+		self.assertEqual(self.handled, ["busy 0", "quiet 0", "other 0", "busy 1", "busy 2", "busy 3"])
+
+	async def test_queue_isHandledInOrder_byOneWorkerAtATime(self):
+		queues = Scheduler(self.handle, workers=4)
+		queues.start()
+		for i in range(6):
+			queues.submit("channel", i)
+		await asyncio.sleep(0)
+		self.assertEqual(queues.stats()["depth"], 5)
+		await self.drain(6)
+		queues.close()
+		self.assertEqual(self.handled, list(range(6)))
+		self.assertEqual(queues.stats(), dict(queues=0, depth=0, deepest=0, workers=0))
+		self.assertEqual(metrics.stages["queue"].count, 6)
+
+	async def test_fullQueue_isBusyOnce_thenDrops_untilItEmpties(self):
+		queues = Scheduler(self.handle, workers=1, queueSize=2)
+		self.assertEqual([queues.submit("channel", i) for i in range(4)], [QUEUED, QUEUED, BUSY, DROPPED])
+		self.assertEqual(queues.submit("other", 0), QUEUED)
+		self.assertEqual(metrics.counters["dropped"].value, 2)
+		queues.start()
+		await self.drain(3)
+		queues.close()
+		self.assertEqual(queues.submit("channel", 5), QUEUED)
+
+	async def test_failingJob_doesNotStopItsWorker(self):
+		async def handle(job):
+			if job == "fails":
+				raise ValueError(job)
+			self.handled.append(job)
+
+		queues = Scheduler(handle, workers=1)
+		queues.start()
+		queues.submit("channel", "fails")
+		queues.submit("channel", "works")
+		with self.assertLogs(scheduler.log, "DEBUG"):
+			await self.drain(1)
+		queues.close()
+		self.assertEqual(self.handled, ["works"])
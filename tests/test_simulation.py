@@ -0,0 +1,118 @@
+from math import isnan
+import unittest
+from unittest.mock import patch
+
+from DiceParser import compileExpression
+from rng import DiceRandom
+import rolling
+from rolling import numpy
+from simulation import (
+	countDice,
+	simulate,
+	trialCap,
+	MAX_SIMULATED_DICE,
+	SAMPLE_BYTES,
+	NumpySampler,
+	PythonSampler,
+	Simulation,
+)
+from expression import fold
+
+
+class Test_simulate(unittest.TestCase):
+	def samplers(self):
+		return [PythonSampler] + ([NumpySampler] if numpy else [])
+
+	def test_everySampler_estimatesTheMean(self):
+		for sampler in self.samplers():
+			for text, mean in (
+				("4d6kh3", 12.24),
+				("d20adv+5", 18.82),
+				("d20dis", 7.18),
+				("8d6/2", 14),
+				("-d4*2", -5),
+				("(2d6-1)", 6),
+				("3", 3),
+			):
+				node = compileExpression(text).numeric
+				sample = sampler(20000, 3)
+				simulation = Simulation(sample.results(fold(node, sample.visit)))
+				self.assertAlmostEqual(simulation.mean, mean, delta=0.2, msg=f"{text} with {sampler.__name__}")
+
+	def test_resultsStayWithinRange(self):
+		simulation = simulate(compileExpression("3d6kl2"), 1000, seed=1)
+		self.assertEqual(simulation.trials, 1000)
+		self.assertGreaterEqual(simulation.results[0], 2)
+		self.assertLessEqual(simulation.results[-1], 12)
+
+	def test_divisionByZero_isCountedAsUndefined(self):
+		for sampler in self.samplers():
+			sample = sampler(10000, 5)
+			node = compileExpression("d6/(d2-1)").numeric
+			simulation = Simulation(sample.results(fold(node, sample.visit)))
+			self.assertAlmostEqual(simulation.undefined / simulation.trials, 0.5, delta=0.03)
+			self.assertFalse(any(isnan(result) for result in simulation.results))
+
+	def test_seededSimulations_repeat(self):
+		node = compileExpression("4d6kh3")
+		self.assertEqual(simulate(node, 100, seed=9).results, simulate(node, 100, seed=9).results)
+
+	def test_simulations_areSeededFromTheSourceOfRandomness(self):
+		node = compileExpression("4d6kh3 + d20")
+		with rolling.using(DiceRandom(4)):
+			first = simulate(node, 100).results
+		with rolling.using(DiceRandom(4)):
+			self.assertEqual(simulate(node, 100).results, first)
+		with rolling.using(DiceRandom(5)):
+			self.assertNotEqual(simulate(node, 100).results, first)
+
+	def test_diceTooBigForAnInt64_areStillSampled(self):
+		for text in ("d100000000000000000000", "3d5000000000000000000"):
+			simulation = simulate(compileExpression(text), 100, seed=2)
+			self.assertEqual(simulation.trials, 100, text)
+			self.assertGreaterEqual(simulation.results[0], 1, text)
+
+	@unittest.skipIf(numpy is None, "numpy is not installed")
+	def test_rollsAreSampledAFewTrialsAtATime(self):
+		for text, mean in (("10d6", 35), ("10d6kh5", 24.4), ("10d6kl1", 1.26)):
+			sample = NumpySampler(4000, 4)
+			with patch("simulation.SAMPLE_BYTES", 8 * 30):
+				simulation = Simulation(sample.results(fold(compileExpression(text).numeric, sample.visit)))
+			self.assertEqual(simulation.trials, 4000)
+			self.assertAlmostEqual(simulation.mean, mean, delta=0.3, msg=text)
+
+	@unittest.skipIf(numpy is None, "numpy is not installed")
+	def test_bigPools_areSampledAsCountsOfEachFace(self):
+		for text, result in (("3200d2kh100", 200), ("3200d2kl100", 100), ("1000d1kh500", 500)):
+			self.assertEqual(set(simulate(compileExpression(text), 50, seed=3).results), {result}, text)
+		simulation = simulate(compileExpression("2000d6"), 200, seed=3)
+		self.assertAlmostEqual(simulation.mean, 7000, delta=15)
+
+
+class Test_trialCap(unittest.TestCase):
+	def test_capsTrialsByDiceRolled(self):
+		self.assertEqual(countDice(compileExpression("4d6kh3 + d20adv * 3").numeric), 6)
+		self.assertEqual(trialCap(compileExpression("1000000d6").numeric), MAX_SIMULATED_DICE // 1000000)
+		self.assertEqual(trialCap(compileExpression("1000000000d6").numeric), 0)
+
+	@unittest.skipIf(numpy is None, "numpy is not installed")
+	def test_capsTrialsByBytesOfOneTrial(self):
+		dice = SAMPLE_BYTES // 8 + 1
+		self.assertEqual(trialCap(compileExpression(f"{dice}d1000000kh5").numeric), 0)
+		self.assertGreater(trialCap(compileExpression(f"{dice}d1000000").numeric), 0)
+		self.assertGreater(trialCap(compileExpression("1000000d6kh500000").numeric), 0)
+
+
+class Test_histogram(unittest.TestCase):
+	def test_wholeNumbers_getOneBarEach(self):
+		histogram = Simulation([1, 2, 2, 3, 3, 3]).histogram()
+		self.assertEqual(histogram, [(1, 2, 1), (2, 3, 2), (3, 4, 3)])
+
+	def test_wideRanges_areSplitIntoEqualBars(self):
+		histogram = Simulation(list(range(100))).histogram(bars=4)
+		self.assertEqual([count for low, high, count in histogram], [25, 25, 25, 25])
+		self.assertEqual(histogram[0][0], 0)
+		self.assertEqual(histogram[-1][1], 99)
+
+	def test_constantResults_getOneBar(self):
+		self.assertEqual(Simulation([2.5] * 4).histogram(), [(2.5, 2.5, 4)])
@@ -0,0 +1,67 @@
+import re
+import unittest
+
+from budget import ParserTimeoutError
+import metrics
+import mice
+from workers import Author, EvaluationPool
+
+
+class Test_EvaluationPool(unittest.IsolatedAsyncioTestCase):
+	async def asyncSetUp(self):
+		self.pool = EvaluationPool(size=2, deadline=5)
+		self.pool.start()
+		self.author = Author(1, "bert")
+
+	async def asyncTearDown(self):
+		self.pool.close()
+
+	async def test_repliesFromWorker(self):
+		reply = await self.pool.evaluate(self.author, "hit for d1+3")
+		self.assertEqual(reply, "bert -- hit for 1+3 = 4")
+
+	async def test_mergesMetricsRecordedInWorker(self):
+		rolls = metrics.stages["roll"].count
+		await self.pool.evaluate(self.author, "hit for d1+3 and d4")
+		self.assertEqual(metrics.stages["roll"].count - rolls, 2)
+
+	async def test_mergesHistoryRecordedInWorker(self):
+		mice.history.clear()
+		await self.pool.evaluate(self.author, "hit for d1+3")
+		self.assertEqual(mice.history.last(self.author.id).text, "hit for d1+3")
+		self.assertEqual(mice.handleReroll(self.author, "!!", ""), "bert -- hit for 1+3 = 4")
+		mice.history.clear()
+
+	async def test_workersShareTheSettingsOfTheBot(self):
+		self.pool.close()
+		mice.admins.add(self.author.id)
+		try:
+			self.pool = EvaluationPool(size=1, deadline=5)
+			self.pool.start()
+			reply = await self.pool.evaluate(self.author, "!metrics")
+		finally:
+			mice.admins.discard(self.author.id)
+		self.assertTrue(reply.startswith("bert -- metrics since the bot started:"), reply)
+		self.assertEqual(self.pool.context.get_start_method(), "forkserver")
+
+	async def test_whenMessageHasNoDice_thenRepliesNone(self):
+		self.assertIsNone(await self.pool.evaluate(self.author, "hello world"))
+
+	async def test_whenBudgetIsExceeded_thenRaisesInParent(self):
+		with self.assertRaises(ParserTimeoutError):
+			await self.pool.evaluate(self.author, "1000000d1000000h1")
+		self.assertTrue(all(worker.process.is_alive() for worker in self.pool.workers))
+
+	async def test_whenDeadlineIsMissed_thenWorkerIsKilledAndReplaced(self):
+		self.pool.deadline = 0.001
+		old = set(worker.process.pid for worker in self.pool.workers)
+		with self.assertLogs("workers", "WARNING"):
+			with self.assertRaises(ParserTimeoutError):
+				await self.pool.evaluate(self.author, "d20 " * 5000)
+		new = set(worker.process.pid for worker in self.pool.workers)
+		self.assertEqual(len(old - new), 1)
+		self.assertEqual(len(new), 2)
+		self.pool.deadline = 5
+		for i in range(4):
+			reply = await self.pool.evaluate(self.author, "d6")
+			self.assertRegex(reply, re.compile(r"^bert -- [1-6]$"))
@@ -0,0 +1,178 @@
+# Workers
+# evaluates messages in a pool of worker processes, so an expensive message never stalls the gateway's event loop
+# workers are forked by a fork server that has only imported the modules of PRELOAD, grammar tables included,
+# so every worker is warm before its first message, and none is forked from a process whose threads may hold locks,
+# like the bot once it runs, which replaces workers long after its threads have started
+# a worker inherits none of the bot's settings from the fork server, so they are sent to every worker it starts
+# each job has a hard deadline on top of the cooperative budget,
+# and a worker that overruns it is killed and replaced, so its work never continues anywhere else
+# the fork server needs a platform with fork
+
+import asyncio
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import multiprocessing
+
+import audit
+import database
+import DiceParser
+import metrics
+from budget import ParserTimeoutError
+import mice
+import render
+import rolling
+
+POOL_SIZE = 2
+DEADLINE_SECONDS = 5
+STOP_SECONDS = 1
+PRELOAD = ["workers", "pratt"]
+
+log = logging.getLogger(__name__)
+Author = namedtuple("Author", "id display_name")
+
+
+class WorkerError(Exception):
+	pass
+
+
+def settings():
+	"""The settings of this process that its workers have to share."""
+	return dict(
+		auditPath=audit.auditLog.path,
+		granularity=audit.auditLog.granularity,
+		databaseUrl=str(database.engine.url),
+		engine=DiceParser.engine,
+		secure=rolling.source.secure,
+		admins=set(mice.admins),
+		split=render.split,
+	)
+
+
+def serve(connection, settings):
+	"""Handles messages sent over connection until it is closed, with the settings of the bot,
+	replying with (reply, error, drained metrics, drained history) tuples."""
+	# each worker writes its own records, to the audit file of the bot
+	audit.configure(settings["auditPath"], settings["granularity"])
+	database.configure(settings["databaseUrl"])
+	DiceParser.setEngine(settings["engine"])
+	# the source is not seeded, so no two workers ever roll the same dice
+	rolling.setSource(rolling.SECURE if settings["secure"] else rolling.FAST)
+	mice.admins.update(settings["admins"])
+	render.setSplit(settings["split"])
+	# each worker would index aliases separately, and miss the changes that other workers make to them
+	mice.aliasIndex = mice.AliasIndex(maxsize=0)
+	# the bot keeps the history, so that any worker's rolls can be rolled again
+	mice.history = mice.HistoryJournal()
+	# the bot merges what each worker records into its own metrics, so a worker starts from nothing
+	metrics.reset()
+	try:
+		while True:
+			try:
+				job = connection.recv()
+			except EOFError:
+				return
+			if job is None:
+				return
+			authorId, displayName, content = job
+			try:
+				reply = mice.handleInput(Author(authorId, displayName), content)
+				connection.send((reply, None, metrics.drain(), mice.history.drain()))
+			except ParserTimeoutError as e:
+				connection.send((None, e, metrics.drain(), mice.history.drain()))
+			except Exception as e:
+				connection.send((None, WorkerError(repr(e)), metrics.drain(), mice.history.drain()))
+	finally:
+		audit.auditLog.close()
+
+
+class Worker:
+	def __init__(self, context):
+		self.connection, child = context.Pipe()
+		self.process = context.Process(
+			target=serve,
+			args=(child, settings()),
+			name="dice worker",
+			daemon=True,
+		)
+		self.process.start()
+		child.close()
+
+	def kill(self):
+		self.process.kill()
+		self.process.join()
+		self.connection.close()
+
+	def stop(self):
+		try:
+			self.connection.send(None)
+		except OSError:
+			pass
+		self.process.join(STOP_SECONDS)
+		if self.process.is_alive():
+			self.process.kill()
+			self.process.join()
+		self.connection.close()
+
+
+class EvaluationPool:
+	"""A pool of worker processes that handle messages, awaited from the event loop.
+	Start the pool from inside the event loop that will await it."""
+
+	def __init__(self, size=POOL_SIZE, deadline=DEADLINE_SECONDS):
+		if size < 1:
+			raise ValueError("An evaluation pool needs at least one worker.")
+		self.size = size
+		self.deadline = deadline
+		self.context = multiprocessing.get_context("forkserver")
+		self.context.set_forkserver_preload(PRELOAD)
+		self.readers = ThreadPoolExecutor(size, thread_name_prefix="worker reader")
+		self.workers = []
+		self.idle = None
+
+	def start(self):
+		self.idle = asyncio.Queue()
+		for i in range(self.size):
+			worker = Worker(self.context)
+			self.workers.append(worker)
+			self.idle.put_nowait(worker)
+		log.info(f"Started {self.size} evaluation workers.")
+
+	async def evaluate(self, author, content):
+		"""Handles content from author in a worker, and returns the reply.
+		Raises ParserTimeoutError if the worker misses the deadline, after replacing it."""
+		worker = await self.idle.get()
+		loop = asyncio.get_running_loop()
+		try:
+			worker.connection.send((author.id, author.display_name, content))
+			reply, error, recorded, rolled = await asyncio.wait_for(
+				loop.run_in_executor(self.readers, worker.connection.recv),
+				self.deadline,
+			)
+		except asyncio.TimeoutError:
+			log.warning(f"Killed worker {worker.process.pid} after it missed the {self.deadline} second deadline.")
+			worker = self.replace(worker)
+			raise ParserTimeoutError(f"Exceeded the deadline of {self.deadline} seconds for evaluating.") from None
+		except BaseException:
+			# the worker may still be busy with this job, so it can never take another
+			worker = self.replace(worker)
+			raise
+		finally:
+			self.idle.put_nowait(worker)
+		metrics.merge(recorded)
+		mice.history.merge(rolled)
+		if error is not None:
+			raise error
+		return reply
+
+	def replace(self, worker):
+		worker.kill()
+		replacement = Worker(self.context)
+		self.workers[self.workers.index(worker)] = replacement
+		return replacement
+
+	def close(self):
+		for worker in self.workers:
+			worker.stop()
+		self.workers = []
+		self.readers.shutdown(wait=False)